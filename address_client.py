@@ -0,0 +1,181 @@
+"""
+Async batched client for the short-address API.
+
+The API payload is a keyed map ({"1": {"location": ...}, "2": ...}), so one
+POST can carry many centroids. Lookups are queued and sent in batches over a
+pooled keep-alive session, with a cap on concurrent requests, a request rate
+limit and retries with exponential backoff. Asking for a key that is already
+in flight waits on the same request instead of sending another one.
+
+Needs aiohttp.
+"""
+import asyncio
+import json
+import random
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# API Configuration
+API_URL = "http://34.80.56.250:8080/api/v1/shortaddress"
+HEADERS = {
+    'Content-Type': 'application/json',
+    'Authorization': 'nisuecb'
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class _RateLimiter:
+    """Spaces request starts at least 1/rate seconds apart."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AddressClient:
+    """
+    Use inside a running event loop:
+
+        async with AddressClient(batch_size=50) as client:
+            ok, name = await client.lookup(cell, lat, lon)
+
+    lookup() returns (ok, address): ok is False if the request failed after
+    all retries, address is None if the API had no name for the point.
+    """
+
+    def __init__(self, api_url=API_URL, headers=HEADERS, batch_size=50, concurrency=8, rate=None,
+                 retries=3, backoff=0.5, timeout=10.0, linger=0.005):
+        if aiohttp is None:
+            raise ImportError("AddressClient needs aiohttp: pip install aiohttp")
+        self.api_url = api_url
+        self.headers = headers
+        self.batch_size = max(1, batch_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.linger = linger
+        self.concurrency = concurrency
+        self.rate = rate
+        self.stats = {'lookups': 0, 'deduped': 0, 'requests': 0, 'retries': 0, 'errors': 0}
+        self._inflight = {}
+        self._pending = []
+        self._flush_handle = None
+        self._tasks = set()
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._limiter = _RateLimiter(self.rate)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=30)
+        self._session = aiohttp.ClientSession(
+            connector=connector, headers=self.headers, timeout=aiohttp.ClientTimeout(total=self.timeout)
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._session.close()
+
+    def lookup(self, key, lat, lon):
+        """Returns an awaitable (ok, address) for one point; duplicate keys share a request."""
+        self.stats['lookups'] += 1
+        if key in self._inflight:
+            self.stats['deduped'] += 1
+            return self._inflight[key]
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        self._pending.append((key, float(lat), float(lon)))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            # Give callers a moment to fill the batch before sending a partial one
+            self._flush_handle = asyncio.get_running_loop().call_later(self.linger, self._flush)
+        return future
+
+    async def lookup_many(self, points):
+        """Looks up (key, lat, lon) triples; returns {key: (ok, address)}."""
+        points = list(points)
+        results = await asyncio.gather(*(self.lookup(key, lat, lon) for key, lat, lon in points))
+        return {key: result for (key, _, _), result in zip(points, results)}
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            task = asyncio.ensure_future(self._send(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _post(self, payload):
+        """POSTs one batch with retries; returns the decoded answer or None."""
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.stats['retries'] += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+            try:
+                async with self._semaphore:
+                    await self._limiter.wait()
+                    self.stats['requests'] += 1
+                    async with self._session.post(self.api_url, data=payload) as response:
+                        if response.status == 200:
+                            return await response.json(content_type=None)
+                        if response.status not in RETRY_STATUSES:
+                            return None
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                pass
+        return None
+
+    async def _send(self, batch):
+        payload = json.dumps({
+            str(i): {"location": {"lat": lat, "lon": lon}} for i, (_, lat, lon) in enumerate(batch, 1)
+        })
+        data = None
+        try:
+            data = await self._post(payload)
+        finally:
+            # Always settle the futures, even if the request blew up
+            if data is None:
+                self.stats['errors'] += 1
+            self._resolve(batch, data)
+
+    def _resolve(self, batch, data):
+        for i, (key, _, _) in enumerate(batch, 1):
+            item = data.get(str(i)) if isinstance(data, dict) else None
+            if item is None:
+                # No answer for this key: a failure, not a negative result
+                result = (False, None)
+            else:
+                address = (item.get("short_address") or {}).get("en")
+                result = (True, address if address and address.strip() else None)
+            future = self._inflight.pop(key)
+            if not future.done():
+                future.set_result(result)
+
+
+def fetch_addresses(points, **client_kwargs):
+    """Blocking wrapper: returns ({key: (ok, address)}, client stats) for (key, lat, lon) triples."""
+    async def run():
+        async with AddressClient(**client_kwargs) as client:
+            results = await client.lookup_many(points)
+            return results, client.stats
+    return asyncio.run(run())
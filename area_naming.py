@@ -0,0 +1,112 @@
+"""
+Hierarchy-aware area naming.
+
+Neighbouring hex-8 cells usually share a short address, so instead of
+reverse-geocoding every cell we ask about each coarser parent first: its
+centroid plus a few sampled children. When every probe agrees on one name,
+the rest of that parent's children inherit it. Parents whose probes
+disagree or come back empty fall back to one lookup per cell.
+
+`lookup` is any callable taking [(key, lat, lon), ...] and returning
+{key: (ok, name)}, e.g. the cached, batched lookup in fetch_hex_names.py.
+"""
+import csv
+import numpy as np
+import pandas as pd
+from hex_index import cell_to_parent, cells_to_latlng
+
+# Hex and area-name columns written by fetch_hex_names.py
+NAME_COLUMNS = (('pickup_hex8', 'pickup_area_name'), ('destination_hex8', 'dropoff_area_name'))
+
+
+def name_hierarchically(cells, lookup, parent_res=7, sample=2, validate=0, seed=0):
+    """
+    Names unique `cells` (uint64). Returns (names, report): names is
+    {cell: name or None} for every cell that got an answer, report counts
+    lookups made versus one per cell and, if validate > 0, how often an
+    inherited name matched a direct lookup on that many inherited cells.
+    """
+    cells = np.unique(np.asarray(cells, dtype=np.uint64))
+    rng = np.random.default_rng(seed)
+    frame = pd.DataFrame({'cell': cells, 'parent': cell_to_parent(cells, parent_res)})
+
+    # 1. Choose probes: parent centroid plus up to `sample` children. Small
+    # families are cheaper to look up cell by cell.
+    families = {int(parent): group.tolist() for parent, group in frame.groupby('parent', sort=False)['cell']}
+    probe_children = []
+    direct = []
+    parents = []
+    for parent, children in families.items():
+        if len(children) <= sample + 1:
+            direct.extend(children)
+        else:
+            parents.append(parent)
+            probe_children.append([int(c) for c in rng.choice(children, sample, replace=False)])
+
+    parent_lat, parent_lon = cells_to_latlng(np.array(parents, dtype=np.uint64))
+    probes = [int(c) for group in probe_children for c in group]
+    child_lat, child_lon = cells_to_latlng(np.array(probes, dtype=np.uint64))
+    points = list(zip(parents, parent_lat.tolist(), parent_lon.tolist()))
+    points += list(zip(probes, child_lat.tolist(), child_lon.tolist()))
+    answers = lookup(points) if points else {}
+    lookups = len(points)
+
+    # 2. Parents whose probes all agree on a real name pass it on
+    names = {}
+    inherited = []
+    ambiguous = 0
+    for parent, children in zip(parents, probe_children):
+        probe_answers = [answers.get(parent, (False, None))] + [answers.get(c, (False, None)) for c in children]
+        for c in children:
+            if answers.get(c, (False, None))[0]:
+                names[c] = answers[c][1]
+        agreed = {name for ok, name in probe_answers}
+        if all(ok for ok, _ in probe_answers) and len(agreed) == 1 and None not in agreed:
+            name = agreed.pop()
+            for c in families[parent]:
+                if c not in names:
+                    names[c] = name
+                    inherited.append(c)
+        else:
+            ambiguous += 1
+            direct.extend(c for c in families[parent] if c not in children)
+
+    # 3. Everything else gets its own lookup
+    if direct:
+        lat, lon = cells_to_latlng(np.array(direct, dtype=np.uint64))
+        for cell, (ok, name) in lookup(list(zip(direct, lat.tolist(), lon.tolist()))).items():
+            if ok:
+                names[cell] = name
+        lookups += len(direct)
+
+    report = {
+        'cells': len(cells),
+        'parents_probed': len(parents),
+        'ambiguous_parents': ambiguous,
+        'inherited': len(inherited),
+        'lookups': lookups,
+        'lookups_per_cell_mode': len(cells),
+        'lookups_saved': len(cells) - lookups,
+    }
+
+    # 4. Optionally check inherited names against direct lookups
+    if validate and inherited:
+        check = rng.choice(np.array(inherited, dtype=np.uint64), min(validate, len(inherited)), replace=False)
+        lat, lon = cells_to_latlng(check)
+        truth = lookup(list(zip(check.tolist(), lat.tolist(), lon.tolist())))
+        compared = [(names[c], name) for c, (ok, name) in truth.items() if ok]
+        report['validated'] = len(compared)
+        report['agreement'] = sum(a == b for a, b in compared) / len(compared) if compared else None
+        report['validation_lookups'] = len(check)
+    return names, report
+
+
+def read_names(path):
+    """{cell: area name} from a fetch_hex_names.py output."""
+    names = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            for hex_col, name_col in NAME_COLUMNS:
+                if row.get(hex_col) and row.get(name_col):
+                    names[int(row[hex_col], 16)] = row[name_col]
+    return names
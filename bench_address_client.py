@@ -0,0 +1,91 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from address_client import fetch_addresses
+from fetch_hex_names import get_short_address
+from hex_index import latlng_to_cells, cells_to_latlng
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def stub_stats(base):
+    with urllib.request.urlopen(f"{base}/stats") as r:
+        return json.load(r)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the async short-address client against the thread-pool version.')
+    parser.add_argument('--hexes', type=int, default=2000, help='Distinct hex centroids to name')
+    parser.add_argument('--duplicates', type=float, default=0.3, help='Extra share of repeated lookups')
+    parser.add_argument('--latency_ms', type=float, default=20, help='Latency the stub server adds per request')
+    parser.add_argument('--batch_size', type=int, default=25)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    # Hex-8 centroids over Dhaka, with some lookups repeated
+    rng = np.random.default_rng(args.seed)
+    cells, _ = latlng_to_cells(rng.uniform(23.65, 23.90, args.hexes * 3), rng.uniform(90.33, 90.50, args.hexes * 3), 8)
+    cells = np.unique(cells)[:args.hexes]
+    distinct = len(cells)
+    cells = np.concatenate([cells, rng.choice(cells, int(len(cells) * args.duplicates))])
+    lat, lon = cells_to_latlng(cells)
+    points = list(zip(cells.tolist(), lat.tolist(), lon.tolist()))
+
+    # Run the stand-in API in its own process so it does not share our GIL
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    url = f"{base}/api/v1/shortaddress"
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_address_server.py')
+    server = subprocess.Popen([sys.executable, script, '--port', str(port), '--latency_ms', str(args.latency_ms)],
+                              stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                stub_stats(base)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        print(f"Naming {len(points)} lookups ({distinct} distinct hexes), stub latency {args.latency_ms}ms...")
+        rows = []
+
+        before = stub_stats(base)['requests']
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=10) as executor:
+            thread_results = list(executor.map(lambda p: get_short_address(p[1], p[2], url), points))
+        secs = time.perf_counter() - start
+        requests = stub_stats(base)['requests'] - before
+        rows.append(('thread pool (10)', secs, requests, len({p[0] for p, (ok, _) in zip(points, thread_results) if ok})))
+
+        before = stub_stats(base)['requests']
+        start = time.perf_counter()
+        async_results, _ = fetch_addresses(points, api_url=url, batch_size=args.batch_size, concurrency=args.concurrency)
+        secs = time.perf_counter() - start
+        requests = stub_stats(base)['requests'] - before
+        rows.append((f'async (batch {args.batch_size}, {args.concurrency} conns)', secs, requests,
+                     sum(ok for ok, _ in async_results.values())))
+
+        # Both clients must come back with the same names
+        mismatches = sum(async_results[key] != res for (key, _, _), res in zip(points, thread_results))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print("\n--- Short-address client benchmark ---")
+    print(f"{'client':<32} {'wall s':>8} {'HTTP reqs':>10} {'reqs/s':>8} {'lookups/s':>10} {'named ok':>9}")
+    for name, secs, requests, ok in rows:
+        print(f"{name:<32} {secs:>8.2f} {requests:>10} {requests / secs:>8.0f} {len(points) / secs:>10.0f} {ok:>9}")
+    print(f"Name mismatches between clients: {mismatches}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from hex_index import H3_NULL, get_resolution
+from route_counts import read_counts_csv
+from geo_export import MAX_FLOW_TILES, build_tiles
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the GeoJSON tile pyramid of a route-count table and check its size.')
+    parser.add_argument('input_csv', nargs='?', default='hex8_route_counts.csv', help='Route counts (pickup hex, dropoff hex, ride_count)')
+    parser.add_argument('--min_zoom', type=int, default=9)
+    parser.add_argument('--max_zoom', type=int, default=14)
+    parser.add_argument('--max_flows', type=int, default=500)
+    parser.add_argument('--max_flow_tiles', type=int, default=MAX_FLOW_TILES)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_csv):
+        print(f"Error: {args.input_csv} not found.")
+        return
+    counts = read_counts_csv(args.input_csv)
+    cells = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+    res = int(get_resolution(cells[cells != H3_NULL][:1])[0])
+    print(f"{len(counts)} Hex-{res} routes from {args.input_csv}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tiles')
+        tracemalloc.start()
+        start = time.perf_counter()
+        meta = build_tiles(counts, path, res, args.min_zoom, args.max_zoom, max_flows=args.max_flows,
+                           max_flow_tiles=args.max_flow_tiles)
+        secs = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        largest = 0
+        for folder, _, files in os.walk(os.path.join(path, 'flows')):
+            for name in files:
+                with open(os.path.join(folder, name), encoding='utf-8') as f:
+                    largest = max(largest, len(json.load(f)['features']))
+        size = sum(os.path.getsize(os.path.join(folder, name)) for folder, _, files in os.walk(path) for name in files)
+
+    zooms = args.max_zoom - args.min_zoom + 1
+    print("\n--- Tile pyramid benchmark ---")
+    print(f"Zooms {args.min_zoom}-{args.max_zoom}: {meta['tiles']['hexes']} hex and {meta['tiles']['flows']} flow tiles, "
+          f"{size / 1e6:.1f} MB, in {secs:.2f} s (peak {peak / 1e6:.0f} MB traced)")
+    print(f"Bounds: {meta.get('bounds')}")
+    # Flows are tiled along their lines, so this stays near the hex tiles, not the square of flow length
+    print(f"Flow tiles per route and zoom: {meta['tiles']['flows'] / (len(counts) * zooms):.3f}")
+    print(f"Busiest flow tile: {largest} features (limit {args.max_flows})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import numpy as np
+import h3
+import argparse
+import time
+from hex_index import latlng_to_cells
+
+def get_hex_safe(lat, lng, res):
+    """The per-row indexing every script used before hex_index.py."""
+    try:
+        if hasattr(h3, 'latlng_to_cell'):
+            return h3.latlng_to_cell(lat, lng, res)
+        return h3.geo_to_h3(lat, lng, res)
+    except:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-row get_hex_safe with batch hex_index throughput.')
+    parser.add_argument('--rows', type=int, default=1_000_000, help='Number of coordinates to index')
+    parser.add_argument('--resolution', type=int, default=8, help='H3 resolution')
+    parser.add_argument('--distinct', type=int, default=0, help='Draw rows from this many distinct points (0 = all distinct)')
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    # Random points over greater Dhaka, with a few bad rows mixed in
+    rng = np.random.default_rng(args.seed)
+    n_points = args.distinct or args.rows
+    lat = rng.uniform(23.65, 23.90, n_points)
+    lng = rng.uniform(90.33, 90.50, n_points)
+    if args.distinct:
+        # Rides snap to a limited set of pickup/dropoff spots
+        pick = rng.integers(0, n_points, args.rows)
+        lat, lng = lat[pick], lng[pick]
+    lat[::1000] = np.nan
+
+    print(f"Indexing {args.rows} points at Hex-{args.resolution}...")
+
+    start = time.perf_counter()
+    per_row = [get_hex_safe(a, b, args.resolution) for a, b in zip(lat, lng)]
+    per_row_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cells, valid = latlng_to_cells(lat, lng, args.resolution)
+    batch_secs = time.perf_counter() - start
+
+    # Both paths must agree on every row before the timings mean anything
+    batch = [format(int(c), 'x') if ok else None for c, ok in zip(cells, valid)]
+    mismatches = sum(a != b for a, b in zip(per_row, batch))
+
+    print("\n--- Throughput ---")
+    print(f"Per-row get_hex_safe: {per_row_secs:8.2f}s  {args.rows / per_row_secs:12,.0f} rows/s")
+    print(f"Batch latlng_to_cells: {batch_secs:7.2f}s  {args.rows / batch_secs:12,.0f} rows/s")
+    print(f"Speedup:              {per_row_secs / batch_secs:8.1f}x")
+    print(f"Mismatched rows:      {mismatches}")
+
+if __name__ == "__main__":
+    main()
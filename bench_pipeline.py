@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+from generate_rides import parse_count, write_rides, make_presets
+
+# Runs every pipeline stage on synthetic rides of each size and appends
+# wall time, throughput and peak RSS to a JSON file, so runs from different
+# versions can be compared (--baseline flags stages that got slower).
+#
+#   python bench_pipeline.py --sizes 1M 10M
+#   python bench_pipeline.py --sizes 1M --baseline bench_results.json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def stage_commands(data, rides, args, api_url):
+    """(stage, script argv, file whose rows are the stage's input) in pipeline order."""
+    workers = ['--workers', str(args.workers)]
+    chunks = ['--chunksize', str(args.chunksize)]
+    out = lambda name: os.path.join(data, name)
+    return [
+        ('hexes', ['generate_hexes.py', rides, out('with_hex.csv')] + chunks, rides),
+        ('routes9', ['hex_routes.py', out('with_hex.csv'), out('routes9.csv')] + workers + chunks, rides),
+        ('routes8', ['test_hex8_routes_filtered.py', rides, out('routes8.csv'), '--min_rides', str(args.min_rides)]
+         + workers + chunks, rides),
+        ('presets', ['filter_presets_by_hex.py', args.presets_csv, out('routes8.csv'), out('preset_filtered.csv')],
+         args.presets_csv),
+        ('centroids', ['filter_and_centroid_presets.py', out('preset_filtered.csv'), out('preset_with_centroids.csv')],
+         out('preset_filtered.csv')),
+        ('names', ['fetch_hex_names.py', out('preset_with_centroids.csv'), out('preset_with_names.csv'),
+                   '--api_url', api_url, '--cache', ':memory:'], out('preset_with_centroids.csv')),
+        ('enrich', ['enrich_ride_data.py', rides, out('enriched.csv')], rides),
+    ]
+
+def count_rows(path, block=1 << 24):
+    """Data rows in a CSV (lines minus the header)."""
+    lines = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            lines += chunk.count(b'\n')
+    return max(lines - 1, 0)
+
+def read_stage_metrics(path):
+    """{stage: wall seconds} from the metrics.py records of the last run in an NDJSON file."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    last = records[-1]['run'] if records else None
+    return {r['stage']: r['wall_s'] for r in records if r['run'] == last and r['stage'] != 'total'}
+
+def run_stage(argv, metrics_path=None):
+    """Runs one script in a fresh process; returns (exit code, seconds, peak RSS in MB)."""
+    env = dict(os.environ, HEX_METRICS=metrics_path) if metrics_path else None
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(HERE, argv[0])] + argv[1:],
+                                stdout=subprocess.DEVNULL, stderr=stderr, env=env)
+        # wait4 gives this child's own resource usage, unlike getrusage(RUSAGE_CHILDREN)
+        _, status, usage = os.wait4(proc.pid, 0)
+        secs = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode:
+            stderr.seek(0)
+            print(stderr.read().decode(errors='replace')[-2000:])
+    return proc.returncode, secs, usage.ru_maxrss / 1024
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_stub():
+    """Starts stub_address_server.py in its own process; returns (process, API url)."""
+    port = free_port()
+    proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'stub_address_server.py'), '--port', str(port)],
+                            stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats").read()
+            break
+        except OSError:
+            time.sleep(0.1)
+    return proc, f"http://127.0.0.1:{port}/api/v1/shortaddress"
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(baseline, results, threshold):
+    """Prints throughput changes against an earlier run; returns the stages that regressed."""
+    before = {(r['size'], r['stage']): r for r in baseline['results'] if r['ok']}
+    regressions = []
+    print(f"\n--- Against the run of {baseline['started_at']} (commit {baseline['commit']}) ---")
+    print(f"{'size':>6} {'stage':<10} {'rows/s before':>14} {'rows/s now':>12} {'change':>8} {'RSS MB before':>14} {'now':>8}")
+    for r in results:
+        old = before.get((r['size'], r['stage']))
+        if not old or not r['ok']:
+            continue
+        change = r['rows_per_s'] / old['rows_per_s'] - 1
+        flag = '  <-- slower' if change < -threshold else ''
+        if flag:
+            regressions.append(f"{r['size']}/{r['stage']}")
+        print(f"{r['size']:>6} {r['stage']:<10} {old['rows_per_s']:>14,.0f} {r['rows_per_s']:>12,.0f} {change:>+8.1%} "
+              f"{old['peak_rss_mb']:>14.0f} {r['peak_rss_mb']:>8.0f}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the hex pipeline stages on synthetic rides.')
+    parser.add_argument('--sizes', nargs='+', default=['1M'], help='Ride counts to test, e.g. 1M 10M 100M')
+    parser.add_argument('--stages', nargs='+', default=None,
+                        help='Subset of: hexes routes9 routes8 presets centroids names enrich (default: all)')
+    parser.add_argument('--data_dir', default='bench_data', help='Where synthetic inputs and stage outputs go')
+    parser.add_argument('--presets_csv', default=None, help='Preset file to use (default: a synthetic one in data_dir)')
+    parser.add_argument('--output', default='bench_results.json', help='JSON file the run is appended to')
+    parser.add_argument('--baseline', default=None, help='Earlier results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Throughput drop that counts as a regression')
+    parser.add_argument('--workers', type=int, default=1, help='--workers for the counting stages')
+    parser.add_argument('--chunksize', type=int, default=0, help='--chunksize for the ride stages (0 = all at once)')
+    parser.add_argument('--min_rides', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    # Read the baseline first: it may be the file this run is appended to
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            runs = json.load(f)
+        if not runs:
+            print(f"Error: {args.baseline} holds no runs.")
+            return
+        baseline = runs[-1]
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    if args.presets_csv is None:
+        args.presets_csv = os.path.join(args.data_dir, 'preset.csv')
+        if not os.path.exists(args.presets_csv):
+            make_presets(17000, args.seed).to_csv(args.presets_csv, index=False)
+
+    run = {
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {'workers': args.workers, 'chunksize': args.chunksize, 'min_rides': args.min_rides, 'seed': args.seed},
+        'results': [],
+    }
+
+    stub, api_url = start_stub()
+    try:
+        for size in args.sizes:
+            rows = parse_count(size)
+            rides = os.path.join(args.data_dir, f'rides_{size}_seed{args.seed}.csv')
+            # Inputs are reused across runs, so only the stages are timed
+            if not os.path.exists(rides):
+                print(f"Generating {rows:,} rides into {rides}...")
+                write_rides(rides + '.tmp', rows, args.seed)
+                os.replace(rides + '.tmp', rides)
+
+            out_dir = os.path.join(args.data_dir, size)
+            os.makedirs(out_dir, exist_ok=True)
+            for stage, argv, input_path in stage_commands(out_dir, rides, args, api_url):
+                if args.stages and stage not in args.stages:
+                    continue
+                if not os.path.exists(input_path):
+                    print(f"[{size}] {stage}: skipped, {input_path} is missing")
+                    continue
+                input_rows = rows if input_path == rides else count_rows(input_path)
+                print(f"[{size}] {stage}: {' '.join(argv)}", flush=True)
+                metrics_path = os.path.join(out_dir, 'metrics.ndjson')
+                code, secs, rss = run_stage(argv, metrics_path)
+                result = {
+                    'size': size, 'stage': stage, 'rows': input_rows, 'ok': code == 0,
+                    'wall_s': round(secs, 3), 'rows_per_s': round(input_rows / secs, 1), 'peak_rss_mb': round(rss, 1),
+                    # Where the time went inside the script (read, index, group, ...)
+                    'stages_s': read_stage_metrics(metrics_path) if code == 0 else {},
+                }
+                run['results'].append(result)
+                print(f"[{size}] {stage}: {secs:.2f}s, {result['rows_per_s']:,.0f} rows/s, peak RSS {rss:.0f} MB"
+                      + ('' if result['ok'] else f", exit code {code}"), flush=True)
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    history = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            history = json.load(f)
+    history.append(run)
+    with open(args.output + '.tmp', 'w') as f:
+        json.dump(history, f, indent=1)
+    os.replace(args.output + '.tmp', args.output)
+
+    print("\n--- Pipeline benchmark ---")
+    print(f"{'size':>6} {'stage':<10} {'rows':>12} {'wall s':>8} {'rows/s':>12} {'peak RSS MB':>12}")
+    for r in run['results']:
+        print(f"{r['size']:>6} {r['stage']:<10} {r['rows']:>12,} {r['wall_s']:>8.2f} {r['rows_per_s']:>12,.0f} "
+              f"{r['peak_rss_mb']:>12.0f}{'' if r['ok'] else '  FAILED'}")
+    print(f"Appended to {args.output}")
+
+    if baseline:
+        regressions = compare(baseline, run['results'], args.threshold)
+        if regressions:
+            print(f"Regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from hex_index import latlng_to_cells, cells_to_str
+from route_counts import count_pairs
+from route_index import RouteIndex
+
+def measure(fn, trace=True):
+    """Runs fn once; returns (result, seconds, bytes allocated and still held)."""
+    # Tracing slows Python code down a lot, so timings that matter run untraced
+    if trace:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    secs = time.perf_counter() - start
+    held = tracemalloc.get_traced_memory()[0] if trace else 0
+    tracemalloc.stop()
+    return result, secs, held
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the packed route index with a set of hex-string tuples.')
+    parser.add_argument('--rides', type=int, default=2_000_000, help='Synthetic rides the routes are counted from')
+    parser.add_argument('--queries', type=int, default=1_000_000, help='Pairs looked up per batch')
+    parser.add_argument('--resolution', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    # Routes between random points over Dhaka, as a route-count table
+    rng = np.random.default_rng(args.seed)
+    def points(n):
+        return latlng_to_cells(rng.uniform(23.65, 23.90, n), rng.uniform(90.33, 90.50, n), args.resolution)[0]
+    counts = count_pairs(points(args.rides), points(args.rides))
+    p = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+    d = counts.index.get_level_values(1).to_numpy(dtype=np.uint64)
+    print(f"{len(counts)} distinct Hex-{args.resolution} routes")
+
+    # Half the queries are known routes, half are random pairs of known cells
+    pick = rng.integers(0, len(counts), args.queries)
+    qp, qd = p[pick].copy(), d[pick].copy()
+    qd[::2] = rng.choice(d, len(qd[::2]))
+    qp_str, qd_str = cells_to_str(qp).tolist(), cells_to_str(qd).tolist()
+
+    # The set holds its own hex strings, as it does when built from the CSV
+    valid_routes, set_build, set_bytes = measure(lambda: set(zip(cells_to_str(p).tolist(), cells_to_str(d).tolist())))
+    index, index_build, _ = measure(lambda: RouteIndex.from_counts(counts))
+
+    # Both ends of the lookup are timed from what each caller already has
+    set_hits, set_secs, _ = measure(lambda: np.array([(a, b) in valid_routes for a, b in zip(qp_str, qd_str)]), trace=False)
+    index_hits, index_secs, _ = measure(lambda: index.contains(qp, qd), trace=False)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'routes.idx')
+        index.save(path)
+        size = os.path.getsize(path)
+        loaded, load_secs, _ = measure(lambda: RouteIndex.load(path))
+        loaded_hits, mmap_secs, _ = measure(lambda: loaded.contains(qp, qd), trace=False)
+        assert (loaded_hits == index_hits).all()
+        del loaded, loaded_hits
+
+    print("\n--- Route membership benchmark ---")
+    print(f"{'structure':<26} {'bytes/route':>12} {'build s':>8} {'lookup s':>9} {'lookups/s':>12}")
+    print(f"{'set of (str, str)':<26} {set_bytes / len(counts):>12.1f} {set_build:>8.3f} {set_secs:>9.3f} {args.queries / set_secs:>12,.0f}")
+    print(f"{'RouteIndex':<26} {index.nbytes / len(counts):>12.1f} {index_build:>8.3f} {index_secs:>9.3f} {args.queries / index_secs:>12,.0f}")
+    print(f"{'RouteIndex (mmap file)':<26} {size / len(counts):>12.1f} {load_secs:>8.4f} {mmap_secs:>9.3f} {args.queries / mmap_secs:>12,.0f}")
+    print(f"Answers agree: {bool((set_hits == index_hits).all())} ({int(index_hits.sum())} hits)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from hex_index import cells_to_latlng
+from route_index import load_routes
+from route_lookup import RouteLookup
+
+def percentiles(latencies):
+    ms = np.asarray(latencies) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+def make_queries(counts_path, n, seed):
+    """Half busy routes (by centroid), half random trips over Dhaka."""
+    rng = np.random.default_rng(seed)
+    p, d, _ = load_routes(counts_path).pairs()
+    pick = rng.integers(0, len(p), n // 2)
+    p_lat, p_lon = cells_to_latlng(p[pick])
+    d_lat, d_lon = cells_to_latlng(d[pick])
+    known = np.column_stack([p_lat, p_lon, d_lat, d_lon])
+    rest = n - len(known)
+    random = np.column_stack([rng.uniform(23.65, 23.90, rest), rng.uniform(90.33, 90.50, rest),
+                              rng.uniform(23.65, 23.90, rest), rng.uniform(90.33, 90.50, rest)])
+    queries = np.concatenate([known, random])
+    return queries[rng.permutation(len(queries))].tolist()
+
+def run_client(port, queries, batch):
+    """Sends the queries over one keep-alive connection; returns per-request latencies."""
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    latencies = []
+    step = batch or 1
+    for i in range(0, len(queries), step):
+        start = time.perf_counter()
+        if batch:
+            body = json.dumps({'queries': [{'pickup': q[:2], 'dropoff': q[2:]} for q in queries[i:i + batch]]})
+            conn.request('POST', '/routes', body, {'Content-Type': 'application/json'})
+        else:
+            q = queries[i]
+            conn.request('GET', f'/route?pickup={q[0]},{q[1]}&dropoff={q[2]},{q[3]}')
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+    conn.close()
+    return latencies
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the route lookup service.')
+    parser.add_argument('--counts', default='hex8_route_counts.csv')
+    parser.add_argument('--lanes', default='hex8_route_counts_filtered.csv')
+    parser.add_argument('--names', default='preset_with_names.csv')
+    parser.add_argument('--requests', type=int, default=20000, help='Lookups to send')
+    parser.add_argument('--concurrency', type=int, default=4, help='Client connections')
+    parser.add_argument('--batch', type=int, default=0, help='Lookups per POST /routes (0 = one GET /route each)')
+    parser.add_argument('--cpu', type=int, default=0, help='CPU core the server is pinned to')
+    parser.add_argument('--port', type=int, default=8091)
+    parser.add_argument('--seed', type=int, default=42)
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.counts):
+        print(f"Error: {args.counts} not found.")
+        return
+
+    queries = make_queries(args.counts, args.requests, args.seed)
+
+    # The lookup itself, without HTTP
+    routes = RouteLookup(args.counts, args.lanes, args.names)
+    latencies = []
+    for q in queries[:min(len(queries), 5000)]:
+        start = time.perf_counter()
+        routes.lookup(*q)
+        latencies.append(time.perf_counter() - start)
+    in_process = percentiles(latencies) + (len(latencies) / sum(latencies),)
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'route_lookup.py')
+    server = subprocess.Popen([sys.executable, script, '--counts', args.counts, '--lanes', args.lanes, '--names', args.names,
+                               '--port', str(args.port), '--cpu', str(args.cpu), '--reload_secs', '0'],
+                              stdout=subprocess.DEVNULL)
+    try:
+        for _ in range(100):
+            try:
+                run_client(args.port, queries[:1], 0)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        # Split the queries across the client connections
+        shards = [queries[i::args.concurrency] for i in range(args.concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = [t for part in pool.map(run_client, [args.port] * len(shards), shards, [args.batch] * len(shards))
+                         for t in part]
+        wall = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    p50, p99 = percentiles(latencies)
+    mode = f"POST /routes x{args.batch}" if args.batch else "GET /route"
+    print(f"\n--- Route lookup load test (server pinned to CPU {args.cpu}) ---")
+    print(f"{'path':<28} {'p50 ms':>8} {'p99 ms':>8} {'lookups/s':>10}")
+    print(f"{'in-process lookup()':<28} {in_process[0]:>8.3f} {in_process[1]:>8.3f} {in_process[2]:>10.0f}")
+    print(f"{mode + f' ({args.concurrency} conns)':<28} {p50:>8.3f} {p99:>8.3f} {len(queries) / wall:>10.0f}")
+    print(f"{len(latencies)} requests in {wall:.2f}s")
+
+if __name__ == "__main__":
+    main()
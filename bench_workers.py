@@ -0,0 +1,52 @@
+import argparse
+import os
+import time
+from functools import partial
+from route_counts import count_file, count_routes, counts_to_frame, input_exists
+
+def main():
+    parser = argparse.ArgumentParser(description='Scaling report for parallel Hex-8 route counting.')
+    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data (a CSV, or a directory or glob of shards, optionally compressed)')
+    parser.add_argument('--max_workers', type=int, default=os.cpu_count(), help='Largest worker count to try')
+    parser.add_argument('--chunksize', type=int, default=0, help='Rows per chunk inside each worker (0 = whole shard)')
+    parser.add_argument('--resolution', type=int, default=8, help='H3 resolution')
+    parser.add_argument('--output', default=None, help='Optional CSV to save the report to')
+
+    args = parser.parse_args()
+
+    if not input_exists(args.input_csv):
+        print(f"Error: {args.input_csv} not found.")
+        return
+
+    count_fn = partial(count_routes, res=args.resolution)
+    rows = []
+    baseline = None
+    reference = None
+    for workers in range(1, args.max_workers + 1):
+        start = time.perf_counter()
+        counts = count_file(args.input_csv, count_fn, workers, args.chunksize)
+        secs = time.perf_counter() - start
+
+        # Every worker count has to produce exactly the single-process table
+        frame = counts_to_frame(counts, 'p_hex', 'd_hex')
+        if reference is None:
+            baseline, reference = secs, frame
+        matches = frame.equals(reference)
+
+        rows.append((workers, secs, baseline / secs, baseline / secs / workers, matches))
+        print(f"workers={workers:<3} {secs:8.2f}s  speedup {baseline / secs:5.2f}x  identical={matches}")
+
+    print("\n--- Scaling Report ---")
+    print(f"{'workers':>7} {'seconds':>9} {'speedup':>8} {'efficiency':>10} {'identical':>9}")
+    for workers, secs, speedup, efficiency, matches in rows:
+        print(f"{workers:>7} {secs:>9.2f} {speedup:>7.2f}x {efficiency:>10.0%} {str(matches):>9}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write('workers,seconds,speedup,efficiency,identical\n')
+            for workers, secs, speedup, efficiency, matches in rows:
+                f.write(f'{workers},{secs:.4f},{speedup:.4f},{efficiency:.4f},{matches}\n')
+        print(f"Saved report to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+Columnar storage for the intermediate ride tables.
+
+Besides CSV, intermediate stages can write:
+- 'npy': a directory holding one raw little-endian file per column plus a
+  _schema.json with the dtypes and row count. Reads memory-map only the
+  columns that are asked for, so nothing is parsed or copied up front.
+- 'parquet': a single Parquet file (needs pyarrow).
+Hex cells go in as uint64 in both formats; CSV stays the human-facing output.
+"""
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+FORMATS = ('csv', 'npy', 'parquet')
+SCHEMA_FILE = '_schema.json'
+
+
+def detect_format(path):
+    """Guesses the storage format of `path` from what is on disk or its suffix."""
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, SCHEMA_FILE)):
+        return 'npy'
+    if str(path).endswith(('.parquet', '.pq')):
+        return 'parquet'
+    return 'csv'
+
+
+def is_columnar(path):
+    return detect_format(path) != 'csv'
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise ImportError("The parquet format needs pyarrow: pip install pyarrow")
+
+
+def _column_array(values):
+    """Numeric columns go in as-is; text columns become fixed-width UTF-8 bytes."""
+    arr = np.asarray(values)
+    if arr.dtype.kind in 'biuf':
+        return np.ascontiguousarray(arr.astype(arr.dtype.newbyteorder('<')))
+    text = pd.Series(values, dtype='object').where(pd.notna(values), '')
+    return np.array([str(v).encode('utf-8') for v in text], dtype='S')
+
+
+def _decode(arr):
+    """Turns fixed-width bytes back into an object column (None for empty)."""
+    if arr.dtype.kind != 'S':
+        return arr
+    text = pd.Series(arr).str.decode('utf-8')
+    return text.where(text != '', None).to_numpy(dtype=object)
+
+
+class TableWriter:
+    """Appends DataFrame chunks to a CSV file, npy directory or Parquet file."""
+
+    def __init__(self, path, fmt=None):
+        self.path = path
+        self.fmt = fmt or detect_format(path)
+        if self.fmt not in FORMATS:
+            raise ValueError(f"Unknown format {self.fmt!r}, expected one of {FORMATS}")
+        if self.fmt == 'parquet':
+            _require_pyarrow()
+        self.rows = 0
+        self._dtypes = None
+        self._parquet = None
+        if self.fmt == 'npy':
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(path)
+
+    def write(self, df):
+        if self.fmt == 'csv':
+            df.to_csv(self.path, index=False, mode='w' if self.rows == 0 else 'a', header=(self.rows == 0))
+        elif self.fmt == 'parquet':
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = pq.ParquetWriter(self.path, table.schema)
+            self._parquet.write_table(table)
+        else:
+            self._write_npy(df)
+        self.rows += len(df)
+
+    def _write_npy(self, df):
+        arrays = {col: _column_array(df[col].to_numpy()) for col in df.columns}
+        if self._dtypes is None:
+            self._dtypes = {col: arr.dtype for col, arr in arrays.items()}
+        for col, arr in arrays.items():
+            dtype = self._dtypes[col]
+            if dtype.kind == 'S' and arr.dtype.itemsize > dtype.itemsize:
+                # A longer string than seen so far: rewrite the column wider
+                self._widen(col, arr.dtype)
+                dtype = self._dtypes[col]
+            with open(os.path.join(self.path, f'{col}.bin'), 'ab') as f:
+                arr.astype(dtype).tofile(f)
+
+    def _widen(self, col, dtype):
+        file = os.path.join(self.path, f'{col}.bin')
+        old = np.fromfile(file, dtype=self._dtypes[col]) if self.rows else np.empty(0, self._dtypes[col])
+        old.astype(dtype).tofile(file)
+        self._dtypes[col] = dtype
+
+    def close(self):
+        if self.fmt == 'parquet' and self._parquet is not None:
+            self._parquet.close()
+        elif self.fmt == 'npy':
+            schema = {
+                'rows': self.rows,
+                'columns': {col: dtype.str for col, dtype in (self._dtypes or {}).items()},
+            }
+            with open(os.path.join(self.path, SCHEMA_FILE), 'w') as f:
+                json.dump(schema, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_table(df, path, fmt=None):
+    """Writes a whole DataFrame in one go."""
+    with TableWriter(path, fmt) as writer:
+        writer.write(df)
+
+
+def read_schema(path):
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        return json.load(f)
+
+
+def load_columns(path, columns=None):
+    """
+    Memory-maps the requested columns of an npy table directory.
+    Returns {column: array}; numeric arrays are read-only views of the files.
+    """
+    schema = read_schema(path)
+    columns = columns or list(schema['columns'])
+    arrays = {}
+    for col in columns:
+        if col not in schema['columns']:
+            raise KeyError(f"{path} has no column {col!r}")
+        dtype = np.dtype(schema['columns'][col])
+        if schema['rows'] == 0:
+            arrays[col] = np.empty(0, dtype=dtype)
+        else:
+            arrays[col] = np.memmap(os.path.join(path, f'{col}.bin'), dtype=dtype, mode='r', shape=(schema['rows'],))
+    return arrays
+
+
+def iter_table(path, columns=None, chunksize=None):
+    """Yields DataFrames with only `columns`, whole or `chunksize` rows at a time."""
+    fmt = detect_format(path)
+    if fmt == 'csv':
+        if chunksize:
+            yield from pd.read_csv(path, usecols=columns, chunksize=chunksize)
+        else:
+            yield pd.read_csv(path, usecols=columns)
+    elif fmt == 'parquet':
+        _require_pyarrow()
+        if chunksize:
+            for batch in pq.ParquetFile(path, memory_map=True).iter_batches(batch_size=chunksize, columns=columns):
+                yield batch.to_pandas()
+        else:
+            yield pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    else:
+        arrays = load_columns(path, columns)
+        rows = read_schema(path)['rows']
+        step = chunksize or max(rows, 1)
+        for start in range(0, max(rows, 1), step):
+            yield pd.DataFrame(
+                {col: _decode(arr[start:start + step]) for col, arr in arrays.items()},
+                copy=False,
+            )
+
+
+def read_table(path, columns=None):
+    """Reads a whole table (any format) with only the requested columns."""
+    return next(iter_table(path, columns))
@@ -1,59 +1,58 @@
+import numpy as np
 import pandas as pd
-import h3
 import argparse
-import os
+from hex_index import latlng_to_cells, cells_to_str, cells_to_latlng
+from route_counts import read_rides, input_exists, RIDE_COLS
+from partitioned import save_partitioned
+from metrics import instrumented, add_arguments, configure, stage
 
-def get_hex_safe(lat, lng, res):
-    """Converts coordinates to H3 ID."""
-    try:
-        if hasattr(h3, 'latlng_to_cell'):
-            return h3.latlng_to_cell(lat, lng, res)
-        return h3.geo_to_h3(lat, lng, res)
-    except:
-        return None
+@instrumented('enrich_ride_data')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Enrich ride data with hex IDs and centroids.')
+    parser.add_argument('input_csv', nargs='?', default='preset_with_centroids.csv', help='Raw ride data (a CSV, or a directory or glob of shards)')
+    parser.add_argument('output_csv', nargs='?', default=None, help='Output file (default: enriched_rides_with_centroids.csv, or enriched_rides_parts with --partition_res)')
+    parser.add_argument('--partition_res', type=int, default=None, help='Write a directory with one CSV per Hex-N parent of the pickup hex instead (see partitioned.py)')
 
-def get_centroid(hex_id):
-    """Returns (lat, lon) of the hex center."""
-    try:
-        if hasattr(h3, 'cell_to_latlng'):
-            return h3.cell_to_latlng(hex_id)
-        return h3.h3_to_geo(hex_id)
-    except:
-        return (None, None)
+    add_arguments(parser)
 
-def main():
-    parser = argparse.ArgumentParser(description='Enrich ride data with hex IDs and centroids.')
-    parser.add_argument('input_csv', nargs='?', default='preset_with_centroids.csv', help='Raw ride data')
-    parser.add_argument('output_csv', nargs='?', default='enriched_rides_with_centroids.csv', help='Output file')
-    
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    configure(args)
+    output = args.output_csv or ('enriched_rides_with_centroids.csv' if args.partition_res is None else 'enriched_rides_parts')
     
-    if not os.path.exists(args.input_csv):
+    if not input_exists(args.input_csv):
         print(f"Error: {args.input_csv} not found.")
         return
+    if args.partition_res is not None and not 0 <= args.partition_res <= 8:
+        print("Error: --partition_res must be between 0 and 8.")
+        return
 
     print(f"Reading {args.input_csv}...")
-    # Using specific columns to save memory
-    df = pd.read_csv(args.input_csv)
+    # Using specific columns to save memory: only the coordinates, as float64
+    # (shards are read in parallel and joined in name order)
+    with stage('read') as s:
+        df = pd.concat(read_rides(args.input_csv, usecols=RIDE_COLS), ignore_index=True)
+        s.rows_out = len(df)
 
     RES = 8
     print(f"Calculating Hex-{RES} IDs and Centroids...")
 
     # 1. Generate Hex IDs
-    df['pickup_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'])]
-    df['dropoff_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'])]
-
-    # 2. Generate Pickup Centroids
-    print("Mapping Pickup Centroids...")
-    p_centroids = [get_centroid(h) for h in df['pickup_hex8']]
-    df['pickup_centroid_lat'] = [c[0] for c in p_centroids]
-    df['pickup_centroid_lon'] = [c[1] for c in p_centroids]
+    with stage('index', rows_in=len(df)) as s:
+        p_cells, p_valid = latlng_to_cells(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'], RES)
+        d_cells, d_valid = latlng_to_cells(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'], RES)
+        df['pickup_hex8'] = cells_to_str(p_cells, p_valid)
+        df['dropoff_hex8'] = cells_to_str(d_cells, d_valid)
+        s.rows_out = len(df)
 
-    # 3. Generate Dropoff Centroids
-    print("Mapping Dropoff Centroids...")
-    d_centroids = [get_centroid(h) for h in df['dropoff_hex8']]
-    df['dropoff_centroid_lat'] = [c[0] for c in d_centroids]
-    df['dropoff_centroid_lon'] = [c[1] for c in d_centroids]
+    with stage('enrich', rows_in=len(df)) as s:
+        # 2-3. Pickup and dropoff centroids, computed once per distinct cell
+        # (both ends together) and broadcast back to the rides
+        print("Mapping Pickup and Dropoff Centroids...")
+        lat, lon = cells_to_latlng(np.concatenate([p_cells, d_cells]))
+        n = len(df)
+        df['pickup_centroid_lat'], df['pickup_centroid_lon'] = lat[:n], lon[:n]
+        df['dropoff_centroid_lat'], df['dropoff_centroid_lon'] = lat[n:], lon[n:]
+        s.rows_out = len(df)
 
     # 4. Save to CSV
     # We keep the original coordinates + new hex data
@@ -65,8 +64,14 @@ def main():
         'dropoff_centroid_lat', 'dropoff_centroid_lon'
     ]
     
-    print(f"Saving to {args.output_csv}...")
-    df[cols_to_save].to_csv(args.output_csv, index=False)
+    print(f"Saving to {output}...")
+    if args.partition_res is not None:
+        manifest = save_partitioned(df[cols_to_save], output, 'pickup_hex8', args.partition_res)
+        print(f"Wrote {len(manifest['partitions'])} Hex-{args.partition_res} partitions")
+    else:
+        with stage('write', rows_in=len(df)) as s:
+            df[cols_to_save].to_csv(output, index=False)
+            s.rows_out = len(df)
     print("Successfully completed!")
 
 if __name__ == "__main__":
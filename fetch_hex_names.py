@@ -4,24 +4,19 @@ import json
 import argparse
 import os
 from concurrent.futures import ThreadPoolExecutor
+from hex_index import str_to_cells
+from geocode_cache import GeocodeCache, DEFAULT_CACHE_PATH
+from address_client import API_URL, HEADERS, aiohttp, fetch_addresses
+from area_naming import name_hierarchically
+from stage_io import read_csv, write_csv
+from metrics import instrumented, add_arguments, configure, stage
 
-# API Configuration
-API_URL = "http://34.80.56.250:8080/api/v1/shortaddress"
-HEADERS = {
-    'Content-Type': 'application/json',
-    'Authorization': 'nisuecb'
-}
-
-# Cache to avoid calling the same coordinates twice
-address_cache = {}
-
-def get_short_address(lat, lon):
-    """Calls the API to get the English short address. Returns None if failed."""
-    coord_key = (round(lat, 6), round(lon, 6))
-    
-    if coord_key in address_cache:
-        return address_cache[coord_key]
-
+def get_short_address(lat, lon, api_url=API_URL):
+    """
+    Calls the API to get the English short address.
+    Returns (ok, address): ok is False if the call failed, address is None if
+    the API answered without a usable name.
+    """
     payload = json.dumps({
         "1": {
             "location": {
@@ -32,64 +27,134 @@ def get_short_address(lat, lon):
     })
 
     try:
-        response = requests.post(API_URL, headers=HEADERS, data=payload, timeout=5)
+        response = requests.post(api_url, headers=HEADERS, data=payload, timeout=5)
         if response.status_code == 200:
             data = response.json()
             address = data.get("1", {}).get("short_address", {}).get("en")
-            # Only cache if it's a valid string, otherwise store None
+            # Only keep it if it's a valid string, otherwise it's a negative result
             if address and address.strip():
-                address_cache[coord_key] = address
-                return address
+                return True, address
+            return True, None
+        print(f"Error fetching address for {lat}, {lon}: HTTP {response.status_code}")
     except Exception as e:
         print(f"Error fetching address for {lat}, {lon}: {e}")
     
-    address_cache[coord_key] = None
-    return None
+    return False, None
+
+def fetch_names(points, args):
+    """
+    Fetches [(cell, lat, lon), ...] with the client chosen on the command line.
+    Returns ({cell: (ok, address)}, number of HTTP requests sent).
+    """
+    if not points:
+        return {}, 0
+    if args.client == 'async':
+        results, stats = fetch_addresses(
+            points, api_url=args.api_url, batch_size=args.batch_size, concurrency=args.concurrency, rate=args.rate,
+        )
+        return results, stats['requests']
+    with ThreadPoolExecutor(max_workers=10) as executor:
+        results = dict(zip([p[0] for p in points], executor.map(
+            lambda p: get_short_address(p[1], p[2], args.api_url), points
+        )))
+    return results, len(points)
 
-def main():
+@instrumented('fetch_hex_names')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Fetch hex names for centroids.')
     parser.add_argument('input_csv', nargs='?', default='preset_with_centroids.csv')
     parser.add_argument('output_csv', nargs='?', default='preset_with_names.csv')
-    
-    args = parser.parse_args()
+    parser.add_argument('--cache', default=DEFAULT_CACHE_PATH, help='SQLite name cache shared across runs (":memory:" to disable)')
+    parser.add_argument('--ttl_days', type=float, default=None, help='Refetch names older than this (default: keep forever)')
+    parser.add_argument('--negative_ttl_days', type=float, default=7, help='Retry hexes the API had no name for after this long')
+    parser.add_argument('--max_entries', type=int, default=None, help='Evict the oldest names beyond this many')
+    parser.add_argument('--api_url', default=API_URL, help='Short-address endpoint (e.g. a local stub server)')
+    parser.add_argument('--client', choices=['async', 'threads'], default='async' if aiohttp else 'threads',
+                        help='Batched asyncio client (needs aiohttp) or one request per hex on 10 threads')
+    parser.add_argument('--batch_size', type=int, default=25, help='Centroids per POST with the async client')
+    parser.add_argument('--concurrency', type=int, default=8, help='Max requests in flight with the async client')
+    parser.add_argument('--rate', type=float, default=None, help='Max requests per second with the async client')
+    parser.add_argument('--naming', choices=['cell', 'hierarchical'], default='cell',
+                        help='Geocode every hex, or probe coarser parents first and only resolve ambiguous ones per hex')
+    parser.add_argument('--parent_res', type=int, default=7, help='Parent resolution for --naming hierarchical')
+    parser.add_argument('--sample', type=int, default=2, help='Children probed per parent for --naming hierarchical')
+    parser.add_argument('--validate', type=int, default=0, help='Check this many inherited names against per-hex lookups')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
 
     if not os.path.exists(args.input_csv):
         print(f"Error: {args.input_csv} not found.")
         return
 
     print(f"Loading {args.input_csv}...")
-    df = pd.read_csv(args.input_csv)
+    df = read_csv(args.input_csv)
 
-    # 1. Get unique points
-    unique_pickups = df[['pickup_hex8_lat', 'pickup_hex8_lon']].drop_duplicates()
-    unique_dropoffs = df[['destination_hex8_lat', 'destination_hex8_lon']].drop_duplicates()
-    all_unique_points = pd.concat([
-        unique_pickups.rename(columns={'pickup_centroid_lat': 'lat', 'pickup_centroid_lon': 'lon'}),
-        unique_dropoffs.rename(columns={'dropoff_centroid_lat': 'lat', 'dropoff_centroid_lon': 'lon'})
-    ]).drop_duplicates()
+    # 1. Get unique hexes and their centroids
+    columns = ['cell', 'lat', 'lon']
+    unique_pickups = df[['pickup_hex8', 'pickup_hex8_lat', 'pickup_hex8_lon']].set_axis(columns, axis=1)
+    unique_dropoffs = df[['destination_hex8', 'destination_hex8_lat', 'destination_hex8_lon']].set_axis(columns, axis=1)
+    all_unique_points = pd.concat([unique_pickups, unique_dropoffs]).dropna().drop_duplicates(subset='cell')
+    all_unique_points['cell'] = str_to_cells(all_unique_points['cell'])
 
     print(f"Querying {len(all_unique_points)} unique centroids...")
 
-    # 2. Fetch names with Threading
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        executor.map(lambda p: get_short_address(p[0], p[1]), all_unique_points.values)
+    # 2. Names we already know, keyed by hex, survive between runs. Only
+    # the misses go to the API, and failed calls are not cached.
+    cache = GeocodeCache(args.cache, args.ttl_days, args.negative_ttl_days, args.max_entries)
+    counters = {'cache_hits': 0, 'fetched': 0, 'failed': 0, 'http_requests': 0}
+
+    def lookup(points):
+        with stage('fetch', rows_in=len(points)) as s:
+            cached = cache.get_many([p[0] for p in points])
+            misses = [p for p in points if p[0] not in cached]
+            results, http_requests = fetch_names(misses, args)
+            fetched = {cell: address for cell, (ok, address) in results.items() if ok}
+            cache.put_many(fetched)
+            s.rows_out = len(cached) + len(fetched)
+            s.count(api_calls=http_requests, cache_hits=len(cached), lookups=len(misses), errors=len(misses) - len(fetched))
+        counters['cache_hits'] += len(cached)
+        counters['fetched'] += len(misses)
+        counters['failed'] += len(misses) - len(fetched)
+        counters['http_requests'] += http_requests
+        answers = dict(results)
+        answers.update((cell, (True, name)) for cell, name in cached.items())
+        return answers
+
+    # 3. Name every hex, or go through coarser parents first
+    report = None
+    if args.naming == 'hierarchical':
+        names, report = name_hierarchically(
+            all_unique_points['cell'].to_numpy(), lookup, args.parent_res, args.sample, args.validate
+        )
+    else:
+        points = list(zip(all_unique_points['cell'].tolist(), all_unique_points['lat'], all_unique_points['lon']))
+        names = {cell: address for cell, (ok, address) in lookup(points).items() if ok}
+    cache.close()
 
-    # 3. Map names
+    # 4. Map names by hex
     print("Mapping names and filtering...")
-    df['pickup_area_name'] = df.apply(
-        lambda row: address_cache.get((round(row['pickup_hex8_lat'], 6), round(row['pickup_hex8_lon'], 6))), 
-        axis=1
-    )
-    df['dropoff_area_name'] = df.apply(
-        lambda row: address_cache.get((round(row['destination_hex8_lat'], 6), round(row['destination_hex8_lon'], 6))), 
-        axis=1
-    )
+    with stage('enrich', rows_in=len(df)) as s:
+        df['pickup_area_name'] = pd.Series(str_to_cells(df['pickup_hex8']), index=df.index).map(names)
+        df['dropoff_area_name'] = pd.Series(str_to_cells(df['destination_hex8']), index=df.index).map(names)
+        s.rows_out = len(df)
 
     # 4. Save all rows, including unknowns
-    df.to_csv(args.output_csv, index=False)
+    write_csv(df, args.output_csv)
     
     print("\n--- Results ---")
     print(f"Total rides processed: {len(df)}")
+    print(f"Cache hits:            {counters['cache_hits']}")
+    print(f"API lookups:           {counters['fetched']} ({counters['failed']} failed) in {counters['http_requests']} requests")
+    if report:
+        print(f"Hierarchical naming:   {report['inherited']} of {report['cells']} hexes inherited a Hex-{args.parent_res} name "
+              f"({report['ambiguous_parents']} of {report['parents_probed']} parents ambiguous)")
+        print(f"Lookups saved:         {report['lookups_saved']} ({report['lookups']} vs {report['lookups_per_cell_mode']} per hex)")
+        if 'agreement' in report:
+            agreement = 'n/a' if report['agreement'] is None else f"{report['agreement']:.1%}"
+            print(f"Agreement with per-hex names: {agreement} on {report['validated']} checked hexes")
     print(f"Final file saved as: {args.output_csv}")
 
 if __name__ == "__main__":
@@ -1,28 +1,23 @@
-import pandas as pd
-import h3
 import argparse
 import os
+from preset_engine import process_presets
+from route_index import load_routes
+from stage_io import read_csv, write_csv
+from metrics import instrumented, add_arguments, configure
 
-def get_hex_safe(lat_lng_str, res):
-    """
-    Parses a 'Lat, Lon' string and converts to H3 index.
-    """
-    try:
-        # Split the string "23.73, 90.41" into floats
-        lat, lng = map(float, lat_lng_str.split(','))
-        if hasattr(h3, 'latlng_to_cell'):
-            return h3.latlng_to_cell(lat, lng, res)
-        return h3.geo_to_h3(lat, lng, res)
-    except Exception:
-        return None
-
-def main():
+@instrumented('filter_presets_by_hex')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Filter preset routes based on high-volume Hex-8 corridors.')
     parser.add_argument('preset_csv', nargs='?', default='preset.csv', help='The preset route file')
-    parser.add_argument('hex_filter_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='The filtered hex pairs')
+    parser.add_argument('hex_filter_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='The filtered hex pairs (CSV, or an index from route_index.py build)')
     parser.add_argument('output_csv', nargs='?', default='preset_filtered.csv', help='Output filename')
-    
-    args = parser.parse_args()
+    parser.add_argument('--tolerance', type=int, default=0,
+                        help='Also accept a power lane within this many grid rings of each end, and add the matched lane')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
 
     # Check if files exist
     if not os.path.exists(args.preset_csv) or not os.path.exists(args.hex_filter_csv):
@@ -31,38 +26,31 @@ def main():
 
     # 1. Load the Filter (The high-volume hex pairs)
     print("Loading hex filters...")
-    filter_df = pd.read_csv(args.hex_filter_csv)
-    # Create a set of tuples {(pickup_hex, dropoff_hex), ...} for lightning fast lookup
-    valid_routes = set(zip(filter_df['p_hex8'], filter_df['d_hex8']))
+    # Packed (pickup, dropoff) cell pairs; a saved index is memory-mapped, not parsed
+    valid_routes = load_routes(args.hex_filter_csv)
 
     # 2. Load the Presets
     print("Reading preset data...")
-    preset_df = pd.read_csv(args.preset_csv)
+    preset_df = read_csv(args.preset_csv)
 
     RES = 8
     
     # 3. Process Presets and Filter
     print("Mapping presets to Hex-8 and filtering...")
-    
-    def is_route_valid(row):
-        # Convert the string columns to hex IDs
-        p_hex = get_hex_safe(row['Popular Pickup Lat,Lon'], RES)
-        d_hex = get_hex_safe(row['Popular Destination Lat, Lon'], RES)
-        
-        # Check if this specific pair exists in our "Power Lanes"
-        return (p_hex, d_hex) in valid_routes
 
-    # Apply the filter
-    initial_count = len(preset_df)
-    filtered_df = preset_df[preset_df.apply(is_route_valid, axis=1)].copy()
-    final_count = len(filtered_df)
+    # Keep presets whose hex pair is one of our "Power Lanes"
+    filtered_df, summary = process_presets(preset_df, RES, routes=valid_routes, hex_columns=False, tolerance=args.tolerance)
+    initial_count, final_count = summary['presets'], summary['kept']
 
     # 4. Save results
-    filtered_df.to_csv(args.output_csv, index=False)
+    write_csv(filtered_df, args.output_csv)
 
     print("\n--- Filtering Summary ---")
     print(f"Original Presets: {initial_count}")
     print(f"Presets kept:     {final_count}")
+    if args.tolerance > 0:
+        print(f"  exact lane:     {summary['exact']}")
+        print(f"  within {args.tolerance} rings: {final_count - summary['exact']}")
     print(f"Presets removed:  {initial_count - final_count}")
     print(f"Saved to:         {args.output_csv}")
 
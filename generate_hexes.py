@@ -1,53 +1,73 @@
-import pandas as pd
-import h3
 import argparse
-import os
-
-def get_hex_safe(lat, lng, res):
-    """
-    Converts lat/lng to H3 index. Returns None if coordinates are invalid.
-    """
-    try:
-        # Supports both h3-py v3 and v4
-        if hasattr(h3, 'latlng_to_cell'):
-            return h3.latlng_to_cell(lat, lng, res)
-        return h3.geo_to_h3(lat, lng, res)
-    except:
-        return None
-
-def main():
+from hex_index import latlng_to_cells, cells_to_str
+from route_counts import read_rides, input_exists
+from columnar import FORMATS, TableWriter
+from partitioned import PartitionedWriter
+from metrics import instrumented, add_arguments, configure, stage, timed_chunks
+
+DEFAULT_OUTPUTS = {
+    'csv': 'big-data-with-hex.csv',
+    'npy': 'big-data-with-hex',
+    'parquet': 'big-data-with-hex.parquet',
+}
+
+@instrumented('generate_hexes')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Add H3 Hex columns to existing ride data.')
-    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Input CSV filename')
-    parser.add_argument('output_csv', nargs='?', default='big-data-with-hex.csv', help='Output CSV filename')
-    
-    args = parser.parse_args()
+    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Input CSV, or a directory or glob of (compressed) shards')
+    parser.add_argument('output_csv', nargs='?', default=None, help='Output filename (default: big-data-with-hex + format suffix)')
+    parser.add_argument('--format', choices=FORMATS, default='csv', help='csv, or a columnar npy directory / parquet file for hex_routes.py')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    parser.add_argument('--partition_res', type=int, default=None, help='Write a directory with one --format file per Hex-N parent of the pickup hex (see partitioned.py)')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
+    output = args.output_csv or DEFAULT_OUTPUTS[args.format]
+    if args.partition_res is not None:
+        output = args.output_csv or 'big-data-with-hex-parts'
     
-    if not os.path.exists(args.input_csv):
+    if not input_exists(args.input_csv):
         print(f"Error: {args.input_csv} not found.")
         return
 
     print(f"Reading {args.input_csv}...")
     
-    # We use chunksize if the file is massive, but for standard files, 
-    # reading the whole thing is faster.
-    df = pd.read_csv(args.input_csv)
+    # Use --chunksize if the file is massive: each chunk is indexed and
+    # appended to the output, so only one chunk is in memory at a time.
+    chunks = timed_chunks(read_rides(args.input_csv, args.chunksize))
 
     RESOLUTION = 9
+    if args.partition_res is not None and not 0 <= args.partition_res <= RESOLUTION:
+        print(f"Error: --partition_res must be between 0 and {RESOLUTION}.")
+        return
+
+    # CSV gets hex strings; columnar formats keep the raw uint64 cells
+    to_column = cells_to_str if args.format == 'csv' else (lambda cells, valid: cells)
+
+    if args.partition_res is None:
+        writer = TableWriter(output, args.format)
+    else:
+        # Partition files are appended in parallel, chunk by chunk
+        writer = PartitionedWriter(output, 'pickup_hex_9', args.partition_res, args.format)
 
-    print("Calculating Pickup Hexes...")
-    df['pickup_hex_9'] = [
-        get_hex_safe(lat, lng, RESOLUTION) 
-        for lat, lng in zip(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'])
-    ]
+    with writer:
+        for df in chunks:
+            with stage('index', rows_in=len(df)) as s:
+                print("Calculating Pickup Hexes...")
+                cells, valid = latlng_to_cells(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'], RESOLUTION)
+                df['pickup_hex_9'] = to_column(cells, valid)
 
-    print("Calculating Dropoff Hexes...")
-    df['dropoff_hex_9'] = [
-        get_hex_safe(lat, lng, RESOLUTION) 
-        for lat, lng in zip(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'])
-    ]
+                print("Calculating Dropoff Hexes...")
+                cells, valid = latlng_to_cells(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'], RESOLUTION)
+                df['dropoff_hex_9'] = to_column(cells, valid)
+                s.rows_out = len(df)
 
-    print(f"Saving enriched data to {args.output_csv}...")
-    df.to_csv(args.output_csv, index=False)
+            print(f"Saving enriched data to {output}...")
+            with stage('write', rows_in=len(df)) as s:
+                writer.write(df)
+                s.rows_out = len(df)
     print("Done!")
 
 if __name__ == "__main__":
@@ -0,0 +1,192 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+# Synthetic stand-in for the query.sql export: same columns, with pickups
+# and dropoffs clustered around Dhaka hotspots so that route counts, filters
+# and hex names behave like they do on real rides.
+
+# (name, lat, lon, weight, spread in degrees)
+HOTSPOTS = [
+    ('Gulshan', 23.7805, 90.4163, 10, 0.008),
+    ('Banani', 23.7937, 90.4066, 7, 0.006),
+    ('Uttara', 23.8759, 90.3795, 9, 0.012),
+    ('Mirpur', 23.8069, 90.3687, 10, 0.012),
+    ('Dhanmondi', 23.7465, 90.3760, 9, 0.008),
+    ('Farmgate', 23.7573, 90.3897, 7, 0.005),
+    ('Motijheel', 23.7330, 90.4172, 8, 0.007),
+    ('Mohakhali', 23.7780, 90.4050, 6, 0.005),
+    ('Badda', 23.7806, 90.4265, 6, 0.008),
+    ('Bashundhara', 23.8193, 90.4526, 6, 0.009),
+    ('Sadarghat', 23.7085, 90.4077, 4, 0.007),
+    ('Jatrabari', 23.7104, 90.4348, 5, 0.009),
+    ('Mohammadpur', 23.7662, 90.3589, 6, 0.008),
+    ('Airport', 23.8434, 90.3978, 4, 0.006),
+    ('New Market', 23.7334, 90.3844, 5, 0.005),
+    ('Rampura', 23.7613, 90.4208, 5, 0.006),
+    ('Khilgaon', 23.7515, 90.4250, 4, 0.006),
+    ('Tejgaon', 23.7639, 90.3925, 4, 0.006),
+    ('Shyamoli', 23.7748, 90.3657, 4, 0.005),
+    ('Malibagh', 23.7482, 90.4126, 4, 0.005),
+]
+# Rides that start or end anywhere in the city, not at a hotspot
+BACKGROUND = (23.68, 23.90, 90.33, 90.48)
+COLUMNS = ['hashed_id', 'estimated_pickup_latitude', 'estimated_pickup_longitude',
+           'estimated_dropoff_latitude', 'estimated_dropoff_longitude', 'created_at']
+# Relative ride volume per local (Dhaka) hour: morning and evening peaks
+HOURLY_WEIGHTS = [1, 0.6, 0.4, 0.3, 0.4, 1, 2.5, 5, 8, 8, 6, 5, 5, 5, 5, 5.5, 6.5, 8, 9, 8, 6, 4, 3, 2]
+# Same month as query.sql; Dhaka is UTC+6
+MONTH_START = np.datetime64('2025-11-01T00:00:00')
+MONTH_DAYS = 30
+UTC_OFFSET_HOURS = 6
+
+def parse_count(value):
+    """'100M', '10m', '250k' or '5000' -> int."""
+    value = str(value).strip().upper()
+    scale = {'K': 1_000, 'M': 1_000_000, 'B': 1_000_000_000}.get(value[-1:], 1)
+    return int(float(value[:-1] if scale > 1 else value) * scale)
+
+def _gravity():
+    """Dropoff hotspot probabilities for each pickup hotspot: busy and near destinations are likelier."""
+    lat = np.array([h[1] for h in HOTSPOTS])
+    lon = np.array([h[2] for h in HOTSPOTS])
+    weight = np.array([h[3] for h in HOTSPOTS], dtype=float)
+    km = np.hypot((lat[:, None] - lat[None, :]) * 111.0, (lon[:, None] - lon[None, :]) * 102.0)
+    attraction = weight[None, :] / (km + 2.0)
+    return attraction / attraction.sum(axis=1, keepdims=True)
+
+def _points(rng, spot, background_share):
+    """Lat/lon around the chosen hotspots, with a share spread over the whole city."""
+    lat = np.array([h[1] for h in HOTSPOTS])[spot]
+    lon = np.array([h[2] for h in HOTSPOTS])[spot]
+    spread = np.array([h[4] for h in HOTSPOTS])[spot]
+    lat = lat + rng.normal(0, 1, len(spot)) * spread
+    lon = lon + rng.normal(0, 1, len(spot)) * spread
+    anywhere = rng.random(len(spot)) < background_share
+    lat[anywhere] = rng.uniform(BACKGROUND[0], BACKGROUND[1], anywhere.sum())
+    lon[anywhere] = rng.uniform(BACKGROUND[2], BACKGROUND[3], anywhere.sum())
+    return lat, lon
+
+def _created_at(rng, n):
+    """UTC ride times spread over the month, following HOURLY_WEIGHTS in local time."""
+    hours = np.array(HOURLY_WEIGHTS, dtype=float)
+    local_hour = rng.choice(len(hours), n, p=hours / hours.sum())
+    seconds = (rng.integers(0, MONTH_DAYS, n) * 86400 + (local_hour - UTC_OFFSET_HOURS) * 3600
+               + rng.integers(0, 3600, n))
+    return MONTH_START + seconds.astype('timedelta64[s]')
+
+def generate_chunk(rng, n, gravity, background_share=0.1, missing_share=0.001, bad_share=0.0):
+    weight = np.array([h[3] for h in HOTSPOTS], dtype=float)
+    pickup = rng.choice(len(HOTSPOTS), n, p=weight / weight.sum())
+    dropoff = np.empty(n, dtype=np.int64)
+    for spot in range(len(HOTSPOTS)):
+        rows = np.flatnonzero(pickup == spot)
+        dropoff[rows] = rng.choice(len(HOTSPOTS), len(rows), p=gravity[spot])
+    p_lat, p_lon = _points(rng, pickup, background_share)
+    d_lat, d_lon = _points(rng, dropoff, background_share)
+
+    # Like the real export, a few rides have no estimated location
+    for column in (p_lat, p_lon, d_lat, d_lon):
+        column[rng.random(n) < missing_share / 4] = np.nan
+
+    ids = rng.integers(0, np.iinfo(np.int64).max, n, dtype=np.int64)
+    df = pd.DataFrame(dict(zip(COLUMNS, [
+        pd.Series(ids).map('{:016x}'.format), p_lat, p_lon, d_lat, d_lon, _created_at(rng, n),
+    ])))
+    if bad_share:
+        # Unparseable tokens, to check that readers drop them like missing values
+        for name in COLUMNS[1:5]:
+            bad = rng.random(n) < bad_share / 4
+            if bad.any():
+                # As text, so the CSV writers take the mixed column
+                text = pd.Series([repr(v) if v == v else '' for v in df[name].tolist()], dtype=object)
+                df[name] = text.where(~bad, 'invalid')
+    return df
+
+def _write_csv_rows(f, df):
+    """Appends df without a header. pyarrow writes the same text as to_csv, >10x faster."""
+    if pa_csv is None:
+        f.write(df.to_csv(index=False, header=False).encode())
+    else:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pa_csv.write_csv(table, f, pa_csv.WriteOptions(include_header=False, quoting_style='none'))
+
+def write_rides(path, rows, seed=42, chunk_rows=1_000_000, background_share=0.1, missing_share=0.001, bad_share=0.0):
+    """Streams `rows` synthetic rides to a CSV, one chunk in memory at a time."""
+    gravity = _gravity()
+    written = 0
+    with open(path, 'wb') as f:
+        f.write((','.join(COLUMNS) + '\n').encode())
+        for i in range(0, rows, chunk_rows):
+            # Each chunk has its own generator, seeded by its position
+            rng = np.random.default_rng([seed, i // chunk_rows])
+            chunk = generate_chunk(rng, min(chunk_rows, rows - i), gravity, background_share, missing_share, bad_share)
+            _write_csv_rows(f, chunk)
+            written += len(chunk)
+            print(f"  {written:,} / {rows:,} rides", flush=True)
+    return written
+
+def make_presets(n, seed=42, areas_per_hotspot=12):
+    """Preset routes between named areas near the hotspots, in preset.csv's layout."""
+    rng = np.random.default_rng(seed)
+    names, lat, lon = [], [], []
+    for name, h_lat, h_lon, _, spread in HOTSPOTS:
+        for k in range(areas_per_hotspot):
+            names.append(name if k == 0 else f"{name} Block {chr(ord('A') + k - 1)}")
+            lat.append(h_lat + rng.normal(0, spread))
+            lon.append(h_lon + rng.normal(0, spread))
+    lat, lon = np.array(lat), np.array(lon)
+    pairs = np.array([(a, b) for a in range(len(names)) for b in range(len(names)) if a != b])
+    pairs = pairs[np.sort(rng.choice(len(pairs), min(n, len(pairs)), replace=False))]
+    a, b = pairs[:, 0], pairs[:, 1]
+
+    # Road distance ~1.3x the straight line; bikes cut a few corners
+    km = np.hypot((lat[a] - lat[b]) * 111.0, (lon[a] - lon[b]) * 102.0) * 1.3
+    bike = km * rng.uniform(0.95, 1.0, len(km))
+    return pd.DataFrame({
+        'Pickup Area': np.array(names)[a],
+        'Popular Pickup Lat,Lon': [f"{x}, {y}" for x, y in zip(lat[a], lon[a])],
+        'Destination': np.array(names)[b],
+        'Popular Destination Lat, Lon': [f"{x}, {y}" for x, y in zip(lat[b], lon[b])],
+        'OSRM_distance_km_car': km.round(2),
+        'OSRM_distance_km_bike': bike.round(2),
+        'diff_car': np.nan,
+        'diff_bike': np.nan,
+    })
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic Dhaka rides in the query.sql layout.')
+    parser.add_argument('output_csv', nargs='?', default='big-data.csv', help='Output ride CSV')
+    parser.add_argument('--rows', default='1M', help='Number of rides, e.g. 1M, 10M, 100M')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk_rows', type=int, default=1_000_000, help='Rides generated and written per chunk')
+    parser.add_argument('--background_share', type=float, default=0.1, help='Share of ride ends placed anywhere in the city')
+    parser.add_argument('--missing_share', type=float, default=0.001, help='Share of rides with a missing coordinate')
+    parser.add_argument('--bad_share', type=float, default=0.0, help="Share of rides with an unparseable coordinate ('invalid')")
+    parser.add_argument('--presets_csv', default=None, help='Also write synthetic presets here (e.g. preset.csv)')
+    parser.add_argument('--presets', type=int, default=17000, help='Number of preset routes')
+
+    args = parser.parse_args(argv)
+    rows = parse_count(args.rows)
+
+    print(f"Writing {rows:,} synthetic rides to {args.output_csv}...")
+    start = time.perf_counter()
+    write_rides(args.output_csv, rows, args.seed, args.chunk_rows, args.background_share, args.missing_share, args.bad_share)
+    secs = time.perf_counter() - start
+    print(f"Done in {secs:.1f}s ({os.path.getsize(args.output_csv) / 1e6:.0f} MB)")
+
+    if args.presets_csv:
+        presets = make_presets(args.presets, args.seed)
+        presets.to_csv(args.presets_csv, index=False)
+        print(f"Saved {len(presets)} preset routes to {args.presets_csv}")
+
+if __name__ == "__main__":
+    main()
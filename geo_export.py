@@ -0,0 +1,409 @@
+"""
+GeoJSON export of a route-count table for visual review (QGIS, kepler.gl,
+a Leaflet/MapLibre page).
+
+Two layers, each streamed as GeoJSONSeq (one feature per line, which
+ogr2ogr, tippecanoe and kepler.gl read):
+- hexes: a Polygon per hex with rides_out / rides_in (rides starting and
+  ending there) and, with --names, its area_name
+- flows: a LineString per route from pickup to dropoff hex centroid, with
+  ride_count and, with --names, pickup_area_name / dropoff_area_name
+
+Boundaries and centroids are computed once per distinct hex and their
+GeoJSON text is cached, so writing a feature is a string join.
+
+With --tiles DIR, a zoom pyramid of GeoJSON tiles is built as well:
+
+    DIR/tiles.json                    zooms, hex resolution per zoom, bounds
+                                      of the data (stray hexes left out)
+    DIR/hexes/{z}/{x}/{y}.geojson     hexes whose centroid is in the tile
+    DIR/flows/{z}/{x}/{y}.geojson     the --max_flows busiest flows whose
+                                      line crosses the tile
+
+At zoom z the hexes are Hex-(z - 6), capped at the table's resolution:
+finer hexes and their flows are rolled up into their parents, so a
+zoomed-out map of a large month draws a few hundred features per tile.
+A flow is only tiled at zooms where its line crosses at most
+--max_flow_tiles tiles, so long flows (and strays to (0, 0)) are drawn
+zoomed out and the tile count stays close to the number of flows.
+Features are built tile by tile, a block at a time.
+(Mapbox vector tiles would need mapbox-vector-tile and protobuf; GeoJSON
+tiles load in Leaflet and MapLibre as they are.)
+
+    python geo_export.py hex8_route_counts_filtered.csv --names preset_with_names.csv
+    python geo_export.py hex8_route_counts.csv --flows '' --tiles hex8_tiles
+"""
+import argparse
+import json
+import os
+import shutil
+from itertools import islice
+import numpy as np
+import pandas as pd
+from hex_index import H3_NULL, cell_boundaries, cells_to_latlng, cells_to_str, get_resolution
+from route_counts import read_counts_csv, rollup_counts, route_columns
+from area_naming import read_names
+from metrics import instrumented, add_arguments, configure, stage
+
+# Decimal places of exported coordinates (about 0.1 m)
+PRECISION = 6
+# Tiles at zoom z show Hex-(z - ZOOM_RES_OFFSET)
+ZOOM_RES_OFFSET = 6
+# Web Mercator stops here
+MAX_LAT = 85.05112878
+TILES_FILE = 'tiles.json'
+# Features joined per write
+WRITE_BLOCK = 1 << 14
+# Most tiles one flow line is copied into at a zoom
+MAX_FLOW_TILES = 32
+# tiles.json bounds take the 1st-99th percentile box of the hex centroids,
+# widened by half its size (at least BOUNDS_MIN_MARGIN degrees), and cover
+# the hexes inside it
+BOUNDS_PERCENTILE = 1
+BOUNDS_MIN_MARGIN = 0.1
+
+# GeoJSON text of each cell's polygon and centroid, kept across calls
+_polygons = {}
+_points = {}
+_GEOMETRY_MEMO_MAX = 1 << 20
+
+
+def _position(lat, lng):
+    # GeoJSON positions are [lng, lat]
+    return f'[{lng:.{PRECISION}f},{lat:.{PRECISION}f}]'
+
+
+def _memoized(cells, memo, build):
+    """Text for each cell from `memo`, calling build(missing cells) once for the distinct misses."""
+    if len(memo) > _GEOMETRY_MEMO_MAX:
+        memo.clear()
+    codes, uniques = pd.factorize(np.asarray(cells, dtype=np.uint64))
+    uniques = uniques.tolist()
+    missing = [c for c in uniques if c not in memo]
+    memo.update(zip(missing, build(missing)))
+    return np.array([memo[c] for c in uniques], dtype=object)[codes] if len(codes) else np.empty(0, dtype=object)
+
+
+def polygon_geometries(cells):
+    """GeoJSON Polygon text of each (non-null) cell."""
+    def build(cells):
+        return ['{"type":"Polygon","coordinates":[[' + ','.join(_position(*v) for v in ring + ring[:1]) + ']]}'
+                for ring in cell_boundaries(cells)]
+    return _memoized(cells, _polygons, build)
+
+
+def centroid_positions(cells):
+    """GeoJSON [lng, lat] text of each (non-null) cell's centroid."""
+    def build(cells):
+        lat, lng = cells_to_latlng(cells)
+        return [_position(a, b) for a, b in zip(lat.tolist(), lng.tolist())]
+    return _memoized(cells, _points, build)
+
+
+def _feature(geometry, properties):
+    return '{"type":"Feature","geometry":' + geometry + ',"properties":' + json.dumps(properties, ensure_ascii=False) + '}'
+
+
+def hex_layer(counts, names=None):
+    """One row per hex (cell, rides_out, rides_in[, area_name]), busiest first."""
+    p = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+    d = counts.index.get_level_values(1).to_numpy(dtype=np.uint64)
+    rides = counts.to_numpy(dtype='int64')
+    cells = np.unique(np.concatenate([p, d]))
+    cells = cells[cells != H3_NULL]
+    hexes = pd.DataFrame({
+        'cell': cells,
+        'rides_out': np.bincount(np.searchsorted(cells, p[p != H3_NULL]), rides[p != H3_NULL], len(cells)).astype('int64'),
+        'rides_in': np.bincount(np.searchsorted(cells, d[d != H3_NULL]), rides[d != H3_NULL], len(cells)).astype('int64'),
+    })
+    if names is not None:
+        # object dtype, so missing names stay None (null in the GeoJSON)
+        hexes['area_name'] = pd.Series([names.get(c) for c in cells.tolist()], dtype=object)
+    order = np.lexsort((cells, -(hexes['rides_out'].to_numpy() + hexes['rides_in'].to_numpy())))
+    return hexes.iloc[order].reset_index(drop=True)
+
+
+def flow_layer(counts, names=None):
+    """One row per route (p, d, ride_count[, area names]) between non-null hexes, busiest first."""
+    flows = pd.DataFrame({
+        'p': counts.index.get_level_values(0).to_numpy(dtype=np.uint64),
+        'd': counts.index.get_level_values(1).to_numpy(dtype=np.uint64),
+        'ride_count': counts.to_numpy(dtype='int64'),
+    })
+    flows = flows[(flows['p'] != H3_NULL) & (flows['d'] != H3_NULL)]
+    if names is not None:
+        flows['pickup_area_name'] = pd.Series([names.get(c) for c in flows['p'].tolist()], index=flows.index, dtype=object)
+        flows['dropoff_area_name'] = pd.Series([names.get(c) for c in flows['d'].tolist()], index=flows.index, dtype=object)
+    order = np.lexsort((flows['d'].to_numpy(), flows['p'].to_numpy(), -flows['ride_count'].to_numpy()))
+    return flows.iloc[order].reset_index(drop=True)
+
+
+def hex_features(hexes, res):
+    """GeoJSON Feature text for each row of a hex_layer frame."""
+    geometries = polygon_geometries(hexes['cell'])
+    ids = cells_to_str(hexes['cell'])
+    names = hexes['area_name'].tolist() if 'area_name' in hexes else None
+    for i, (out, inn) in enumerate(zip(hexes['rides_out'].tolist(), hexes['rides_in'].tolist())):
+        properties = {'hex': ids[i], 'resolution': res, 'rides_out': out, 'rides_in': inn}
+        if names is not None:
+            properties['area_name'] = names[i]
+        yield _feature(geometries[i], properties)
+
+
+def flow_features(flows, res):
+    """GeoJSON Feature text for each row of a flow_layer frame."""
+    p_col, d_col = route_columns(res)
+    starts, ends = centroid_positions(flows['p']), centroid_positions(flows['d'])
+    p_ids, d_ids = cells_to_str(flows['p']), cells_to_str(flows['d'])
+    names = 'pickup_area_name' in flows
+    if names:
+        p_names, d_names = flows['pickup_area_name'].tolist(), flows['dropoff_area_name'].tolist()
+    for i, rides in enumerate(flows['ride_count'].tolist()):
+        properties = {p_col: p_ids[i], d_col: d_ids[i], 'ride_count': rides}
+        if names:
+            properties['pickup_area_name'], properties['dropoff_area_name'] = p_names[i], d_names[i]
+        yield _feature('{"type":"LineString","coordinates":[' + starts[i] + ',' + ends[i] + ']}', properties)
+
+
+def write_seq(features, path):
+    """Streams features to a GeoJSONSeq file (swapped in when complete); returns how many."""
+    n = 0
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        while True:
+            block = list(islice(features, WRITE_BLOCK))
+            if not block:
+                break
+            f.write('\n'.join(block) + '\n')
+            n += len(block)
+    os.replace(path + '.tmp', path)
+    return n
+
+
+def _tile_coords(lat, lng, z):
+    """Fractional Web Mercator tile column and row of each point at zoom z."""
+    n = 1 << z
+    lat = np.radians(np.clip(np.asarray(lat, dtype='float64'), -MAX_LAT, MAX_LAT))
+    x = (np.asarray(lng, dtype='float64') + 180) / 360 * n
+    y = (1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n
+    return x, y
+
+
+def _tile_index(v, z):
+    return np.clip(np.floor(v), 0, (1 << z) - 1).astype(np.int64)
+
+
+def tile_xy(lat, lng, z):
+    """Web Mercator (slippy map) tile column and row of each point at zoom z."""
+    x, y = _tile_coords(lat, lng, z)
+    return _tile_index(x, z), _tile_index(y, z)
+
+
+def zoom_resolution(z, res):
+    """Hex resolution drawn at zoom z for a table of Hex-`res` routes."""
+    return max(0, min(res, z - ZOOM_RES_OFFSET))
+
+
+def _tile_runs(x, y, limit=None):
+    """
+    Positions of the items (tile x, y) grouped by tile, keeping their order
+    within a tile and at most `limit` per tile, and where each tile starts.
+    """
+    order = np.lexsort((y, x))
+    if not len(order):
+        return order, order
+    x, y = x[order], y[order]
+    new = np.r_[True, (x[1:] != x[:-1]) | (y[1:] != y[:-1])]
+    if limit is not None:
+        starts = np.flatnonzero(new)
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+        order, new = order[rank < limit], new[rank < limit]
+    return order, np.flatnonzero(new)
+
+
+def _write_tiles(root, z, x, y, starts, features):
+    """
+    Writes FeatureCollection tiles root/z/x/y.geojson from tile-sorted items
+    (x, y, starts from _tile_runs) and an iterator of their features in the
+    same order. Returns the tile count.
+    """
+    ends = np.r_[starts[1:], len(x)]
+    for a, b in zip(starts.tolist(), ends.tolist()):
+        folder = os.path.join(root, str(z), str(x[a]))
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f'{y[a]}.geojson'), 'w', encoding='utf-8') as f:
+            f.write('{"type":"FeatureCollection","features":[\n')
+            f.write(',\n'.join(islice(features, b - a)))
+            f.write('\n]}\n')
+    return len(starts)
+
+
+def _block_features(build, frame, rows, res):
+    """build(frame, res) over the given rows of `frame`, WRITE_BLOCK rows at a time."""
+    for a in range(0, len(rows), WRITE_BLOCK):
+        yield from build(frame.iloc[rows[a:a + WRITE_BLOCK]], res)
+
+
+def _line_crossings(rows, c0, c1, f0, f1):
+    """
+    (row, position along the line, step) for each grid line a flow crosses
+    on one axis, stepping from tile c0 to c1 (f0, f1: fractional ends).
+    """
+    steps = np.abs(c1 - c0)[rows]
+    row = np.repeat(rows, steps)
+    k = np.arange(int(steps.sum())) - np.repeat(np.cumsum(steps) - steps, steps)
+    sign = np.sign(c1 - c0)[row]
+    # Going up, step k crosses the line c0 + k + 1; going down, c0 - k
+    line = c0[row] + sign * k + (sign > 0)
+    return row, (line - f0[row]) / (f1 - f0)[row], sign
+
+
+def _flow_tiles(flows, z, max_tiles=MAX_FLOW_TILES):
+    """
+    (flow row, tile x, tile y) for every tile each flow's line crosses, in
+    row order. Flows crossing more than `max_tiles` tiles are left out.
+    """
+    fx0, fy0 = _tile_coords(*cells_to_latlng(flows['p']), z)
+    fx1, fy1 = _tile_coords(*cells_to_latlng(flows['d']), z)
+    x0, y0, x1, y1 = (_tile_index(v, z) for v in (fx0, fy0, fx1, fy1))
+    kept = np.flatnonzero(np.abs(x1 - x0) + np.abs(y1 - y0) + 1 <= max_tiles)
+    rx, tx, sx = _line_crossings(kept, x0, x1, fx0, fx1)
+    ry, ty, sy = _line_crossings(kept, y0, y1, fy0, fy1)
+    # Walk each line from its pickup tile, one step per crossing in order
+    row = np.concatenate([kept, rx, ry])
+    t = np.concatenate([np.full(len(kept), -1.0), tx, ty])
+    dx = np.concatenate([np.zeros(len(kept), dtype=np.int64), sx, np.zeros(len(ry), dtype=np.int64)])
+    dy = np.concatenate([np.zeros(len(kept) + len(rx), dtype=np.int64), sy])
+    order = np.lexsort((t, row))
+    row, dx, dy = row[order], np.cumsum(dx[order]), np.cumsum(dy[order])
+    first = np.flatnonzero(np.r_[True, row[1:] != row[:-1]]) if len(row) else row
+    size = np.diff(np.r_[first, len(row)])
+    x = x0[row] + dx - np.repeat(dx[first], size)
+    y = y0[row] + dy - np.repeat(dy[first], size)
+    return row, x, y
+
+
+def _bounds(lat, lng):
+    """
+    [west, south, east, north] of the points, leaving out strays (e.g. a hex
+    at (0, 0) from unset GPS) far outside the central percentile box.
+    """
+    keep = np.ones(len(lat), dtype=bool)
+    for v in (lat, lng):
+        lo, hi = np.percentile(v, [BOUNDS_PERCENTILE, 100 - BOUNDS_PERCENTILE])
+        margin = max((hi - lo) / 2, BOUNDS_MIN_MARGIN)
+        keep &= (v >= lo - margin) & (v <= hi + margin)
+    lat, lng = lat[keep], lng[keep]
+    return [round(float(lng.min()), PRECISION), round(float(lat.min()), PRECISION),
+            round(float(lng.max()), PRECISION), round(float(lat.max()), PRECISION)]
+
+
+def build_tiles(counts, path, res, min_zoom, max_zoom, names=None, max_flows=500, max_flow_tiles=MAX_FLOW_TILES):
+    """
+    Writes the tile pyramid described above to the directory `path`,
+    replacing it. Returns the tiles.json contents.
+    """
+    tmp = path.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    levels = {}
+    meta = {'format': 'geojson', 'min_zoom': min_zoom, 'max_zoom': max_zoom, 'resolution': res,
+            'resolutions': {}, 'max_flows': max_flows, 'max_flow_tiles': max_flow_tiles,
+            'tiles': {'hexes': 0, 'flows': 0},
+            'layers': {'hexes': 'hexes/{z}/{x}/{y}.geojson', 'flows': 'flows/{z}/{x}/{y}.geojson'}}
+    try:
+        for z in range(min_zoom, max_zoom + 1):
+            r = zoom_resolution(z, res)
+            if r not in levels:
+                levels[r] = counts if r == res else rollup_counts(counts, r)
+            level_names = names if r == res else None
+            with stage('write', rows_in=len(levels[r])) as s:
+                hexes = hex_layer(levels[r], level_names)
+                x, y = tile_xy(*cells_to_latlng(hexes['cell']), z)
+                order, starts = _tile_runs(x, y)
+                n_hex = _write_tiles(os.path.join(tmp, 'hexes'), z, x[order], y[order], starts,
+                                     _block_features(hex_features, hexes, order, r))
+
+                flows = flow_layer(levels[r], level_names)
+                row, x, y = _flow_tiles(flows, z, max_flow_tiles)
+                # Rows are busiest first, so each tile keeps its busiest flows
+                order, starts = _tile_runs(x, y, max_flows)
+                n_flow = _write_tiles(os.path.join(tmp, 'flows'), z, x[order], y[order], starts,
+                                      _block_features(flow_features, flows, row[order], r))
+                tiled = len(np.unique(row))
+                s.rows_out = len(hexes) + tiled
+            meta['resolutions'][z] = r
+            meta['tiles']['hexes'] += n_hex
+            meta['tiles']['flows'] += n_flow
+            print(f"- zoom {z}: Hex-{r}, {len(hexes)} hexes in {n_hex} tiles, "
+                  f"{tiled} of {len(flows)} flows in {n_flow} tiles")
+        lat, lng = cells_to_latlng(hex_layer(counts)['cell'])
+        if len(lat):
+            meta['bounds'] = _bounds(lat, lng)
+        with open(os.path.join(tmp, TILES_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+    except BaseException:
+        # Leave any earlier pyramid in place
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return meta
+
+
+@instrumented('geo_export')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export route counts as GeoJSON hexes and flow lines, and optionally a tile pyramid.')
+    parser.add_argument('input_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='Route counts (pickup hex, dropoff hex, ride_count)')
+    parser.add_argument('--names', default=None, help='Area names from fetch_hex_names.py, e.g. preset_with_names.csv')
+    parser.add_argument('--hexes', default='route_hexes.geojsonl', help="GeoJSONSeq file for the hex polygons ('' to skip)")
+    parser.add_argument('--flows', default='route_flows.geojsonl', help="GeoJSONSeq file for the flow lines ('' to skip)")
+    parser.add_argument('--min_rides', type=int, default=1, help='Leave out routes with fewer rides')
+    parser.add_argument('--tiles', default=None, help='Also build a zoom pyramid of GeoJSON tiles in this directory')
+    parser.add_argument('--min_zoom', type=int, default=9, help='Lowest tile zoom')
+    parser.add_argument('--max_zoom', type=int, default=14, help='Highest tile zoom')
+    parser.add_argument('--max_flows', type=int, default=500, help='Busiest flow lines kept per tile')
+    parser.add_argument('--max_flow_tiles', type=int, default=MAX_FLOW_TILES,
+                        help='Tile a flow only at zooms where its line crosses at most this many tiles')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
+
+    for path in (args.input_csv, args.names):
+        if path and not os.path.exists(path):
+            print(f"Error: {path} not found.")
+            return
+    if args.tiles and not 0 <= args.min_zoom <= args.max_zoom <= 22:
+        print("Error: zooms must satisfy 0 <= --min_zoom <= --max_zoom <= 22.")
+        return
+
+    print(f"Reading {args.input_csv}...")
+    with stage('read') as s:
+        counts = read_counts_csv(args.input_csv)
+        counts = counts[counts >= args.min_rides]
+        names = read_names(args.names) if args.names else None
+        s.rows_out = len(counts)
+    cells = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+    res = int(get_resolution(cells[cells != H3_NULL][:1])[0]) if (cells != H3_NULL).any() else 8
+
+    with stage('enrich', rows_in=len(counts)) as s:
+        hexes = hex_layer(counts, names)
+        flows = flow_layer(counts, names)
+        s.rows_out = len(hexes) + len(flows)
+
+    for layer, path, features in (('hexes', args.hexes, hex_features(hexes, res)),
+                                  ('flows', args.flows, flow_features(flows, res))):
+        if path:
+            with stage('write', rows_in=len(hexes if layer == 'hexes' else flows)) as s:
+                n = s.rows_out = write_seq(features, path)
+            print(f"Saved {n} Hex-{res} {layer} to {path}")
+
+    if args.tiles:
+        print(f"Building zoom {args.min_zoom}-{args.max_zoom} tiles in {args.tiles}...")
+        meta = build_tiles(counts, args.tiles, res, args.min_zoom, args.max_zoom, names, args.max_flows,
+                           args.max_flow_tiles)
+        print(f"Saved {meta['tiles']['hexes']} hex and {meta['tiles']['flows']} flow tiles")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Persistent cache for short-address lookups, keyed by H3 cell.
+
+A hex's centroid never moves, so its name only needs to be fetched once.
+Entries live in a small SQLite file: the name, when it was fetched, and
+whether the API came back empty (a negative result, kept for a shorter TTL
+so it gets retried eventually). WAL mode plus a busy timeout lets several
+processes share the file.
+"""
+import sqlite3
+import time
+
+DEFAULT_CACHE_PATH = 'hex_names_cache.sqlite'
+DAY = 86400.0
+
+
+class GeocodeCache:
+    """SQLite-backed {cell: name} cache with TTLs and size-based eviction."""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_days=None, negative_ttl_days=7, max_entries=None, timeout=30.0):
+        self.path = path
+        self.ttl = ttl_days * DAY if ttl_days else None
+        self.negative_ttl = negative_ttl_days * DAY if negative_ttl_days else None
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS names ('
+            ' cell INTEGER PRIMARY KEY,'
+            ' name TEXT,'
+            ' fetched_at REAL NOT NULL,'
+            ' negative INTEGER NOT NULL DEFAULT 0)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS names_fetched_at ON names (fetched_at)')
+
+    def _is_fresh(self, fetched_at, negative, now):
+        ttl = self.negative_ttl if negative else self.ttl
+        return ttl is None or now - fetched_at < ttl
+
+    def get_many(self, cells):
+        """
+        Returns {cell: name} for every cell with a fresh entry. Negative
+        entries come back as None; cells missing from the result need a fetch.
+        """
+        now = time.time()
+        found = {}
+        cells = [int(c) for c in cells]
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(cells), 900):
+            batch = cells[start:start + 900]
+            rows = self.conn.execute(
+                f'SELECT cell, name, fetched_at, negative FROM names WHERE cell IN ({",".join("?" * len(batch))})',
+                batch,
+            )
+            for cell, name, fetched_at, negative in rows:
+                if self._is_fresh(fetched_at, negative, now):
+                    found[cell] = None if negative else name
+        return found
+
+    def get(self, cell):
+        """Returns (hit, name) for one cell."""
+        found = self.get_many([cell])
+        return (int(cell) in found), found.get(int(cell))
+
+    def put_many(self, items):
+        """Stores {cell: name} (or (cell, name) pairs); a None name is a negative result."""
+        items = items.items() if hasattr(items, 'items') else items
+        now = time.time()
+        rows = [(int(cell), name, now, int(not name)) for cell, name in items]
+        if not rows:
+            return
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO names (cell, name, fetched_at, negative) VALUES (?, ?, ?, ?)', rows
+            )
+        self.evict()
+
+    def put(self, cell, name):
+        self.put_many([(cell, name)])
+
+    def evict(self):
+        """Drops expired entries, then the oldest ones beyond max_entries."""
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if self.ttl is not None:
+                self.conn.execute('DELETE FROM names WHERE negative = 0 AND fetched_at < ?', (now - self.ttl,))
+            if self.negative_ttl is not None:
+                self.conn.execute('DELETE FROM names WHERE negative = 1 AND fetched_at < ?', (now - self.negative_ttl,))
+            if self.max_entries:
+                self.conn.execute(
+                    'DELETE FROM names WHERE cell IN '
+                    '(SELECT cell FROM names ORDER BY fetched_at DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,),
+                )
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM names').fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
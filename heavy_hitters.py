@@ -0,0 +1,268 @@
+"""
+Approximate route counts in fixed memory, for ride streams whose exact
+(pickup, dropoff) table does not fit.
+
+One pass over the rides feeds two mergeable sketches:
+
+- SpaceSaving keeps at most `capacity` candidate routes. For every kept
+  route, count - error <= true rides <= count, and error <= N / capacity
+  for N rides. A route that is not kept has at most `floor` rides (the
+  smallest kept count, once anything was evicted). So every route with more
+  than `floor` rides is a candidate.
+- Count-Min keeps `depth` rows of `width` counters. Its estimate never
+  undercounts. With probability 1 - exp(-depth) it overcounts by at most
+  e / width * N. A candidate's reported count is the smaller of the two
+  upper bounds.
+
+Each chunk is counted exactly first (count_pairs) and then folded into both
+sketches, so the per-ride work is the same vectorized indexing as the exact
+path. Memory is the sketches plus one chunk. Sketches from --workers shards
+merge like exact tables.
+"""
+import math
+import numpy as np
+import pandas as pd
+from route_counts import index_rides, count_pairs
+from metrics import stage, timed_chunks
+
+# Mixes the pickup cell into the dropoff cell to make one Count-Min key
+PAIR_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _empty_counts():
+    index = pd.MultiIndex.from_arrays([np.empty(0, dtype=np.uint64)] * 2, names=['p', 'd'])
+    return pd.Series(np.empty(0, dtype=np.int64), index=index)
+
+
+def _cells(counts):
+    return (counts.index.get_level_values(0).to_numpy(dtype=np.uint64),
+            counts.index.get_level_values(1).to_numpy(dtype=np.uint64))
+
+
+class CountMinSketch:
+    """depth x width uint32 counters; width is rounded up to a power of two."""
+
+    def __init__(self, width=1 << 20, depth=4, seed=0):
+        self.bits = max(1, math.ceil(math.log2(width)))
+        self.width = 1 << self.bits
+        self.depth = depth
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hashing: odd multipliers, top `bits` bits of the product
+        self.a = rng.integers(0, 2**64, depth, dtype=np.uint64, endpoint=False) | np.uint64(1)
+        self.b = rng.integers(0, 2**64, depth, dtype=np.uint64, endpoint=False)
+        self.table = np.zeros((depth, self.width), dtype=np.uint32)
+        self.total = 0
+
+    def _buckets(self, p_cells, d_cells):
+        keys = (p_cells * PAIR_MIX) ^ d_cells
+        return ((keys[None, :] * self.a[:, None] + self.b[:, None]) >> np.uint64(64 - self.bits)).astype(np.intp)
+
+    def add(self, p_cells, d_cells, counts):
+        for row, buckets in enumerate(self._buckets(p_cells, d_cells)):
+            self.table[row] += np.bincount(buckets, weights=counts, minlength=self.width).astype(np.uint32)
+        self.total += int(counts.sum())
+
+    def estimate(self, p_cells, d_cells):
+        buckets = self._buckets(p_cells, d_cells)
+        return self.table[np.arange(self.depth)[:, None], buckets].min(axis=0).astype(np.int64)
+
+    def merge(self, other):
+        if (self.width, self.depth, self.seed) != (other.width, other.depth, other.seed):
+            raise ValueError("Count-Min sketches with different shapes or seeds cannot be merged")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def error_bound(self):
+        """(max overcount, probability the bound holds for a given route)."""
+        return math.e / self.width * self.total, 1 - math.exp(-self.depth)
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+class SpaceSaving:
+    """At most `capacity` routes with upper-bound counts and per-route error."""
+
+    def __init__(self, capacity=100_000):
+        self.capacity = capacity
+        self.counts = _empty_counts()
+        self.errors = _empty_counts()
+        self.total = 0
+        self.evicted = False
+
+    @property
+    def floor(self):
+        """Upper bound on the rides of any route that is not kept."""
+        return int(self.counts.min()) if self.evicted and len(self.counts) else 0
+
+    def update(self, counts):
+        """Folds in exact counts for one chunk (a count_pairs table)."""
+        exact = SpaceSaving(self.capacity)
+        exact.counts = counts.astype(np.int64)
+        exact.errors = pd.Series(np.zeros(len(counts), dtype=np.int64), index=counts.index)
+        exact.total = int(counts.sum())
+        return self.merge(exact)
+
+    def merge(self, other):
+        # A route one side does not hold may still have had up to that side's floor
+        counts = self.counts.add(other.counts, fill_value=0).astype(np.int64)
+        errors = self.errors.add(other.errors, fill_value=0).astype(np.int64)
+        for side in (self, other):
+            floor = side.floor
+            if floor:
+                missing = ~counts.index.isin(side.counts.index)
+                counts[missing] += floor
+                errors[missing] += floor
+        self.total += other.total
+        self.evicted = self.evicted or other.evicted
+
+        if len(counts) > self.capacity:
+            keep = np.sort(np.argpartition(-counts.to_numpy(), self.capacity - 1)[:self.capacity])
+            counts, errors = counts.iloc[keep], errors.iloc[keep]
+            self.evicted = True
+        self.counts, self.errors = counts, errors
+        return self
+
+    @property
+    def nbytes(self):
+        return int(self.counts.memory_usage(index=True, deep=True) + self.errors.memory_usage(index=False))
+
+
+class RouteSketch:
+    """SpaceSaving candidates plus a Count-Min sketch over the same rides."""
+
+    def __init__(self, capacity=100_000, width=1 << 20, depth=4, seed=0):
+        self.space_saving = SpaceSaving(capacity)
+        self.count_min = CountMinSketch(width, depth, seed)
+
+    def __len__(self):
+        return len(self.space_saving.counts)
+
+    @property
+    def total(self):
+        return self.space_saving.total
+
+    @property
+    def nbytes(self):
+        return self.space_saving.nbytes + self.count_min.nbytes
+
+    def update(self, counts):
+        """Folds in one chunk's exact route counts."""
+        p_cells, d_cells = _cells(counts)
+        self.count_min.add(p_cells, d_cells, counts.to_numpy(dtype=np.int64))
+        self.space_saving.update(counts)
+        return self
+
+    def merge(self, other):
+        self.count_min.merge(other.count_min)
+        self.space_saving.merge(other.space_saving)
+        return self
+
+    def candidates(self):
+        """DataFrame of kept routes with ride_count (best upper bound) and ride_count_min (lower bound)."""
+        ss = self.space_saving
+        p_cells, d_cells = _cells(ss.counts)
+        upper = np.minimum(ss.counts.to_numpy(), self.count_min.estimate(p_cells, d_cells))
+        return pd.DataFrame({
+            'ride_count': upper,
+            'ride_count_min': (ss.counts - ss.errors).to_numpy(),
+        }, index=ss.counts.index)
+
+    def heavy_routes(self, min_rides=None, top_k=None):
+        """
+        Route counts (estimates) in count_pairs' layout: routes estimated at
+        >= min_rides, or the top_k by estimate, or all candidates.
+        """
+        found = self.candidates()['ride_count']
+        if min_rides is not None:
+            found = found[found >= min_rides]
+        if top_k is not None and len(found) > top_k:
+            found = found.iloc[np.sort(np.argsort(-found.to_numpy(), kind='stable')[:top_k])]
+        return found.rename('ride_count')
+
+    def bounds(self, min_rides=None):
+        """Error bounds for the current stream, for printing or a report."""
+        ss, cm = self.space_saving, self.count_min
+        cm_over, cm_prob = cm.error_bound()
+        out = {
+            'rides': ss.total,
+            'capacity': ss.capacity,
+            'candidates': len(ss.counts),
+            'floor': ss.floor,
+            'space_saving_max_overcount': ss.total / ss.capacity,
+            'count_min_width': cm.width,
+            'count_min_depth': cm.depth,
+            'count_min_max_overcount': cm_over,
+            'count_min_confidence': cm_prob,
+            'sketch_mb': self.nbytes / 1e6,
+        }
+        if min_rides is not None:
+            # Routes not kept have at most `floor` rides, so none at or over min_rides is missing
+            out['complete'] = ss.floor < min_rides
+        return out
+
+
+def sketch_routes(chunks, res, capacity=100_000, width=1 << 20, depth=4, seed=0):
+    """Like count_routes, but returns a RouteSketch of the rides instead of the exact table."""
+    sketch = RouteSketch(capacity, width, depth, seed)
+    for df in timed_chunks(chunks):
+        with stage('index', rows_in=len(df)) as s:
+            p_cells, d_cells = index_rides(df, res)
+            s.rows_out = len(p_cells)
+        del df
+        with stage('group', rows_in=len(p_cells)) as s:
+            sketch.update(count_pairs(p_cells, d_cells))
+            s.rows_out = len(sketch)
+    return sketch
+
+
+def validate(sketch, exact, min_rides=None, top_k=None):
+    """
+    Compares heavy_routes(min_rides, top_k) with the exact route counts.
+    Returns a report dict: recall and precision of the route set, count
+    errors on the routes found, and whether the documented bounds held.
+    """
+    found = sketch.heavy_routes(min_rides, top_k)
+    if top_k is not None:
+        ranked = exact.iloc[np.argsort(-exact.to_numpy(), kind='stable')]
+        truth = ranked[ranked >= ranked.iloc[min(top_k, len(ranked)) - 1]] if len(ranked) else ranked
+        if min_rides is not None:
+            truth = truth[truth >= min_rides]
+    else:
+        truth = exact[exact >= (min_rides or 1)]
+
+    hits = found.index.isin(truth.index)
+    true_found = exact.reindex(found.index).fillna(0).to_numpy(dtype=np.int64)
+    over = found.to_numpy() - true_found
+    candidates = sketch.candidates()
+    true_candidates = exact.reindex(candidates.index).fillna(0).to_numpy(dtype=np.int64)
+    bounds = sketch.bounds(min_rides)
+    report = dict(bounds, **{
+        'mode': 'top_k' if top_k is not None else 'threshold',
+        'min_rides': min_rides,
+        'top_k': top_k,
+        'exact_routes': len(exact),
+        'exact_table_mb': exact.memory_usage(index=True, deep=True) / 1e6,
+        'true_routes': len(truth),
+        'found_routes': len(found),
+        # Ties at the K-th count all count as true top-K routes
+        'recall': float(hits.sum() / min(len(truth), top_k or len(truth))) if len(truth) else 1.0,
+        'precision': float(hits.mean()) if len(found) else 1.0,
+        'missed': int(min(len(truth), top_k or len(truth)) - hits.sum()),
+        'false_positives': int((~hits).sum()),
+        'exact_counts': int((over == 0).sum()),
+        'max_overcount': int(over.max()) if len(over) else 0,
+        'mean_overcount': float(over.mean()) if len(over) else 0.0,
+        # Never below the truth, within N / capacity, lower bounds really below
+        'bounds_held': bool((over >= 0).all()
+                            and (over <= bounds['space_saving_max_overcount']).all()
+                            and (candidates['ride_count_min'].to_numpy() <= true_candidates).all()
+                            and (true_candidates <= candidates['ride_count'].to_numpy()).all()),
+    })
+    if min_rides is not None and top_k is None:
+        # With a floor under min_rides nothing can be missed
+        report['complete_and_no_misses'] = bool(not bounds['complete'] or report['missed'] == 0)
+    return report
@@ -0,0 +1,291 @@
+"""
+Batch H3 indexing shared by the pipeline scripts.
+
+Cells are handled as uint64 arrays (0 is H3's null cell) together with a
+boolean validity mask, and only turned into the usual 15-character hex
+strings where a script writes them out. The h3-py v3/v4 API is picked once
+at import time instead of on every call.
+"""
+import warnings
+from itertools import repeat
+import numpy as np
+import pandas as pd
+import h3
+from h3.api import basic_int as h3_int
+
+# Supports both h3-py v3 and v4
+if hasattr(h3, 'latlng_to_cell'):
+    _latlng_to_cell = h3_int.latlng_to_cell
+    _cell_to_latlng = h3_int.cell_to_latlng
+    _cell_to_boundary = h3_int.cell_to_boundary
+    _cell_to_local_ij = h3_int.cell_to_local_ij
+    _grid_distance = h3_int.grid_distance
+    _grid_disk = h3_int.grid_disk
+else:
+    _latlng_to_cell = h3_int.geo_to_h3
+    _cell_to_latlng = h3_int.h3_to_geo
+    _cell_to_boundary = h3_int.h3_to_geo_boundary
+    _cell_to_local_ij = h3_int.experimental_h3_to_local_ij
+    _grid_distance = h3_int.h3_distance
+    _grid_disk = h3_int.k_ring
+
+# h3-py v3 ships a vectorized geo_to_h3 under h3.unstable; v4 has no equivalent
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from h3.unstable import vect as _h3_vect
+except ImportError:
+    _h3_vect = None
+
+H3_NULL = np.uint64(0)
+
+# Bit layout of an H3 cell index: resolution in bits 52-55, then one 3-bit
+# digit per resolution 1..15 with unused digits set to 7
+_RES_SHIFT = np.uint64(52)
+_RES_MASK = np.uint64(0xF) << _RES_SHIFT
+
+# Distinct points indexed per batch of scalar h3 calls
+_SCALAR_BLOCK = 1 << 16
+
+# Centroids already computed in this process, kept across calls (and across
+# stages run by pipeline.py); cleared once it holds this many cells
+_centroids = {}
+_CENTROID_MEMO_MAX = 1 << 20
+# Same for cell boundaries
+_boundaries = {}
+
+
+def to_float_array(values):
+    """Coerces a column to float64, turning unparseable entries into NaN."""
+    return np.asarray(pd.to_numeric(values, errors='coerce'), dtype='float64')
+
+
+def valid_latlng_mask(lat, lng):
+    """True where lat/lng are finite and inside the valid degree ranges."""
+    with np.errstate(invalid='ignore'):
+        return (
+            np.isfinite(lat) & np.isfinite(lng)
+            & (np.abs(lat) <= 90.0) & (np.abs(lng) <= 180.0)
+        )
+
+
+def latlng_to_cells(lat, lng, res):
+    """
+    Indexes whole lat/lng columns at resolution `res`.
+    Returns (cells, valid): a uint64 array of cells (0 where invalid) and the
+    validity mask. Each distinct coordinate pair is only indexed once.
+    """
+    lat = to_float_array(lat)
+    lng = to_float_array(lng)
+    valid = valid_latlng_mask(lat, lng)
+    cells = np.zeros(len(lat), dtype=np.uint64)
+    if not valid.any():
+        return cells, valid
+
+    # Pack each pair into one complex number so pandas can hash it in one pass
+    codes, uniques = pd.factorize(lat[valid] + 1j * lng[valid])
+    if _h3_vect is not None:
+        unique_cells = _h3_vect.geo_to_h3(
+            np.ascontiguousarray(uniques.real), np.ascontiguousarray(uniques.imag), res
+        ).astype(np.uint64)
+    else:
+        # In blocks, so the temporary Python floats and ints stay small
+        unique_cells = np.empty(len(uniques), dtype=np.uint64)
+        for start in range(0, len(uniques), _SCALAR_BLOCK):
+            block = uniques[start:start + _SCALAR_BLOCK]
+            unique_cells[start:start + len(block)] = np.fromiter(
+                map(_latlng_to_cell, block.real.tolist(), block.imag.tolist(), repeat(res)),
+                dtype=np.uint64, count=len(block),
+            )
+    cells[valid] = unique_cells[codes]
+    return cells, valid
+
+
+def latlng_to_cell(lat, lng, res):
+    """Scalar version of latlng_to_cells for online callers: an int cell, 0 if invalid. No pandas involved."""
+    try:
+        lat, lng = float(lat), float(lng)
+    except (TypeError, ValueError):
+        return 0
+    if not (abs(lat) <= 90.0 and abs(lng) <= 180.0):
+        return 0
+    return _latlng_to_cell(lat, lng, res)
+
+
+def parse_latlng_strings(values):
+    """Splits a column of 'Lat, Lon' strings into two float arrays (NaN if unparseable)."""
+    # Preset locations repeat a lot, so only distinct strings are parsed
+    codes, uniques = pd.factorize(pd.Series(values, dtype='object').astype(str))
+    parts = pd.Series(uniques, dtype='object').str.split(',', n=1, expand=True)
+    for missing in range(parts.shape[1], 2):
+        parts[missing] = None
+    lat = to_float_array(parts[0].str.strip())
+    lng = to_float_array(parts[1].str.strip())
+    return lat[codes], lng[codes]
+
+
+def latlng_strings_to_cells(values, res):
+    """Same as latlng_to_cells, for a column of 'Lat, Lon' strings."""
+    lat, lng = parse_latlng_strings(values)
+    return latlng_to_cells(lat, lng, res)
+
+
+def cells_to_str(cells, valid=None):
+    """Converts uint64 cells to hex strings (object array, None where invalid)."""
+    cells = np.asarray(cells, dtype=np.uint64)
+    if valid is None:
+        valid = cells != H3_NULL
+    codes, uniques = pd.factorize(cells)
+    names = np.array([format(int(c), 'x') for c in uniques], dtype=object)
+    out = names[codes] if len(cells) else np.empty(0, dtype=object)
+    out[~valid] = None
+    return out
+
+
+def str_to_cells(values):
+    """Converts hex strings back to uint64 cells (0 for missing or malformed)."""
+    codes, uniques = pd.factorize(pd.Series(values, dtype='object'))
+    parsed = np.zeros(len(uniques) + 1, dtype=np.uint64)
+    for i, s in enumerate(uniques):
+        try:
+            parsed[i] = int(s, 16)
+        except (TypeError, ValueError):
+            pass
+    # factorize marks missing values with -1, which picks the trailing 0
+    return parsed[codes]
+
+
+def get_resolution(cells):
+    """Resolution of each cell as a uint8 array."""
+    cells = np.asarray(cells, dtype=np.uint64)
+    return ((cells & _RES_MASK) >> _RES_SHIFT).astype(np.uint8)
+
+
+def cell_to_parent(cells, res):
+    """
+    Vectorized H3 parent lookup: rewrites the resolution field and blanks the
+    finer digits, which is exactly what h3's cell_to_parent does.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    valid = cells != H3_NULL
+    if valid.any() and get_resolution(cells[valid]).min() < res:
+        raise ValueError(f"Cannot take a res-{res} parent of a coarser cell")
+    unused_digits = np.uint64((1 << ((15 - res) * 3)) - 1)
+    parents = (cells & ~_RES_MASK) | (np.uint64(res) << _RES_SHIFT) | unused_digits
+    return np.where(valid, parents, H3_NULL)
+
+
+def cells_to_latlng(cells):
+    """
+    Returns (lat, lng) float arrays of cell centroids (NaN for null cells).
+    Centroids are computed once per distinct cell and broadcast back.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    codes, uniques = pd.factorize(cells)
+    lat = np.full(len(uniques), np.nan)
+    lng = np.full(len(uniques), np.nan)
+    if len(_centroids) > _CENTROID_MEMO_MAX:
+        _centroids.clear()
+    for i, c in enumerate(uniques.tolist()):
+        if c:
+            latlng = _centroids.get(c)
+            if latlng is None:
+                latlng = _centroids[c] = _cell_to_latlng(c)
+            lat[i], lng[i] = latlng
+    return lat[codes], lng[codes]
+
+
+def cell_boundaries(cells):
+    """
+    The boundary of each cell as a tuple of (lat, lng) vertices (None for
+    null cells), memoized like the centroids.
+    """
+    if len(_boundaries) > _CENTROID_MEMO_MAX:
+        _boundaries.clear()
+    out = []
+    for c in np.asarray(cells, dtype=np.uint64).tolist():
+        ring = _boundaries.get(c) if c else None
+        if c and ring is None:
+            ring = _boundaries[c] = tuple(_cell_to_boundary(c))
+        out.append(ring)
+    return out
+
+
+def cells_to_local_ij(cells, origin=None):
+    """
+    Returns (i, j, ok): each cell's coordinates in the local IJ frame of
+    `origin` (default: the first non-null cell). ok is False for null cells
+    and for cells H3 cannot place in that frame (too far away, or across a
+    pentagon). One h3 call per distinct cell.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    codes, uniques = pd.factorize(cells)
+    i = np.zeros(len(uniques), dtype=np.int64)
+    j = np.zeros(len(uniques), dtype=np.int64)
+    ok = np.zeros(len(uniques), dtype=bool)
+    if origin is None:
+        nonnull = uniques[uniques != H3_NULL]
+        origin = nonnull[0] if len(nonnull) else H3_NULL
+    origin = int(origin)
+    if origin:
+        for k, c in enumerate(uniques.tolist()):
+            if c:
+                try:
+                    i[k], j[k] = _cell_to_local_ij(origin, c)
+                    ok[k] = True
+                except Exception:
+                    pass
+    return i[codes], j[codes], ok[codes]
+
+
+def ij_distance(i1, j1, i2, j2):
+    """Grid distance between local IJ coordinates (broadcasts, so it works on blocks)."""
+    di = np.subtract(i1, i2)
+    dj = np.subtract(j1, j2)
+    return np.maximum(np.maximum(np.abs(di), np.abs(dj)), np.abs(di - dj))
+
+
+def grid_distances(a, b):
+    """
+    H3 grid distance (cell steps) between a[k] and b[k], as int64; -1 where
+    H3 has none (null cells, mixed resolutions, or cells too far apart).
+    Both arrays share one local IJ frame, so most pairs cost no h3 call;
+    pairs outside the frame fall back to h3's own grid distance.
+    """
+    a = np.asarray(a, dtype=np.uint64)
+    b = np.asarray(b, dtype=np.uint64)
+    i, j, ok = cells_to_local_ij(np.concatenate([a, b]))
+    n = len(a)
+    dist = ij_distance(i[:n], j[:n], i[n:], j[n:])
+    same_res = get_resolution(a) == get_resolution(b)
+    dist = np.where(ok[:n] & ok[n:] & same_res, dist, -1)
+
+    retry = (dist < 0) & (a != H3_NULL) & (b != H3_NULL) & same_res
+    if retry.any():
+        pairs = pd.MultiIndex.from_arrays([a[retry], b[retry]])
+        codes, uniques = pd.factorize(pairs)
+        found = np.full(len(uniques), -1, dtype=np.int64)
+        for k, (x, y) in enumerate(uniques):
+            try:
+                found[k] = _grid_distance(int(x), int(y))
+            except Exception:
+                pass
+        dist[retry] = found[codes]
+    return dist
+
+
+def grid_disks(cells, k):
+    """
+    Every cell within k steps of each non-null cell, flattened: returns
+    (position in `cells`, neighbouring cell) arrays. Includes the cell itself.
+    """
+    cells = np.asarray(cells, dtype=np.uint64)
+    sources, neighbours = [], []
+    for pos, c in enumerate(cells.tolist()):
+        if c:
+            disk = list(_grid_disk(c, k))
+            sources.append(np.full(len(disk), pos, dtype=np.int64))
+            neighbours.append(np.array(disk, dtype=np.uint64))
+    if not sources:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    return np.concatenate(sources), np.concatenate(neighbours)
@@ -0,0 +1,145 @@
+"""
+Neighbour-tolerant lookups of (pickup, dropoff) hex pairs in a RouteIndex.
+
+A preset whose point sits just across a hex boundary from a busy corridor
+misses the exact pair lookup. With a tolerance of k, any lane whose pickup
+is within k grid steps of the preset's pickup hex and whose dropoff is
+within k steps of its dropoff hex matches.
+
+Probing every pair of two k-rings costs (3k^2 + 3k + 1)^2 lookups per preset.
+Instead, a NeighbourIndex is built once per lane end over the cells that
+actually carry lanes: for every cell within k steps of an active cell it
+lists those active cells, nearest first (CSR arrays, searched with
+np.searchsorted). A query then only pairs the active neighbours of each
+end, ring by ring in order of total shift, and stops at the first shift
+that finds a lane. Presets are matched per distinct hex pair, in blocks,
+with batch RouteIndex lookups.
+"""
+import numpy as np
+import pandas as pd
+from hex_index import H3_NULL, grid_disks, grid_distances
+
+# Distinct preset hex pairs matched per block
+MATCH_BLOCK = 1 << 16
+
+
+def _ragged_arange(starts, counts):
+    """Concatenation of arange(start, start + count) for each pair."""
+    total = int(counts.sum())
+    if not total:
+        return np.empty(0, dtype=np.int64)
+    shifts = np.repeat(starts - np.concatenate([[0], np.cumsum(counts)[:-1]]), counts)
+    return np.arange(total, dtype=np.int64) + shifts
+
+
+class NeighbourIndex:
+    """For any cell, the active cells within k grid steps of it, nearest first."""
+
+    def __init__(self, cells, offsets, members, distances, k):
+        self.cells = cells
+        self.offsets = offsets
+        self.members = members
+        self.distances = distances
+        self.k = k
+
+    @classmethod
+    def build(cls, active, k):
+        active = np.unique(np.asarray(active, dtype=np.uint64))
+        active = active[active != H3_NULL]
+        source, near = grid_disks(active, k)
+        members = active[source]
+        distances = grid_distances(members, near)
+        # By covered cell, then nearest active cell first, then cell order
+        order = np.lexsort((members, distances, near))
+        near, members, distances = near[order], members[order], distances[order]
+        cells, starts = np.unique(near, return_index=True)
+        offsets = np.append(starts, len(near)).astype(np.int64)
+        return cls(cells, offsets, members, distances.astype(np.int8 if k < 128 else np.int64), k)
+
+    def __len__(self):
+        return len(self.cells)
+
+    def neighbours(self, query):
+        """(query position, active cell, grid distance) for every active cell near each queried cell."""
+        query = np.asarray(query, dtype=np.uint64)
+        if not len(self.cells):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.cells, query), len(self.cells) - 1)
+        hit = self.cells[pos] == query
+        starts = self.offsets[pos]
+        counts = np.where(hit, self.offsets[pos + 1] - starts, 0)
+        at = _ragged_arange(starts, counts)
+        return np.repeat(np.arange(len(query)), counts), self.members[at], self.distances[at].astype(np.int64)
+
+
+class LaneMatcher:
+    """A RouteIndex plus neighbour indexes over its pickup and dropoff cells."""
+
+    def __init__(self, routes, k):
+        self.routes = routes
+        self.k = k
+        self.pickups = NeighbourIndex.build(routes.p_cells, k)
+        self.dropoffs = NeighbourIndex.build(routes.d_cells, k)
+
+    def _match_block(self, p, d):
+        q_p, lane_p, shift_p = self.pickups.neighbours(p)
+        q_d, lane_d, shift_d = self.dropoffs.neighbours(d)
+        pending = np.ones(len(p), dtype=bool)
+        found = []
+        # Widen the total shift one step at a time, pairing only the rings
+        # at that distance, so most presets stop after a few small joins
+        for total in range(1, 2 * self.k + 1):
+            step = []
+            for a in range(max(0, total - self.k), min(total, self.k) + 1):
+                at_p = (shift_p == a) & pending[q_p]
+                at_d = (shift_d == total - a) & pending[q_d]
+                if not (at_p.any() and at_d.any()):
+                    continue
+                near = pd.DataFrame({'q': q_p[at_p], 'p': lane_p[at_p]}).merge(
+                    pd.DataFrame({'q': q_d[at_d], 'd': lane_d[at_d]}), on='q')
+                rides = self.routes.lookup(near['p'].to_numpy(dtype=np.uint64), near['d'].to_numpy(dtype=np.uint64))
+                step.append(near[rides > 0].assign(rides=rides[rides > 0]))
+            if not step:
+                continue
+            hits = pd.concat(step)
+            # At the same shift, the busiest lane
+            hits = hits.iloc[np.lexsort((-hits['rides'].to_numpy(), hits['q'].to_numpy()))]
+            hits = hits[~hits['q'].duplicated()].assign(shift=total)
+            pending[hits['q'].to_numpy()] = False
+            found.append(hits)
+            if not pending.any():
+                break
+        if not found:
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64),
+                    np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64))
+        found = pd.concat(found)
+        return (found['q'].to_numpy(), found['p'].to_numpy(dtype=np.uint64), found['d'].to_numpy(dtype=np.uint64),
+                found['rides'].to_numpy(dtype=np.int64), found['shift'].to_numpy(dtype=np.int64))
+
+    def match(self, p, d):
+        """
+        The lane each (p[i], d[i]) matches: (lane pickup, lane dropoff, rides,
+        steps moved in total). An exact lane always wins; unmatched pairs get
+        null cells, 0 rides and -1 steps.
+        """
+        p = np.asarray(p, dtype=np.uint64)
+        d = np.asarray(d, dtype=np.uint64)
+        codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([p, d]))
+        up = pairs.get_level_values(0).to_numpy(dtype=np.uint64)
+        ud = pairs.get_level_values(1).to_numpy(dtype=np.uint64)
+
+        lane_p = np.zeros(len(pairs), dtype=np.uint64)
+        lane_d = np.zeros(len(pairs), dtype=np.uint64)
+        shift = np.full(len(pairs), -1, dtype=np.int64)
+        rides = self.routes.lookup(up, ud)
+        exact = rides > 0
+        lane_p[exact], lane_d[exact], shift[exact] = up[exact], ud[exact], 0
+
+        todo = np.flatnonzero(~exact & (up != H3_NULL) & (ud != H3_NULL))
+        if self.k > 0:
+            for start in range(0, len(todo), MATCH_BLOCK):
+                block = todo[start:start + MATCH_BLOCK]
+                q, bp, bd, br, bs = self._match_block(up[block], ud[block])
+                at = block[q]
+                lane_p[at], lane_d[at], rides[at], shift[at] = bp, bd, br, bs
+        return lane_p[codes], lane_d[codes], rides[codes], shift[codes]
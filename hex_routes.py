@@ -1,35 +1,64 @@
-import pandas as pd
 import argparse
-import os
+from functools import partial
+from route_counts import count_file, count_hex_routes, counts_to_frame, input_exists
+from stage_io import write_csv
+from od_matrix import save_od_matrix
+from partitioned import save_partitioned, DEFAULT_PARTITION_RES
+from metrics import instrumented, add_arguments, configure, stage
 
-def main():
+@instrumented('hex_routes')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Aggregate ride counts for hex-to-hex routes.')
-    parser.add_argument('input_csv', nargs='?', default='big-data-with-hex.csv', help='Input enriched CSV')
+    parser.add_argument('input_csv', nargs='?', default='big-data-with-hex.csv', help='Input enriched CSV, npy directory or parquet file')
     parser.add_argument('output_csv', nargs='?', default='hex_route_counts.csv', help='Output summary CSV')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    parser.add_argument('--workers', type=int, default=1, help='Count shards of the input in this many processes')
+    parser.add_argument('--od_matrix', default=None, help='Also save the counts as a sparse OD matrix to this directory (see od_matrix.py)')
+    parser.add_argument('--ids_from', default=None, help='With --od_matrix, keep the hex ids of this earlier matrix')
+    parser.add_argument('--partitioned', default=None, help='Also write the routes to this directory, partitioned by the pickup hex parent (see partitioned.py)')
+    parser.add_argument('--partition_res', type=int, default=DEFAULT_PARTITION_RES, help='Resolution of the pickup parent hexes that key the partitions')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
     
-    args = parser.parse_args()
-    
-    if not os.path.exists(args.input_csv):
+    if not input_exists(args.input_csv):
         print(f"Error: {args.input_csv} not found. Please run the previous script first.")
         return
+    if args.partitioned and not 0 <= args.partition_res <= 9:
+        print("Error: --partition_res must be between 0 and 9.")
+        return
 
     print(f"Reading {args.input_csv}...")
-    df = pd.read_csv(args.input_csv)
+    hex_cols = ['pickup_hex_9', 'dropoff_hex_9']
 
     # 1. Group by the pickup and dropoff hex pair
     print("Grouping by routes and counting rides...")
     
-    # We group by both hex columns and count the 'hashed_id' (or any column)
-    route_counts = df.groupby(['pickup_hex_9', 'dropoff_hex_9']).size().reset_index(name='ride_count')
+    # Only the two hex columns are read; each chunk (or shard) is counted and folded in
+    count_fn = partial(count_hex_routes, p_col=hex_cols[0], d_col=hex_cols[1])
+    counts = count_file(args.input_csv, count_fn, args.workers, args.chunksize, usecols=hex_cols)
+
+    if args.od_matrix:
+        matrix = save_od_matrix(counts, args.od_matrix, 9, args.ids_from)
+        print(f"Saved the {matrix.shape[0]}-hex OD matrix to {args.od_matrix}")
 
     # 2. Sort by highest ride count so the busiest routes are at the top
-    route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+    with stage('sort', rows_in=len(counts)) as s:
+        route_counts = counts_to_frame(counts, *hex_cols)
+        route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+        s.rows_out = len(route_counts)
 
     print(f"Found {len(route_counts)} unique hex-to-hex routes.")
     
     # 3. Save to CSV
-    route_counts.to_csv(args.output_csv, index=False)
+    write_csv(route_counts, args.output_csv)
     print(f"Successfully saved route counts to {args.output_csv}")
 
+    if args.partitioned:
+        manifest = save_partitioned(route_counts, args.partitioned, hex_cols[0], args.partition_res)
+        print(f"Saved {len(manifest['partitions'])} Hex-{args.partition_res} partitions to {args.partitioned}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
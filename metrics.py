@@ -0,0 +1,231 @@
+"""
+Per-stage timing and memory metrics for the pipeline scripts.
+
+Shared code wraps its phases in stage('read'), stage('index'), ... and the
+scripts only opt in:
+
+    @instrumented('hex_routes')
+    def main(argv=None):
+        ...
+        add_arguments(parser)
+        args = parser.parse_args(argv)
+        configure(args)
+
+Every stage records wall and CPU time, rows in and out, peak RSS and any
+extra counters. Repeated stages (one per chunk) add up into one record.
+At the end of the script one NDJSON line per stage plus a 'total' line is
+appended to the --metrics file (or $HEX_METRICS). --profile FILE also runs
+the script under cProfile and writes the stats there, with the top
+functions as text next to it.
+
+Peak RSS is per stage on Linux (the high-water mark is reset through
+/proc/self/clear_refs when a stage starts), otherwise the process peak so far.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+_run = None
+
+
+def _rss_peak_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def _cpu_s():
+    """CPU time of this process and its finished children (e.g. --workers pools)."""
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def _reset_rss_peak():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class Stage:
+    """Totals for one stage name within a run."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_s = 0.0
+        self.cpu_s = 0.0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.peak_rss_mb = 0.0
+        self.counters = {}
+
+    def count(self, **counters):
+        """Adds to named counters, e.g. count(api_calls=3, cache_hits=10)."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def record(self):
+        out = {
+            'stage': self.name,
+            'calls': self.calls,
+            'wall_s': round(self.wall_s, 4),
+            'cpu_s': round(self.cpu_s, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rows_per_s': round(max(self.rows_in, self.rows_out) / self.wall_s, 1) if self.wall_s else None,
+            'peak_rss_mb': round(self.peak_rss_mb, 1),
+        }
+        out.update(self.counters)
+        return out
+
+
+class _Run:
+    def __init__(self, script):
+        self.script = script
+        self.path = os.environ.get('HEX_METRICS') or None
+        self.profile_path = None
+        self.profiler = None
+        self.argv = sys.argv[1:]
+        self.stages = {}
+        self.depth = 0
+        self.started = time.time()
+        self.wall = time.perf_counter()
+        self.cpu = _cpu_s()
+
+
+@contextmanager
+def stage(name, rows_in=0):
+    """
+    Times a block as stage `name`; set .rows_out (and .rows_in) on the
+    yielded Stage. Does nothing but yield when no script run is active.
+    """
+    if _run is None:
+        yield Stage(name)
+        return
+    totals = _run.stages.setdefault(name, Stage(name))
+    # Nested stages count towards their outer stage's peak too
+    if _run.depth == 0:
+        _reset_rss_peak()
+    _run.depth += 1
+    rows_out = totals.rows_out
+    totals.rows_out = 0
+    wall, cpu = time.perf_counter(), _cpu_s()
+    try:
+        yield totals
+    finally:
+        totals.wall_s += time.perf_counter() - wall
+        totals.cpu_s += _cpu_s() - cpu
+        totals.calls += 1
+        totals.rows_in += rows_in
+        totals.rows_out += rows_out
+        totals.peak_rss_mb = max(totals.peak_rss_mb, _rss_peak_mb())
+        _run.depth -= 1
+
+
+def timed_chunks(chunks, name='read'):
+    """Yields from an iterator of DataFrames, timing each read as stage `name`."""
+    chunks = iter(chunks)
+    while True:
+        with stage(name) as s:
+            chunk = next(chunks, None)
+            if chunk is not None:
+                s.rows_out = len(chunk)
+        if chunk is None:
+            # Finding the end is not a read of its own
+            s.calls -= 1
+            return
+        yield chunk
+
+
+def count(name, **counters):
+    """Adds counters to stage `name` without timing anything."""
+    if _run is not None:
+        _run.stages.setdefault(name, Stage(name)).count(**counters)
+
+
+def add_arguments(parser):
+    parser.add_argument('--metrics', default=None, help='Append per-stage timings as NDJSON to this file (default: $HEX_METRICS)')
+    parser.add_argument('--profile', default=None, help='Run under cProfile and save the stats to this file')
+
+
+def configure(args):
+    """Applies --metrics and --profile for the current run."""
+    if _run is None:
+        return
+    if getattr(args, 'metrics', None):
+        _run.path = args.metrics
+    if getattr(args, 'profile', None):
+        _run.profile_path = args.profile
+        _run.profiler = cProfile.Profile()
+        _run.profiler.enable()
+
+
+def _finish(run):
+    if run.profiler is not None:
+        run.profiler.disable()
+        run.profiler.dump_stats(run.profile_path)
+        text = io.StringIO()
+        pstats.Stats(run.profiler, stream=text).sort_stats('cumulative').print_stats(30)
+        with open(run.profile_path + '.txt', 'w') as f:
+            f.write(text.getvalue())
+        print(f"Saved profile to {run.profile_path} (top functions in {run.profile_path}.txt)")
+    if not run.path:
+        return
+
+    total = Stage('total')
+    total.calls = 1
+    total.wall_s = time.perf_counter() - run.wall
+    total.cpu_s = _cpu_s() - run.cpu
+    # Rows the script read and wrote, if it used the shared readers and writers
+    total.rows_in = run.stages['read'].rows_out if 'read' in run.stages else 0
+    total.rows_out = run.stages['write'].rows_in if 'write' in run.stages else 0
+    total.peak_rss_mb = max([s.peak_rss_mb for s in run.stages.values()] + [_rss_peak_mb()])
+    run_id = f"{run.script}-{int(run.started)}-{os.getpid()}"
+    common = {
+        'run': run_id,
+        'script': run.script,
+        'started_at': datetime.fromtimestamp(run.started, timezone.utc).isoformat(timespec='seconds'),
+    }
+    lines = []
+    for s in list(run.stages.values()) + [total]:
+        record = dict(common, **s.record())
+        if s is total:
+            record['argv'] = run.argv
+        lines.append(json.dumps(record) + '\n')
+    # One write, so runs appending to the same file at once do not interleave
+    with open(run.path, 'a') as f:
+        f.write(''.join(lines))
+
+
+def instrumented(script):
+    """Decorator for a script's main(argv=None): collects stages for the duration of the call."""
+    def wrap(main):
+        @functools.wraps(main)
+        def run(argv=None):
+            global _run
+            outer, _run = _run, _Run(script)
+            if argv is not None:
+                _run.argv = list(argv)
+            try:
+                return main(argv)
+            finally:
+                finished, _run = _run, outer
+                _finish(finished)
+        return run
+    return wrap
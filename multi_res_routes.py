@@ -0,0 +1,113 @@
+import argparse
+import os
+from functools import partial
+from hex_index import get_resolution
+from route_counts import (
+    count_file, count_routes_multi, counts_to_frame, input_exists, read_counts_csv, rollup_counts, route_columns,
+)
+from stage_io import write_csv
+from od_matrix import save_od_matrix
+from partitioned import save_partitioned, DEFAULT_PARTITION_RES
+from metrics import instrumented, add_arguments, configure, stage, count
+
+def output_name(res, filtered=False, rollup=False):
+    """
+    hex_route_counts.csv for res 9, hex{res}_route_counts.csv otherwise.
+    Tables rolled up from a finer resolution get a _rollup suffix, so they
+    are not mistaken for the directly indexed ones test_hex8_rides.py and
+    hex_routes.py write.
+    """
+    name = 'hex_route_counts' if res == 9 else f'hex{res}_route_counts'
+    if rollup:
+        name += '_rollup'
+    return f'{name}_filtered.csv' if filtered else f'{name}.csv'
+
+@instrumented('multi_res_routes')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Aggregate hex-to-hex route counts for several resolutions in one pass.')
+    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data (a CSV, or a directory or glob of shards, optionally compressed)')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[9, 8], help='H3 resolutions to write')
+    parser.add_argument('--from_counts', default=None, help='Roll up an existing (finer) route-count CSV instead of reading rides')
+    parser.add_argument('--exact', action='store_true', help='Index every resolution directly instead of rolling up parents (rolled-up tables are written as *_rollup.csv)')
+    parser.add_argument('--min_rides', type=int, default=0, help='Also write *_filtered.csv files keeping routes with at least this many rides')
+    parser.add_argument('--output_dir', default='.', help='Directory for the output CSVs')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    parser.add_argument('--workers', type=int, default=1, help='Count shards of the input in this many processes')
+    parser.add_argument('--od_matrix', default=None, help='Also save each resolution as a sparse OD matrix under this directory (hex{res}/ or hex{res}_rollup/)')
+    parser.add_argument('--partitioned', default=None, help='Also write each resolution under this directory (hex{res}/ or hex{res}_rollup/), partitioned by the pickup hex parent')
+    parser.add_argument('--partition_res', type=int, default=DEFAULT_PARTITION_RES, help='Resolution of the pickup parent hexes that key the partitions')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
+
+    if args.from_counts:
+        # 1a. Derive coarser tables from counts we already have, no ride scan
+        if not os.path.exists(args.from_counts):
+            print(f"Error: {args.from_counts} not found.")
+            return
+        print(f"Reading route counts from {args.from_counts}...")
+        base = read_counts_csv(args.from_counts)
+        base_res = int(get_resolution(base.index.get_level_values(0)[:1])[0]) if len(base) else max(args.resolutions)
+        if max(args.resolutions) > base_res:
+            print(f"Error: {args.from_counts} is Hex-{base_res}; it cannot produce finer resolutions.")
+            return
+        all_counts = {res: base if res == base_res else rollup_counts(base, res) for res in args.resolutions}
+        source_res = base_res
+    else:
+        # 1b. One pass over the rides, indexed at the finest resolution only
+        if not input_exists(args.input_csv):
+            print(f"Error: {args.input_csv} not found.")
+            return
+        print(f"Reading {args.input_csv}...")
+        mode = "direct indexing" if args.exact else f"Hex-{max(args.resolutions)} with parent rollup"
+        print(f"Aggregating Hex-{sorted(args.resolutions, reverse=True)} route counts ({mode})...")
+        count_fn = partial(count_routes_multi, resolutions=args.resolutions, exact=args.exact)
+        all_counts = count_file(args.input_csv, count_fn, args.workers, args.chunksize)
+        source_res = None if args.exact else max(args.resolutions)
+
+    # Coarser tables derived from parents only approximate direct indexing
+    # (H3 children do not tile their parent exactly)
+    rolled = {res for res in all_counts if source_res is not None and res != source_res}
+    count('group', rollup_tables=len(rolled), direct_tables=len(all_counts) - len(rolled))
+
+    # 2. Write one table per resolution, busiest routes first
+    os.makedirs(args.output_dir, exist_ok=True)
+    for res in sorted(all_counts, reverse=True):
+        with stage('sort', rows_in=len(all_counts[res])) as s:
+            route_counts = counts_to_frame(all_counts[res], *route_columns(res))
+            ordered = route_counts.sort_values(by='ride_count', ascending=False)
+            s.rows_out = len(ordered)
+        path = os.path.join(args.output_dir, output_name(res, rollup=res in rolled))
+        write_csv(ordered, path)
+        how = f"rolled up from Hex-{source_res}" if res in rolled else "indexed directly"
+        print(f"Hex-{res}: {len(route_counts)} unique routes ({how}) -> {path}")
+        if args.od_matrix:
+            path = os.path.join(args.od_matrix, f'hex{res}_rollup' if res in rolled else f'hex{res}')
+            os.makedirs(args.od_matrix, exist_ok=True)
+            save_od_matrix(all_counts[res], path, res)
+            print(f"Hex-{res}: OD matrix -> {path}")
+        if args.partitioned:
+            if res < args.partition_res:
+                print(f"Hex-{res}: coarser than --partition_res {args.partition_res}, not partitioned")
+            else:
+                path = os.path.join(args.partitioned, f'hex{res}_rollup' if res in rolled else f'hex{res}')
+                os.makedirs(args.partitioned, exist_ok=True)
+                manifest = save_partitioned(ordered, path, route_columns(res)[0], args.partition_res)
+                print(f"Hex-{res}: {len(manifest['partitions'])} partitions -> {path}")
+
+        if args.min_rides > 0:
+            # Filter before sorting, like test_hex8_routes_filtered.py
+            with stage('filter', rows_in=len(route_counts)) as s:
+                filtered = route_counts[route_counts['ride_count'] >= args.min_rides]
+                filtered = filtered.sort_values(by='ride_count', ascending=False)
+                s.rows_out = len(filtered)
+            path = os.path.join(args.output_dir, output_name(res, filtered=True, rollup=res in rolled))
+            write_csv(filtered, path)
+            print(f"Hex-{res}: {len(filtered)} routes with >= {args.min_rides} rides -> {path}")
+
+    print("Done!")
+
+if __name__ == "__main__":
+    main()
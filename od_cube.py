@@ -0,0 +1,238 @@
+"""
+Origin-destination cube: route counts by local hour of day and day type.
+
+Rides are counted per (pickup cell, dropoff cell, slot), where a slot is one
+hour of a weekday or of a weekend day in Dhaka time. Fri and Sat are the
+weekend. Rides without a usable created_at go in an extra 'unknown' slot.
+That slot only shows up in the all-time slice, so the all-time slice always
+equals the flat route counts.
+
+On disk a cube is a directory:
+- routes/: the distinct (p, d) pairs, sorted (a columnar.py npy table)
+- entries/: (route, rides) per slot, grouped by slot
+- cube.json: resolution, slot offsets into entries, totals
+
+A slice reads only the entries of the selected slots (memory-mapped), sums
+them per route with one bincount, and applies the threshold.
+
+    python od_cube.py query hex8_cube --hours 7-10 --days weekday --min_rides 5 -o morning.csv
+    python od_cube.py info hex8_cube
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from hex_index import latlng_to_cells
+from route_counts import PICKUP_COLS, DROPOFF_COLS, merge_counts, counts_to_frame, route_columns
+from columnar import write_table, load_columns
+from metrics import stage, timed_chunks
+
+TIME_COL = 'created_at'
+TIMEZONE = 'Asia/Dhaka'
+# pandas weekday numbers, Monday = 0
+WEEKEND_DAYS = (4, 5)
+DAY_TYPES = ('weekday', 'weekend')
+HOURS = 24
+# Slots 0-23 are weekday hours, 24-47 weekend hours, 48 is unknown time
+UNKNOWN_SLOT = len(DAY_TYPES) * HOURS
+N_SLOTS = UNKNOWN_SLOT + 1
+CUBE_FILE = 'cube.json'
+
+
+def ride_slots(values):
+    """
+    Slot of each created_at value (UNKNOWN_SLOT if missing or unparseable).
+    Naive timestamps are taken as UTC, like BigQuery's exports. Values are
+    cut to the minute and only the distinct minutes are parsed.
+    """
+    text = pd.Series(values, dtype='object').astype('string')
+    # Keep the zone, drop the seconds: '2025-11-03 02:15:42.1 UTC' -> '2025-11-03 02:15+00:00'
+    zone = text.str.slice(19).str.lstrip('.0123456789').str.strip().replace({'UTC': '+00:00', 'Z': '+00:00'})
+    codes, uniques = pd.factorize(text.str.slice(0, 16) + zone.fillna(''))
+    parsed = pd.to_datetime(pd.Series(uniques, dtype='object'), utc=True, errors='coerce', format='ISO8601')
+    local = parsed.dt.tz_convert(TIMEZONE)
+    slot = (np.isin(local.dt.dayofweek, WEEKEND_DAYS) * HOURS + local.dt.hour).to_numpy(dtype='float64')
+    slot = np.where(np.isnan(slot), UNKNOWN_SLOT, slot).astype(np.uint8)
+    # factorize marks missing values with -1, which picks the trailing unknown slot
+    return np.append(slot, np.uint8(UNKNOWN_SLOT))[codes]
+
+
+def count_cube(chunks, res):
+    """Like count_routes, with a (p, d, slot) -> rides table as the result."""
+    total = None
+    for df in timed_chunks(chunks):
+        with stage('index', rows_in=len(df)) as s:
+            p_cells, p_valid = latlng_to_cells(df[PICKUP_COLS[0]], df[PICKUP_COLS[1]], res)
+            d_cells, d_valid = latlng_to_cells(df[DROPOFF_COLS[0]], df[DROPOFF_COLS[1]], res)
+            keep = p_valid & d_valid
+            slots = ride_slots(df[TIME_COL])[keep]
+            p_cells, d_cells = p_cells[keep], d_cells[keep]
+            s.rows_out = len(p_cells)
+        del df
+        with stage('group', rows_in=len(p_cells)) as s:
+            before = 0 if total is None else len(total)
+            counts = pd.DataFrame({'p': p_cells, 'd': d_cells, 'slot': slots}).groupby(['p', 'd', 'slot'], sort=True).size()
+            total = merge_counts(total, counts)
+            s.rows_out = len(total) - before
+    if total is None:
+        index = pd.MultiIndex.from_arrays([np.empty(0, dtype=np.uint64)] * 2 + [np.empty(0, dtype=np.uint8)],
+                                          names=['p', 'd', 'slot'])
+        total = pd.Series(np.empty(0, dtype=np.int64), index=index)
+    return total
+
+
+def parse_hours(spec):
+    """'7-10,17-20' or '8' -> sorted hours; a range includes both ends and may wrap ('22-2')."""
+    hours = set()
+    for part in str(spec).split(','):
+        start, _, end = part.strip().partition('-')
+        start, end = int(start), int(end or start)
+        if not (0 <= start < HOURS and 0 <= end < HOURS):
+            raise ValueError(f"Hours must be 0-23, not {part!r}")
+        h = start
+        hours.add(h)
+        while h != end:
+            h = (h + 1) % HOURS
+            hours.add(h)
+    return sorted(hours)
+
+
+class ODCube:
+    """Route counts per slot; slice() gives a flat route table for any set of hours and day types."""
+
+    def __init__(self, p_cells, d_cells, route, rides, offsets, res):
+        self.p_cells = p_cells
+        self.d_cells = d_cells
+        self.route = route
+        self.rides = rides
+        self.offsets = offsets
+        self.res = res
+
+    @classmethod
+    def from_counts(cls, counts, res):
+        """Builds a cube from a count_cube table."""
+        p = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+        d = counts.index.get_level_values(1).to_numpy(dtype=np.uint64)
+        slot = counts.index.get_level_values(2).to_numpy(dtype=np.int64)
+        # The table is sorted by (p, d), so the first row of each pair starts a route
+        starts = np.ones(len(p), dtype=bool)
+        starts[1:] = (p[1:] != p[:-1]) | (d[1:] != d[:-1])
+        route = (np.cumsum(starts) - 1).astype(np.uint32)
+        order = np.argsort(slot, kind='stable')
+        offsets = np.zeros(N_SLOTS + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(slot, minlength=N_SLOTS))
+        return cls(p[starts], d[starts], route[order], counts.to_numpy(dtype=np.uint32)[order], offsets, res)
+
+    def __len__(self):
+        return len(self.p_cells)
+
+    @property
+    def total_rides(self):
+        return int(self.rides.sum(dtype=np.int64))
+
+    def slots(self, hours=None, day_types=None):
+        """Slots for the given hours (default all) and day types (default both). Both None adds unknown time."""
+        if hours is None and day_types is None:
+            return list(range(N_SLOTS))
+        hours = range(HOURS) if hours is None else hours
+        day_types = DAY_TYPES if day_types is None else day_types
+        return [DAY_TYPES.index(t) * HOURS + h for t in day_types for h in hours]
+
+    def slice(self, hours=None, day_types=None, min_rides=1):
+        """Route counts (count_pairs' layout, sorted by pair) over the chosen slots, at least min_rides each."""
+        parts = [(self.offsets[s], self.offsets[s + 1]) for s in self.slots(hours, day_types)]
+        route = np.concatenate([self.route[a:b] for a, b in parts]) if parts else np.empty(0, dtype=np.uint32)
+        rides = np.concatenate([self.rides[a:b] for a, b in parts]) if parts else np.empty(0, dtype=np.uint32)
+        totals = np.bincount(route, weights=rides, minlength=len(self)).astype(np.int64)
+        keep = totals >= max(min_rides, 1)
+        index = pd.MultiIndex.from_arrays([self.p_cells[keep], self.d_cells[keep]], names=['p', 'd'])
+        return pd.Series(totals[keep], index=index)
+
+    def by_slot(self):
+        """Rides per slot, for a quick profile of the month."""
+        return np.array([int(self.rides[a:b].sum(dtype=np.int64)) for a, b in zip(self.offsets[:-1], self.offsets[1:])])
+
+    def save(self, path):
+        """Writes the cube directory, replacing an existing one."""
+        tmp = path.rstrip('/\\') + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        write_table(pd.DataFrame({'p': self.p_cells, 'd': self.d_cells}), os.path.join(tmp, 'routes'), 'npy')
+        write_table(pd.DataFrame({'route': self.route, 'rides': self.rides}), os.path.join(tmp, 'entries'), 'npy')
+        meta = {
+            'resolution': self.res,
+            'timezone': TIMEZONE,
+            'weekend_days': list(WEEKEND_DAYS),
+            'routes': len(self),
+            'entries': len(self.route),
+            'rides': self.total_rides,
+            'offsets': self.offsets.tolist(),
+        }
+        with open(os.path.join(tmp, CUBE_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Opens a saved cube; the arrays are memory-mapped."""
+        with open(os.path.join(path, CUBE_FILE)) as f:
+            meta = json.load(f)
+        routes = load_columns(os.path.join(path, 'routes'))
+        entries = load_columns(os.path.join(path, 'entries'))
+        return cls(routes['p'], routes['d'], entries['route'], entries['rides'],
+                   np.array(meta['offsets'], dtype=np.int64), meta['resolution'])
+
+
+def is_cube(path):
+    return os.path.isfile(os.path.join(path, CUBE_FILE))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query a time-bucketed route cube.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('query', help='Route counts for some hours and day types')
+    p.add_argument('cube', nargs='?', default='hex8_cube')
+    p.add_argument('--hours', default=None, help='Local hours, e.g. 7-10 or 7-10,17-20 (default: all)')
+    p.add_argument('--days', choices=DAY_TYPES, nargs='+', default=None, help='Day types (default: both)')
+    p.add_argument('--min_rides', type=int, default=5, help='Minimum number of rides to keep a route')
+    p.add_argument('-o', '--output_csv', default=None, help='Write the routes here (busiest first)')
+
+    p = commands.add_parser('info', help='Describe a cube')
+    p.add_argument('cube', nargs='?', default='hex8_cube')
+
+    args = parser.parse_args(argv)
+
+    if not is_cube(args.cube):
+        print(f"Error: {args.cube} is not a route cube.")
+        return
+    cube = ODCube.load(args.cube)
+
+    if args.command == 'info':
+        print(f"Hex-{cube.res} cube at {args.cube}: {len(cube)} routes, {len(cube.route)} entries, {cube.total_rides} rides")
+        per_slot = cube.by_slot()
+        for t, name in enumerate(DAY_TYPES):
+            print(f"  {name}: " + ' '.join(f"{h:02d}h:{per_slot[t * HOURS + h]}" for h in range(HOURS)))
+        print(f"  unknown time: {per_slot[UNKNOWN_SLOT]}")
+        return
+
+    try:
+        hours = None if args.hours is None else parse_hours(args.hours)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    counts = cube.slice(hours, args.days, args.min_rides)
+    routes = counts_to_frame(counts, *route_columns(cube.res)).sort_values(by='ride_count', ascending=False)
+    what = f"hours {args.hours or 'all'}, {' + '.join(args.days or DAY_TYPES)}"
+    print(f"{len(routes)} routes with >= {args.min_rides} rides ({what}), {int(routes['ride_count'].sum())} rides")
+    if args.output_csv:
+        routes.to_csv(args.output_csv, index=False)
+        print(f"Saved to {args.output_csv}")
+    else:
+        print(routes.head(20).to_string(index=False))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Sparse origin-destination matrix of route counts.
+
+Hexes get integer ids from a dictionary (cells.npy: id -> cell). Ids are
+stable: a matrix built with an earlier dictionary keeps every id it had
+and appends new hexes after them. Counts are stored twice, as CSR (one row
+of destinations per origin) and CSC (one column of origins per
+destination), in the usual indptr / indices / data layout:
+
+    od_matrix/
+      matrix.json              resolution, shape, nnz, total rides
+      cells.npy                uint64 cell of each id
+      csr_indptr.npy  csr_indices.npy  csr_data.npy
+      csc_indptr.npy  csc_indices.npy  csc_data.npy
+
+Files are memory-mapped on load. A row or column is one slice, so top-K
+and single-route queries cost microseconds; marginals are one pass over
+the data, computed on first use.
+
+    python od_matrix.py build hex8_route_counts.csv hex8_od
+    python od_matrix.py top hex8_od 883cf13b37fffff -k 10 [--inbound]
+    python od_matrix.py info hex8_od
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from hex_index import get_resolution, cells_to_str, str_to_cells
+from route_counts import read_counts_csv
+from metrics import stage
+
+MATRIX_FILE = 'matrix.json'
+ARRAYS = ('cells', 'csr_indptr', 'csr_indices', 'csr_data', 'csc_indptr', 'csc_indices', 'csc_data')
+
+
+def _compress(major, minor, data, n):
+    """indptr, indices, data for entries sorted by (major, minor)."""
+    order = np.lexsort((minor, major))
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(major, minlength=n))
+    return indptr, minor[order].astype(np.uint32), data[order]
+
+
+class ODMatrix:
+    """Route counts as CSR + CSC arrays over a hex <-> id dictionary."""
+
+    def __init__(self, cells, csr_indptr, csr_indices, csr_data, csc_indptr, csc_indices, csc_data, res=None):
+        self.cells = cells
+        self.csr_indptr, self.csr_indices, self.csr_data = csr_indptr, csr_indices, csr_data
+        self.csc_indptr, self.csc_indices, self.csc_data = csc_indptr, csc_indices, csc_data
+        self.res = res
+        # Sorted view of the dictionary for cell -> id
+        self._order = np.argsort(cells, kind='stable')
+        self._sorted = np.asarray(cells)[self._order]
+        self._outbound = self._inbound = None
+
+    @classmethod
+    def from_counts(cls, counts, ids=None, res=None):
+        """
+        Builds the matrix from a route-count table. `ids` is an earlier
+        dictionary (cells array) whose ids are kept; new hexes are appended.
+        """
+        p = counts.index.get_level_values(0).to_numpy(dtype=np.uint64)
+        d = counts.index.get_level_values(1).to_numpy(dtype=np.uint64)
+        data = counts.to_numpy(dtype=np.int64)
+        if len(data) and data.max() > np.iinfo(np.uint32).max:
+            raise ValueError("Route counts do not fit in uint32")
+        cells = np.empty(0, dtype=np.uint64) if ids is None else np.asarray(ids, dtype=np.uint64)
+        new = np.setdiff1d(np.union1d(p, d), cells)
+        cells = np.concatenate([cells, new])
+        if res is None and len(cells):
+            res = int(get_resolution(cells[:1])[0])
+
+        order = np.argsort(cells, kind='stable')
+        p_id = order[np.searchsorted(cells[order], p)]
+        d_id = order[np.searchsorted(cells[order], d)]
+        data = data.astype(np.uint32)
+        n = len(cells)
+        return cls(cells, *_compress(p_id, d_id, data, n), *_compress(d_id, p_id, data, n), res=res)
+
+    @property
+    def shape(self):
+        return len(self.cells), len(self.cells)
+
+    @property
+    def nnz(self):
+        return len(self.csr_data)
+
+    @property
+    def total_rides(self):
+        return int(self.csr_data.sum(dtype=np.int64))
+
+    def ids(self, cells):
+        """Id of each cell (-1 for hexes not in the dictionary)."""
+        cells = np.atleast_1d(np.asarray(cells, dtype=np.uint64))
+        if not len(self._sorted):
+            return np.full(len(cells), -1, dtype=np.int64)
+        at = np.minimum(np.searchsorted(self._sorted, cells), len(self._sorted) - 1)
+        return np.where(self._sorted[at] == cells, self._order[at], -1).astype(np.int64)
+
+    def _id(self, cell):
+        cell = np.atleast_1d(np.asarray(cell, dtype=np.uint64))[:1]
+        i = int(self.ids(cell)[0])
+        if i < 0:
+            raise KeyError(f"{cells_to_str(cell)[0]} is not in the matrix")
+        return i
+
+    def row(self, origin):
+        """(destination cells, rides) of one origin, in id order."""
+        i = self._id(origin)
+        a, b = self.csr_indptr[i], self.csr_indptr[i + 1]
+        return self.cells[self.csr_indices[a:b]], np.asarray(self.csr_data[a:b], dtype=np.int64)
+
+    def column(self, destination):
+        """(origin cells, rides) of one destination, in id order."""
+        j = self._id(destination)
+        a, b = self.csc_indptr[j], self.csc_indptr[j + 1]
+        return self.cells[self.csc_indices[a:b]], np.asarray(self.csc_data[a:b], dtype=np.int64)
+
+    @staticmethod
+    def _top(cells, rides, k):
+        if len(rides) > k:
+            # Everything tied with the k-th count stays in, so ties break by cell
+            keep = rides >= np.partition(rides, len(rides) - k)[len(rides) - k]
+            cells, rides = cells[keep], rides[keep]
+        order = np.lexsort((cells, -rides))[:k]
+        return cells[order], rides[order]
+
+    def top_destinations(self, origin, k=10):
+        """The k busiest destinations from `origin`: (cells, rides), busiest first."""
+        return self._top(*self.row(origin), k)
+
+    def top_origins(self, destination, k=10):
+        """The k origins that feed `destination` most: (cells, rides), busiest first."""
+        return self._top(*self.column(destination), k)
+
+    def count(self, origin, destination):
+        """Rides on one route (0 if absent)."""
+        ids = self.ids([origin, destination])
+        if (ids < 0).any():
+            return 0
+        a, b = self.csr_indptr[ids[0]], self.csr_indptr[ids[0] + 1]
+        at = a + int(np.searchsorted(self.csr_indices[a:b], ids[1]))
+        return int(self.csr_data[at]) if at < b and self.csr_indices[at] == ids[1] else 0
+
+    def outbound(self, cells=None):
+        """Total rides leaving each hex (by id, or for the given cells)."""
+        if self._outbound is None:
+            self._outbound = np.diff(np.concatenate([[0], np.cumsum(self.csr_data, dtype=np.int64)])[self.csr_indptr])
+        return self._outbound if cells is None else self._marginal(self._outbound, cells)
+
+    def inbound(self, cells=None):
+        """Total rides arriving at each hex (by id, or for the given cells)."""
+        if self._inbound is None:
+            self._inbound = np.diff(np.concatenate([[0], np.cumsum(self.csc_data, dtype=np.int64)])[self.csc_indptr])
+        return self._inbound if cells is None else self._marginal(self._inbound, cells)
+
+    def _marginal(self, totals, cells):
+        ids = self.ids(cells)
+        return np.where(ids >= 0, totals[np.maximum(ids, 0)], 0)
+
+    def submatrix(self, origins, destinations):
+        """Dense len(origins) x len(destinations) array of rides between the given hexes."""
+        o_ids, d_ids = self.ids(origins), self.ids(destinations)
+        out = np.zeros((len(o_ids), len(d_ids)), dtype=np.int64)
+        # Column position of each destination id, -1 for the rest
+        col = np.full(len(self.cells), -1, dtype=np.int64)
+        col[d_ids[d_ids >= 0]] = np.flatnonzero(d_ids >= 0)
+        for r, i in enumerate(o_ids):
+            if i >= 0:
+                a, b = self.csr_indptr[i], self.csr_indptr[i + 1]
+                at = col[self.csr_indices[a:b]]
+                hit = at >= 0
+                out[r, at[hit]] = self.csr_data[a:b][hit]
+        return out
+
+    def to_counts(self):
+        """Back to a route-count table (count_pairs' layout, sorted by pair)."""
+        rows = np.repeat(np.arange(len(self.cells)), np.diff(self.csr_indptr))
+        counts = pd.Series(np.asarray(self.csr_data, dtype=np.int64), index=pd.MultiIndex.from_arrays(
+            [self.cells[rows], self.cells[self.csr_indices]], names=['p', 'd']))
+        return counts.sort_index()
+
+    def save(self, path):
+        """Writes the matrix directory, replacing an existing one."""
+        tmp = path.rstrip('/\\') + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name in ARRAYS:
+            np.save(os.path.join(tmp, f'{name}.npy'), np.asarray(getattr(self, name)))
+        meta = {'resolution': self.res, 'shape': list(self.shape), 'nnz': self.nnz, 'rides': self.total_rides}
+        with open(os.path.join(tmp, MATRIX_FILE), 'w') as f:
+            json.dump(meta, f, indent=1)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Opens a saved matrix; with mmap the arrays are paged in as queries touch them."""
+        with open(os.path.join(path, MATRIX_FILE)) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r' if mmap else None) for name in ARRAYS}
+        return cls(res=meta['resolution'], **arrays)
+
+
+def is_od_matrix(path):
+    return os.path.isfile(os.path.join(path, MATRIX_FILE))
+
+
+def save_od_matrix(counts, path, res, ids_from=None):
+    """Builds and saves the matrix for a route-count table, keeping the ids of the matrix at `ids_from`."""
+    with stage('write', rows_in=len(counts)) as s:
+        ids = ODMatrix.load(ids_from).cells if ids_from else None
+        matrix = ODMatrix.from_counts(counts, ids, res)
+        matrix.save(path)
+        s.rows_out = matrix.nnz
+    return matrix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query a sparse origin-destination matrix.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('build', help='Build a matrix from a route-count CSV')
+    p.add_argument('input_csv', nargs='?', default='hex8_route_counts.csv', help='Route counts (pickup hex, dropoff hex, ride_count)')
+    p.add_argument('output', nargs='?', default='hex8_od', help='Matrix directory')
+    p.add_argument('--ids_from', default=None, help='Keep the hex ids of this earlier matrix')
+
+    p = commands.add_parser('top', help='Busiest destinations from a hex (or origins into it)')
+    p.add_argument('matrix', help='Matrix directory')
+    p.add_argument('hex', help='Hex id, e.g. 883cf13b37fffff')
+    p.add_argument('-k', type=int, default=10, help='How many to show')
+    p.add_argument('--inbound', action='store_true', help='Show the origins feeding the hex instead')
+
+    p = commands.add_parser('info', help='Describe a matrix and its busiest hexes')
+    p.add_argument('matrix', nargs='?', default='hex8_od')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if not os.path.exists(args.input_csv):
+            print(f"Error: {args.input_csv} not found.")
+            return
+        if args.ids_from and not is_od_matrix(args.ids_from):
+            print(f"Error: {args.ids_from} is not an OD matrix.")
+            return
+        counts = read_counts_csv(args.input_csv)
+        matrix = save_od_matrix(counts, args.output, None, args.ids_from)
+        print(f"Saved a {matrix.shape[0]} x {matrix.shape[1]} matrix with {matrix.nnz} routes to {args.output}")
+        return
+
+    if not is_od_matrix(args.matrix):
+        print(f"Error: {args.matrix} is not an OD matrix.")
+        return
+    matrix = ODMatrix.load(args.matrix)
+
+    if args.command == 'info':
+        print(f"Hex-{matrix.res} matrix at {args.matrix}: {matrix.shape[0]} hexes, {matrix.nnz} routes, {matrix.total_rides} rides")
+        for name, totals in (('outbound', matrix.outbound()), ('inbound', matrix.inbound())):
+            busiest = np.argsort(-totals, kind='stable')[:5]
+            print(f"  busiest {name}: " + ', '.join(f"{c}:{t}" for c, t in zip(cells_to_str(matrix.cells[busiest]), totals[busiest])))
+        return
+
+    cell = str_to_cells([args.hex])
+    try:
+        cells, rides = (matrix.top_origins if args.inbound else matrix.top_destinations)(cell, args.k)
+    except KeyError as e:
+        print(f"Error: {e.args[0]}")
+        return
+    what = 'origins into' if args.inbound else 'destinations from'
+    total = (matrix.inbound if args.inbound else matrix.outbound)(cell)[0]
+    print(f"Top {len(cells)} {what} {args.hex} ({total} rides in total):")
+    for c, r in zip(cells_to_str(cells), rides):
+        print(f"  {c}  {r}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""
+Datasets partitioned by the coarse parent of the pickup hex.
+
+Instead of one file, a table is written as a directory with one file (CSV,
+npy table or Parquet, see columnar.py) per parent cell of its key column,
+plus a manifest:
+
+    hex8_route_counts/
+      _manifest.json              key column, resolutions, format, and per
+                                  partition: parent cell, file, rows and the
+                                  bounding box of its key-hex centroids
+      parent=863cf13afffffff.csv
+      parent=863cf13b7ffffff.csv
+      parent=none.csv             rows without a valid key hex
+
+Rows keep their order within a partition, so a partition of a sorted
+route-count table is sorted too. Each chunk is split by parent and the
+partition files are appended in parallel from a thread pool (the npy and
+Parquet writers release the GIL while writing).
+
+A reader opens only the partitions that can hold the hexes or the bounding
+box it asks for:
+
+    from partitioned import read_partitioned
+    df = read_partitioned('hex8_route_counts', cells=['883cf13b37fffff'])
+    df = read_partitioned('hex8_route_counts', bbox=(23.77, 90.39, 23.80, 90.42))
+"""
+import json
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from hex_index import H3_NULL, cell_to_parent, cells_to_latlng, cells_to_str, get_resolution, str_to_cells
+from columnar import TableWriter, read_table
+from metrics import stage
+
+MANIFEST = '_manifest.json'
+SUFFIXES = {'csv': '.csv', 'npy': '', 'parquet': '.parquet'}
+DEFAULT_PARTITION_RES = 6
+# Partition files written at once
+WRITE_THREADS = min(8, os.cpu_count() or 1)
+
+
+def key_cells(values):
+    """uint64 cells of a key column or hex list, whether it holds cells or hex strings."""
+    if getattr(values, 'dtype', None) == np.uint64:
+        return np.asarray(values)
+    if isinstance(values, str):
+        values = [values]
+    return str_to_cells(list(values) if not isinstance(values, pd.Series) else values)
+
+
+def partition_name(parent, fmt):
+    return f"parent={cells_to_str([parent])[0] if parent else 'none'}{SUFFIXES[fmt]}"
+
+
+class PartitionedWriter:
+    """Appends DataFrame chunks to a dataset partitioned by the res-`partition_res` parent of `key_column`."""
+
+    def __init__(self, path, key_column, partition_res=DEFAULT_PARTITION_RES, fmt='csv', threads=WRITE_THREADS):
+        if fmt not in SUFFIXES:
+            raise ValueError(f"Unknown format {fmt!r}, expected one of {tuple(SUFFIXES)}")
+        self.path = path
+        self.key_column = key_column
+        self.partition_res = partition_res
+        self.fmt = fmt
+        self.rows = 0
+        self.columns = None
+        self.key_res = None
+        self.manifest = None
+        self._partitions = {}
+        # Built next to the old dataset and swapped in on close
+        self._tmp = path.rstrip('/\\') + '.tmp'
+        shutil.rmtree(self._tmp, ignore_errors=True)
+        os.makedirs(self._tmp)
+        self._pool = ThreadPoolExecutor(max(threads, 1))
+
+    def _partition(self, parent):
+        part = self._partitions.get(parent)
+        if part is None:
+            name = partition_name(parent, self.fmt)
+            part = self._partitions[parent] = {
+                'writer': TableWriter(os.path.join(self._tmp, name), self.fmt),
+                'name': name,
+                'bbox': [np.inf, np.inf, -np.inf, -np.inf],
+            }
+        return part
+
+    def write(self, df):
+        cells = key_cells(df[self.key_column])
+        valid = cells != H3_NULL
+        if valid.any():
+            res = int(get_resolution(cells[valid][:1])[0])
+            if res < self.partition_res:
+                raise ValueError(f"{self.key_column} holds Hex-{res} cells; they have no Hex-{self.partition_res} parent")
+            self.key_res = res
+        parents = np.zeros(len(cells), dtype=np.uint64)
+        parents[valid] = cell_to_parent(cells[valid], self.partition_res)
+        if self.columns is None:
+            self.columns = list(df.columns)
+
+        codes, uniques = pd.factorize(parents)
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+        lat, lng = cells_to_latlng(cells)
+        jobs = []
+        for k, parent in enumerate(uniques.tolist()):
+            rows = order[bounds[k]:bounds[k + 1]]
+            part = self._partition(parent)
+            if parent:
+                box = part['bbox']
+                box[0], box[1] = min(box[0], lat[rows].min()), min(box[1], lng[rows].min())
+                box[2], box[3] = max(box[2], lat[rows].max()), max(box[3], lng[rows].max())
+            jobs.append(self._pool.submit(part['writer'].write, df.iloc[rows]))
+        for job in jobs:
+            job.result()
+        self.rows += len(df)
+
+    def close(self):
+        for part in self._partitions.values():
+            part['writer'].close()
+        self._pool.shutdown()
+        manifest = {
+            'key_column': self.key_column,
+            'key_resolution': self.key_res,
+            'partition_resolution': self.partition_res,
+            'format': self.fmt,
+            'columns': self.columns,
+            'rows': self.rows,
+            'partitions': [
+                {
+                    'parent': cells_to_str([parent])[0] if parent else None,
+                    'path': part['name'],
+                    'rows': part['writer'].rows,
+                    'bbox': [round(float(x), 7) for x in part['bbox']] if parent else None,
+                }
+                for parent, part in sorted(self._partitions.items())
+            ],
+        }
+        with open(os.path.join(self._tmp, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=1)
+        self.manifest = manifest
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self._tmp, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            # Leave any earlier dataset in place
+            self._pool.shutdown()
+            shutil.rmtree(self._tmp, ignore_errors=True)
+
+
+def write_partitioned(df, path, key_column, partition_res=DEFAULT_PARTITION_RES, fmt='csv'):
+    """Writes a whole DataFrame as a partitioned dataset; returns its manifest."""
+    with PartitionedWriter(path, key_column, partition_res, fmt) as writer:
+        writer.write(df)
+    return writer.manifest
+
+
+def save_partitioned(df, path, key_column, partition_res=DEFAULT_PARTITION_RES, fmt='csv'):
+    """write_partitioned as a metered write stage; returns the manifest."""
+    with stage('write', rows_in=len(df)) as s:
+        manifest = write_partitioned(df, path, key_column, partition_res, fmt)
+        s.rows_out = manifest['rows']
+    return manifest
+
+
+def is_partitioned(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST)) as f:
+        return json.load(f)
+
+
+def partition_paths(path):
+    """Every partition file of a dataset, in parent order."""
+    return [os.path.join(path, p['path']) for p in read_manifest(path)['partitions']]
+
+
+def _cover(manifest, cells):
+    """Parents at the partition resolution that the given hexes fall in or contain."""
+    res = manifest['partition_resolution']
+    cells = key_cells(cells)
+    cells = cells[cells != H3_NULL]
+    fine = get_resolution(cells) >= res
+    parents = set(cells_to_str(cell_to_parent(cells[fine], res)))
+    # A coarser hex covers every partition whose parent lies inside it
+    coarse = cells[~fine]
+    if len(coarse):
+        known = [p['parent'] for p in manifest['partitions'] if p['parent']]
+        known_cells = str_to_cells(known)
+        for cell in coarse:
+            inside = cell_to_parent(known_cells, int(get_resolution([cell])[0])) == cell
+            parents.update(np.array(known, dtype=object)[inside])
+    return parents
+
+
+def select_partitions(path, cells=None, bbox=None):
+    """
+    Manifest entries of the partitions that can hold rows for `cells` (hexes
+    at any resolution) and/or `bbox` (min_lat, min_lng, max_lat, max_lng of
+    key-hex centroids). With neither, every partition.
+    """
+    manifest = read_manifest(path)
+    selected = manifest['partitions']
+    if cells is not None:
+        parents = _cover(manifest, cells)
+        selected = [p for p in selected if p['parent'] in parents]
+    if bbox is not None:
+        lat0, lng0, lat1, lng1 = bbox
+        selected = [p for p in selected if p['bbox'] and p['bbox'][0] <= lat1 and p['bbox'][2] >= lat0
+                    and p['bbox'][1] <= lng1 and p['bbox'][3] >= lng0]
+    return selected
+
+
+def iter_partitioned(path, cells=None, bbox=None, columns=None):
+    """
+    Yields the rows of the selected partitions, one DataFrame per partition,
+    keeping only rows whose key hex is one of (or inside one of) `cells`
+    and whose centroid is inside `bbox`.
+    """
+    manifest = read_manifest(path)
+    key = manifest['key_column']
+    read_cols = None if columns is None else list(dict.fromkeys(list(columns) + [key]))
+    wanted = None
+    if cells is not None:
+        wanted = key_cells(cells)
+        wanted = wanted[wanted != H3_NULL]
+    for part in select_partitions(path, cells, bbox):
+        df = read_table(os.path.join(path, part['path']), read_cols)
+        keys = key_cells(df[key])
+        keep = np.ones(len(df), dtype=bool)
+        if wanted is not None:
+            keep &= _inside_any(keys, wanted)
+        if bbox is not None:
+            lat, lng = cells_to_latlng(keys)
+            keep &= (lat >= bbox[0]) & (lat <= bbox[2]) & (lng >= bbox[1]) & (lng <= bbox[3])
+        df = df[keep]
+        yield df if columns is None else df[list(columns)]
+
+
+def _inside_any(keys, wanted):
+    """True where a key hex is one of `wanted` or has one of them as an ancestor."""
+    hit = np.zeros(len(keys), dtype=bool)
+    valid = keys != H3_NULL
+    key_res = get_resolution(keys[valid][:1])[0] if valid.any() else 0
+    for res in np.unique(get_resolution(wanted)):
+        if res > key_res:
+            continue
+        level = wanted[get_resolution(wanted) == res]
+        hit[valid] |= np.isin(cell_to_parent(keys[valid], int(res)), level)
+    return hit
+
+
+def read_partitioned(path, cells=None, bbox=None, columns=None):
+    """Like iter_partitioned, as one DataFrame (in parent order)."""
+    frames = list(iter_partitioned(path, cells, bbox, columns))
+    if not frames:
+        manifest = read_manifest(path)
+        return pd.DataFrame(columns=columns or manifest['columns'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,284 @@
+import argparse
+import glob
+import hashlib
+import importlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import stage_io
+
+# One entry point for the whole chain:
+#
+#   big-data.csv -> hexes9 -> routes9                        (res-9 branch)
+#   big-data.csv -> counts8 -> filtered8 -> presets -> centroids -> names -> export
+#                                           preset.csv --^    \-> distances
+#                                                            (res-8 branch;
+#                                                 export also maps filtered8)
+#
+# Every stage is one of the existing scripts, called through main(argv).
+# A stage is skipped when the content of its inputs, its arguments and the
+# code it runs all match the last successful run and its outputs are still
+# there. Branches that share no files run in parallel processes; stages of
+# one branch run in the same process and hand their CSVs on in memory.
+
+STATE_FILE = '.pipeline_state.json'
+
+# Library modules every stage may import; editing one invalidates all stages
+SHARED_MODULES = ['hex_index', 'route_counts', 'columnar', 'stage_io', 'preset_engine', 'route_index',
+                  'geocode_cache', 'address_client', 'area_naming', 'metrics', 'heavy_hitters', 'od_cube',
+                  'hex_neighbours', 'od_matrix', 'partitioned']
+
+Stage = namedtuple('Stage', 'name script argv inputs outputs')
+
+def build_stages(args):
+    hexes = 'big-data-with-hex' if args.hex_format == 'npy' else f'big-data-with-hex.{args.hex_format}'
+    names_argv = ['preset_with_centroids.csv', 'preset_with_names.csv', '--naming', args.naming]
+    if args.api_url:
+        names_argv += ['--api_url', args.api_url]
+    if args.cache:
+        names_argv += ['--cache', args.cache]
+    return [
+        Stage('hexes9', 'generate_hexes', [args.rides, hexes, '--format', args.hex_format],
+              [args.rides], [hexes]),
+        Stage('routes9', 'hex_routes', [hexes, 'hex_route_counts.csv', '--workers', str(args.workers)],
+              [hexes], ['hex_route_counts.csv']),
+        Stage('counts8', 'test_hex8_rides', [args.rides, 'hex8_route_counts.csv'],
+              [args.rides], ['hex8_route_counts.csv']),
+        # Filtering reuses the res-8 counts, so a new --min_rides never rereads the rides
+        Stage('filtered8', 'test_hex8_routes_filtered',
+              [args.rides, 'hex8_route_counts_filtered.csv', '--route_counts', 'hex8_route_counts.csv',
+               '--min_rides', str(args.min_rides)],
+              ['hex8_route_counts.csv'], ['hex8_route_counts_filtered.csv']),
+        Stage('presets', 'filter_presets_by_hex', [args.presets, 'hex8_route_counts_filtered.csv', 'preset_filtered.csv'],
+              [args.presets, 'hex8_route_counts_filtered.csv'], ['preset_filtered.csv']),
+        Stage('centroids', 'filter_and_centroid_presets', ['preset_filtered.csv', 'preset_with_centroids.csv'],
+              ['preset_filtered.csv'], ['preset_with_centroids.csv']),
+        Stage('names', 'fetch_hex_names', names_argv,
+              ['preset_with_centroids.csv'], ['preset_with_names.csv']),
+        Stage('distances', 'preset_distances', ['preset_with_centroids.csv', 'preset_with_distances.csv'],
+              ['preset_with_centroids.csv'], ['preset_with_distances.csv']),
+        Stage('export', 'geo_export',
+              ['hex8_route_counts_filtered.csv', '--names', 'preset_with_names.csv',
+               '--hexes', 'hex8_hexes.geojsonl', '--flows', 'hex8_flows.geojsonl'],
+              ['hex8_route_counts_filtered.csv', 'preset_with_names.csv'], ['hex8_hexes.geojsonl', 'hex8_flows.geojsonl']),
+    ]
+
+def upstream(stages):
+    """{stage name: names of the stages that produce its inputs}."""
+    producers = {os.path.normpath(out): s.name for s in stages for out in s.outputs}
+    return {s.name: {producers[os.path.normpath(i)] for i in s.inputs if os.path.normpath(i) in producers}
+            for s in stages}
+
+def select(stages, targets):
+    """Keeps the target stages and everything they depend on, in declared order."""
+    if not targets:
+        return stages
+    unknown = set(targets) - {s.name for s in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    deps = upstream(stages)
+    wanted, todo = set(), list(targets)
+    while todo:
+        name = todo.pop()
+        if name not in wanted:
+            wanted.add(name)
+            todo.extend(deps[name])
+    return [s for s in stages if s.name in wanted]
+
+def branches(stages):
+    """Splits the DAG into groups of stages connected through files, each in declared order."""
+    deps = upstream(stages)
+    group = {s.name: s.name for s in stages}
+
+    def root(name):
+        while group[name] != name:
+            name = group[name]
+        return name
+
+    for s in stages:
+        for d in deps[s.name]:
+            group[root(d)] = root(s.name)
+    result = {}
+    for s in stages:
+        result.setdefault(root(s.name), []).append(s)
+    return list(result.values())
+
+def _files(path):
+    """The file itself, every file under a directory (npy tables, ride shards), or a glob's matches."""
+    if os.path.isdir(path):
+        return sorted(os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs)
+    return [path] if os.path.exists(path) else sorted(glob.glob(path))
+
+def content_hash(path, known, block=1 << 20):
+    """
+    sha256 of a file or directory. `known` maps file -> [size, mtime_ns, sha]
+    so that unchanged files are not read again; it is updated in place.
+    """
+    digest = hashlib.sha256()
+    for f in _files(path):
+        st = os.stat(f)
+        entry = known.get(f)
+        if not entry or entry[:2] != [st.st_size, st.st_mtime_ns]:
+            h = hashlib.sha256()
+            with open(f, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(block), b''):
+                    h.update(chunk)
+            entry = known[f] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        digest.update(os.path.relpath(f, path).encode() + b'\0' + entry[2].encode())
+    return digest.hexdigest()
+
+def code_hash(script):
+    digest = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for module in [script] + SHARED_MODULES:
+        with open(os.path.join(here, f'{module}.py'), 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+def fingerprint(stage, known):
+    """Hash of the stage's input contents, arguments and code; None if an input is missing."""
+    if not all(_files(i) for i in stage.inputs):
+        return None
+    parts = {
+        'argv': stage.argv,
+        'inputs': [content_hash(i, known) for i in stage.inputs],
+        'code': code_hash(stage.script),
+    }
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+def _mtime(path):
+    return max((os.stat(f).st_mtime for f in _files(path)), default=0)
+
+def run_branch(stages, done, known, force=False, in_memory=True):
+    """
+    Runs one branch in order. Returns (fingerprints of stages that are now
+    current, updated file hashes, [(stage, status, seconds), ...]).
+    Stops at the first stage that fails; later stages are left stale.
+    """
+    stage_io.keep_in_memory(in_memory)
+    current = {}
+    report = []
+    for stage in stages:
+        fp = fingerprint(stage, known)
+        if fp is None:
+            report.append((stage.name, 'missing input', 0.0))
+            break
+        if not force and done.get(stage.name) == fp and all(os.path.exists(o) for o in stage.outputs):
+            current[stage.name] = fp
+            report.append((stage.name, 'up to date', 0.0))
+            continue
+
+        print(f"[{stage.name}] {stage.script}.py {' '.join(stage.argv)}", flush=True)
+        start = time.time()
+        try:
+            importlib.import_module(stage.script).main(stage.argv)
+            # The scripts print their errors and return, so check that every output was written
+            ok = all(_mtime(o) >= start - 1 for o in stage.outputs)
+        except (Exception, SystemExit) as e:
+            print(f"[{stage.name}] failed: {e!r}", flush=True)
+            ok = False
+        secs = time.time() - start
+        if not ok:
+            report.append((stage.name, 'failed', secs))
+            break
+        current[stage.name] = fp
+        report.append((stage.name, 'ran', secs))
+    stage_io.keep_in_memory(False)
+    return current, known, report
+
+def load_state(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {'stages': {}, 'files': {}}
+
+def save_state(path, state):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the hex pipeline, skipping stages whose outputs are current.')
+    parser.add_argument('targets', nargs='*', help='Stages to bring up to date, with their upstream stages (default: all)')
+    parser.add_argument('--rides', default='big-data.csv', help='Ride export (query.sql output): a CSV, or a directory or glob of shards')
+    parser.add_argument('--presets', default='preset.csv', help='Preset routes')
+    parser.add_argument('--min_rides', type=int, default=5, help='Minimum number of rides to keep a Hex-8 route')
+    parser.add_argument('--hex_format', choices=['csv', 'npy', 'parquet'], default='npy', help='Format of the Hex-9 enriched rides')
+    parser.add_argument('--workers', type=int, default=1, help='Processes for counting Hex-9 routes')
+    parser.add_argument('--naming', choices=['cell', 'hierarchical'], default='cell', help='Naming mode for fetch_hex_names.py')
+    parser.add_argument('--api_url', default=None, help='Short-address endpoint for fetch_hex_names.py')
+    parser.add_argument('--cache', default=None, help='Name cache for fetch_hex_names.py')
+    parser.add_argument('--jobs', type=int, default=2, help='Independent branches to run at once')
+    parser.add_argument('--force', action='store_true', help='Rerun every selected stage')
+    parser.add_argument('--no_memory', action='store_true', help='Always reread CSVs from disk between stages')
+    parser.add_argument('--dry_run', action='store_true', help='Only show which stages are stale')
+    parser.add_argument('--list', action='store_true', help='Show the stages and exit')
+    parser.add_argument('--metrics', default=None, help='Have every stage append its per-stage timings (NDJSON) to this file')
+
+    args = parser.parse_args(argv)
+    if args.metrics:
+        # Read by metrics.py in each stage, including the branch processes
+        os.environ['HEX_METRICS'] = os.path.abspath(args.metrics)
+
+    stages = build_stages(args)
+    if args.list:
+        deps = upstream(stages)
+        for s in stages:
+            after = ', '.join(sorted(deps[s.name])) or '-'
+            print(f"{s.name:<10} {s.script + '.py':<32} after: {after:<10} -> {', '.join(s.outputs)}")
+        return
+    try:
+        stages = select(stages, args.targets)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    state = load_state(STATE_FILE)
+    if args.dry_run:
+        deps = upstream(stages)
+        stale = set()
+        for s in stages:
+            fp = fingerprint(s, state['files'])
+            # Anything after a stale stage may get new inputs, so counts as stale too
+            if args.force or fp is None or state['stages'].get(s.name) != fp \
+                    or not all(os.path.exists(o) for o in s.outputs) or deps[s.name] & stale:
+                stale.add(s.name)
+            print(f"{s.name:<10} {'stale' if s.name in stale else 'up to date'}")
+        return
+
+    groups = branches(stages)
+    print(f"Running {len(stages)} stages in {len(groups)} independent branches...")
+    start = time.time()
+    jobs = [(g, state['stages'], state['files'], args.force, not args.no_memory) for g in groups]
+    if args.jobs > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(groups))) as pool:
+            results = list(pool.map(run_branch, *zip(*jobs)))
+    else:
+        results = [run_branch(*job) for job in jobs]
+
+    report = []
+    for current, known, branch_report in results:
+        state['stages'].update(current)
+        state['files'].update(known)
+        report.extend(branch_report)
+    for s in stages:
+        if s.name not in {r[0] for r in report if r[1] in ('ran', 'up to date')}:
+            state['stages'].pop(s.name, None)
+    save_state(STATE_FILE, state)
+
+    print("\n--- Pipeline ---")
+    order = {s.name: i for i, s in enumerate(stages)}
+    for name, status, secs in sorted(report, key=lambda r: order[r[0]]):
+        print(f"{name:<10} {status:<14} {secs:>7.1f}s")
+    skipped = [s.name for s in stages if s.name not in {r[0] for r in report}]
+    if skipped:
+        print(f"Not reached: {', '.join(skipped)}")
+    print(f"Total wall time: {time.time() - start:.1f}s")
+    if any(r[1] in ('failed', 'missing input') for r in report):
+        return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""
+Straight-line and hex-grid distances for preset routes, as a baseline to
+sanity-check the OSRM road distances against.
+
+For every preset:
+- straight_km: haversine distance between the two points (or, with
+  --centroids, between their hex centroids)
+- grid_distance_hex{res}: H3 cell steps between the two hexes (-1 if H3 has none)
+- diff_car / diff_bike: OSRM distance minus straight_km
+- osrm_check_car / osrm_check_bike: 'ok', or why the OSRM distance looks wrong:
+  'missing', 'shorter_than_straight_line' (no road beats the straight line)
+  or 'long_detour' (more than --max_detour times the straight line)
+
+Everything is computed on whole columns at once. With --matrix, the same
+distances are also written for every pair of distinct preset hexes as
+.npy matrices, computed in blocks and appended a band of rows at a time.
+
+    python preset_distances.py preset_with_centroids.csv preset_with_distances.csv
+    python preset_distances.py preset_filtered.csv out.csv --matrix hex8_distances
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from hex_index import (
+    parse_latlng_strings, latlng_to_cells, cells_to_latlng, cells_to_local_ij, ij_distance, grid_distances,
+)
+from preset_engine import PICKUP_COL, DESTINATION_COL
+from stage_io import read_csv, write_csv
+from metrics import instrumented, add_arguments, configure, stage
+
+# Mean earth radius H3 uses for its great-circle distances
+EARTH_RADIUS_KM = 6371.007180918475
+OSRM_COLS = {'car': 'OSRM_distance_km_car', 'bike': 'OSRM_distance_km_bike'}
+# OSRM distances are rounded to 10 m, and snapping to the road network can
+# shave a little off very short trips
+SHORTCUT_TOLERANCE_KM = 0.05
+MATRIX_FILE = 'matrix.json'
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km (broadcasts; NaN where a point is missing)."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(x, dtype='float64')) for x in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def osrm_check(osrm_km, straight_km, max_detour=3.0, min_km=0.5):
+    """Labels each OSRM distance 'ok' or with the reason it looks implausible."""
+    osrm_km = np.asarray(osrm_km, dtype='float64')
+    with np.errstate(invalid='ignore'):
+        return np.select(
+            [~(osrm_km > 0),
+             osrm_km < straight_km - SHORTCUT_TOLERANCE_KM,
+             (straight_km >= min_km) & (osrm_km > straight_km * max_detour)],
+            ['missing', 'shorter_than_straight_line', 'long_detour'],
+            default='ok',
+        ).astype(object)
+
+
+def add_distances(df, res=8, centroids=False, max_detour=3.0, min_km=0.5):
+    """
+    Adds the distance and check columns described above to a preset frame.
+    Returns (frame, summary counts).
+    """
+    with stage('index', rows_in=len(df)) as s:
+        p_lat, p_lng = parse_latlng_strings(df[PICKUP_COL])
+        d_lat, d_lng = parse_latlng_strings(df[DESTINATION_COL])
+        p_cells, _ = latlng_to_cells(p_lat, p_lng, res)
+        d_cells, _ = latlng_to_cells(d_lat, d_lng, res)
+        s.rows_out = len(df)
+
+    with stage('enrich', rows_in=len(df)) as s:
+        out = df.copy()
+        if centroids:
+            # NaN for unindexable points, like the centroid columns
+            p_lat, p_lng = cells_to_latlng(p_cells)
+            d_lat, d_lng = cells_to_latlng(d_cells)
+        straight = haversine_km(p_lat, p_lng, d_lat, d_lng)
+        out['straight_km'] = straight.round(3)
+        out[f'grid_distance_hex{res}'] = grid_distances(p_cells, d_cells)
+
+        summary = {'presets': len(out)}
+        for mode, col in OSRM_COLS.items():
+            if col not in out:
+                continue
+            osrm = pd.to_numeric(out[col], errors='coerce').to_numpy(dtype='float64')
+            out[f'diff_{mode}'] = (osrm - straight).round(3)
+            out[f'osrm_check_{mode}'] = check = osrm_check(osrm, straight, max_detour, min_km)
+            summary[f'implausible_{mode}'] = int((check != 'ok').sum())
+        s.rows_out = len(out)
+    return out, summary
+
+
+def preset_cells(df, res=8):
+    """Distinct non-null hexes at either end of the presets, sorted."""
+    cells = np.concatenate([
+        latlng_to_cells(*parse_latlng_strings(df[PICKUP_COL]), res)[0],
+        latlng_to_cells(*parse_latlng_strings(df[DESTINATION_COL]), res)[0],
+    ])
+    return np.unique(cells[cells != 0])
+
+
+def iter_distance_blocks(cells, block=2048, rows=None):
+    """
+    Yields (row_start, col_start, km, steps) blocks of the cells x cells
+    distance matrix, `rows` (default `block`) by `block` at a time: centroid
+    haversine km (float32) and H3 grid steps (int32, -1 for cells outside
+    the shared local IJ frame).
+    """
+    lat, lng = cells_to_latlng(cells)
+    i, j, ok = cells_to_local_ij(cells)
+    n = len(cells)
+    rows = rows or block
+    for r in range(0, n, rows):
+        rs = slice(r, min(r + rows, n))
+        for c in range(0, n, block):
+            cs = slice(c, min(c + block, n))
+            km = haversine_km(lat[rs, None], lng[rs, None], lat[None, cs], lng[None, cs]).astype(np.float32)
+            steps = ij_distance(i[rs, None], j[rs, None], i[None, cs], j[None, cs]).astype(np.int32)
+            steps[~(ok[rs, None] & ok[None, cs])] = -1
+            yield r, c, km, steps
+
+
+def _npy_writer(path, dtype, shape):
+    f = open(path, 'wb')
+    header = {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)), 'fortran_order': False, 'shape': shape}
+    np.lib.format.write_array_header_1_0(f, header)
+    return f
+
+
+def write_distance_matrix(cells, path, res, block=2048, band_bytes=1 << 26):
+    """
+    Writes cells.npy, straight_km.npy and grid_distance.npy (n x n) plus
+    matrix.json to the directory `path`, replacing it. Rows are computed and
+    appended in bands of at most `band_bytes` per matrix, so memory does
+    not grow with n.
+    """
+    tmp = path.rstrip('/\\') + '.tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    n = len(cells)
+    np.save(os.path.join(tmp, 'cells.npy'), np.asarray(cells, dtype=np.uint64))
+    rows = max(1, min(block, band_bytes // (4 * max(n, 1))))
+    km_band = np.empty((rows, n), dtype=np.float32)
+    steps_band = np.empty((rows, n), dtype=np.int32)
+    unknown = 0
+    with _npy_writer(os.path.join(tmp, 'straight_km.npy'), np.float32, (n, n)) as km_file, \
+         _npy_writer(os.path.join(tmp, 'grid_distance.npy'), np.int32, (n, n)) as steps_file:
+        for r, c, km, steps in iter_distance_blocks(cells, block, rows):
+            km_band[:len(km), c:c + km.shape[1]] = km
+            steps_band[:len(steps), c:c + steps.shape[1]] = steps
+            unknown += int((steps < 0).sum())
+            if c + km.shape[1] == n:
+                # Band complete: append its rows
+                km_file.write(km_band[:len(km)].tobytes())
+                steps_file.write(steps_band[:len(steps)].tobytes())
+    with open(os.path.join(tmp, MATRIX_FILE), 'w') as f:
+        json.dump({'resolution': res, 'cells': n, 'block': block, 'unknown_grid_distances': unknown}, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return unknown
+
+
+@instrumented('preset_distances')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Straight-line and hex-grid distances for presets, and OSRM sanity checks.')
+    parser.add_argument('preset_csv', nargs='?', default='preset_with_centroids.csv', help='Presets (any file with the two Lat,Lon columns)')
+    parser.add_argument('output_csv', nargs='?', default='preset_with_distances.csv', help='Output filename')
+    parser.add_argument('--resolution', type=int, default=8, help='H3 resolution for grid distances')
+    parser.add_argument('--centroids', action='store_true', help='Measure between hex centroids instead of the preset points')
+    parser.add_argument('--max_detour', type=float, default=3.0, help='Flag OSRM distances over this many times the straight line')
+    parser.add_argument('--min_km', type=float, default=0.5, help='Only flag detours on trips at least this long (straight line)')
+    parser.add_argument('--matrix', default=None, help='Also write the distance matrix of all distinct preset hexes to this directory')
+    parser.add_argument('--block', type=int, default=2048, help='Matrix rows and columns computed per block')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
+
+    if not os.path.exists(args.preset_csv):
+        print(f"Error: {args.preset_csv} not found.")
+        return
+
+    df = read_csv(args.preset_csv)
+    print(f"Measuring {len(df)} presets at Hex-{args.resolution}...")
+    out, summary = add_distances(df, args.resolution, args.centroids, args.max_detour, args.min_km)
+    for mode in OSRM_COLS:
+        if f'implausible_{mode}' in summary:
+            print(f"- Implausible OSRM {mode} distances: {summary[f'implausible_{mode}']}")
+    write_csv(out, args.output_csv)
+    print(f"Saved to {args.output_csv}")
+
+    if args.matrix:
+        cells = preset_cells(df, args.resolution)
+        print(f"Writing the {len(cells)} x {len(cells)} hex distance matrix to {args.matrix}...")
+        with stage('matrix', rows_in=len(cells)) as s:
+            unknown = write_distance_matrix(cells, args.matrix, args.resolution, args.block)
+            s.rows_out = len(cells) ** 2
+        if unknown:
+            print(f"- {unknown} hex pairs have no grid distance (-1)")
+
+if __name__ == "__main__":
+    main()
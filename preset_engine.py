@@ -0,0 +1,92 @@
+"""
+Single-pass preset processing shared by the preset scripts.
+
+A preset file is parsed column-wise and both ends are indexed once. From
+there everything works on uint64 cell arrays: the route filter is one
+batch lookup in a RouteIndex of the valid (pickup, dropoff) pairs, repeated
+hex pairs are dropped in one hashed pass, and centroids are computed once
+per distinct cell.
+Hex strings are only made for the output columns.
+
+With a tolerance of k, a preset also matches a route whose ends are each
+within k grid steps of its own (see hex_neighbours.py), and the lane it
+matched is added to the output.
+"""
+import numpy as np
+import pandas as pd
+from hex_index import latlng_strings_to_cells, cells_to_str, cells_to_latlng
+from route_index import RouteIndex
+from hex_neighbours import LaneMatcher
+from metrics import stage
+
+PICKUP_COL = 'Popular Pickup Lat,Lon'
+DESTINATION_COL = 'Popular Destination Lat, Lon'
+
+
+def route_mask(p_cells, d_cells, routes):
+    """
+    True where (p_cells[i], d_cells[i]) is one of `routes`: a RouteIndex,
+    or a route-count table that is indexed on the fly.
+    """
+    if not isinstance(routes, RouteIndex):
+        routes = RouteIndex.from_counts(routes)
+    return routes.contains(p_cells, d_cells)
+
+
+def process_presets(df, res=8, routes=None, dedupe=False, hex_columns=True, centroids=False, tolerance=0):
+    """
+    Indexes both ends of every preset at `res` and then, in order:
+    keeps presets whose hex pair is in `routes` (if given; within
+    `tolerance` grid steps of each end if that is over 0), drops repeated
+    hex pairs (if dedupe), and adds pickup_hex{res}/destination_hex{res}
+    and their centroid columns. Returns (frame, summary counts).
+    """
+    with stage('index', rows_in=len(df)) as s:
+        p_cells, p_valid = latlng_strings_to_cells(df[PICKUP_COL], res)
+        d_cells, d_valid = latlng_strings_to_cells(df[DESTINATION_COL], res)
+        s.rows_out = len(df)
+    summary = {'presets': len(df)}
+
+    with stage('filter', rows_in=len(df)) as s:
+        keep = np.ones(len(df), dtype=bool)
+        lanes = None
+        if routes is not None and tolerance > 0:
+            if not isinstance(routes, RouteIndex):
+                routes = RouteIndex.from_counts(routes)
+            lanes = LaneMatcher(routes, tolerance).match(p_cells, d_cells)
+            keep = lanes[2] > 0
+            summary['exact'] = int((lanes[3] == 0).sum())
+        elif routes is not None:
+            # Unindexable presets have cell 0, which is never a route end
+            keep = route_mask(p_cells, d_cells, routes)
+        summary['kept'] = int(keep.sum())
+
+        if dedupe:
+            pairs = pd.MultiIndex.from_arrays([p_cells[keep], d_cells[keep]])
+            first = np.flatnonzero(keep)[~pairs.duplicated()]
+            keep = np.zeros(len(df), dtype=bool)
+            keep[first] = True
+        summary['unique'] = int(keep.sum())
+
+        out = df[keep].copy()
+        p_cells, p_valid, d_cells, d_valid = p_cells[keep], p_valid[keep], d_cells[keep], d_valid[keep]
+        if lanes is not None:
+            lanes = [values[keep] for values in lanes]
+        s.rows_out = len(out)
+
+    with stage('enrich', rows_in=len(out)) as s:
+        if hex_columns:
+            out[f'pickup_hex{res}'] = cells_to_str(p_cells, p_valid)
+            out[f'destination_hex{res}'] = cells_to_str(d_cells, d_valid)
+        if centroids:
+            out[f'pickup_hex{res}_lat'], out[f'pickup_hex{res}_lon'] = cells_to_latlng(p_cells)
+            out[f'destination_hex{res}_lat'], out[f'destination_hex{res}_lon'] = cells_to_latlng(d_cells)
+        if lanes is not None:
+            lane_p, lane_d, rides, shift = lanes
+            out[f'lane_pickup_hex{res}'] = cells_to_str(lane_p)
+            out[f'lane_destination_hex{res}'] = cells_to_str(lane_d)
+            out['lane_ride_count'] = rides
+            # Grid steps moved, pickup and dropoff together (0 for an exact match)
+            out['lane_shift'] = shift
+        s.rows_out = len(out)
+    return out, summary
@@ -3,7 +3,8 @@ SELECT
   estimated_pickup_latitude,
   estimated_pickup_longitude,
   estimated_dropoff_latitude,
-  estimated_dropoff_longitude
+  estimated_dropoff_longitude,
+  created_at
 FROM `data-cloud-production.pathao_ride.rides` 
 WHERE
     city_id = 1
@@ -0,0 +1,417 @@
+"""
+Route-count aggregation shared by the ride scripts.
+
+Rides are read either in one go or in chunks. Each chunk is indexed, reduced
+to a (pickup cell, dropoff cell) -> count table and folded into a running
+total, so with --chunksize the peak memory depends on the number of distinct
+routes rather than the number of rides.
+
+With --workers the file is split into byte ranges that a process pool counts
+independently; the partial tables are merged before any filtering, so the
+result is the same as a single-process run.
+
+An input may also be a directory or glob of shards (the way BigQuery exports
+large tables), each plain or compressed (.gz, .bz2, .xz, .zip; .zst with the
+zstandard package). Shards are read in name order as one stream, with the
+next shards decompressed and parsed ahead in background threads. With
+--workers every shard is its own pool job, and large plain shards are split
+further into byte ranges, so nothing is ever concatenated on disk.
+
+Inputs written by columnar.py (npy directories, Parquet) are read through it
+instead of the CSV parser, memory-mapping only the columns a stage uses.
+"""
+import csv
+import glob
+import io
+import math
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import pandas as pd
+from hex_index import latlng_to_cells, str_to_cells, cells_to_str, cell_to_parent
+from columnar import is_columnar, iter_table
+from partitioned import is_partitioned, partition_paths
+from metrics import stage, timed_chunks
+import stage_io
+
+PICKUP_COLS = ('estimated_pickup_latitude', 'estimated_pickup_longitude')
+DROPOFF_COLS = ('estimated_dropoff_latitude', 'estimated_dropoff_longitude')
+# The only ride columns the counting stages use; hashed_id and the rest of
+# the export are never parsed
+RIDE_COLS = PICKUP_COLS + DROPOFF_COLS
+# pandas infers the compression from these suffixes
+COMPRESSED_SUFFIXES = ('.gz', '.bz2', '.xz', '.zst', '.zip')
+SHARD_SUFFIXES = ('.csv', '.parquet', '.pq') + COMPRESSED_SUFFIXES
+# Shards decompressed and parsed ahead of the one being consumed
+PREFETCH_SHARDS = 2
+
+
+def is_compressed(path):
+    return str(path).endswith(COMPRESSED_SUFFIXES)
+
+
+def expand_inputs(path):
+    """
+    The ride files behind `path`: the file (or columnar table) itself, the
+    partitions of a partitioned dataset, the shard files in a directory, or
+    the files matching a glob. Sorted by name.
+    """
+    path = os.fspath(path)
+    if is_partitioned(path):
+        return partition_paths(path)
+    if is_columnar(path) or os.path.isfile(path):
+        return [path]
+    if os.path.isdir(path):
+        names = sorted(n for n in os.listdir(path) if n.endswith(SHARD_SUFFIXES))
+        return [os.path.join(path, n) for n in names if os.path.isfile(os.path.join(path, n))]
+    return sorted(f for f in glob.glob(path) if os.path.isfile(f) or is_columnar(f))
+
+
+def input_exists(path):
+    """True if `path` names at least one ride file (see expand_inputs)."""
+    return bool(expand_inputs(path))
+
+
+_DONE = object()
+
+
+def _put(q, item, cancel):
+    while not cancel.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _prefetch(chunks, q, cancel):
+    """Feeds one shard's chunks into q; errors are passed on to the reader."""
+    try:
+        for df in chunks:
+            if not _put(q, df, cancel):
+                return
+        _put(q, _DONE, cancel)
+    except BaseException as e:
+        _put(q, e, cancel)
+
+
+def _read_shards(files, chunksize, usecols, prefetch=PREFETCH_SHARDS):
+    """
+    Yields the chunks of several files in order. Up to `prefetch` files are
+    read at once in threads (zlib and the CSV tokenizer release the GIL);
+    each holds at most two parsed chunks, so memory stays bounded.
+    """
+    files = iter(files)
+    pending = []
+    cancel = threading.Event()
+
+    def start_next():
+        path = next(files, None)
+        if path is not None:
+            q = queue.Queue(maxsize=2)
+            threading.Thread(target=_prefetch, args=(read_rides(path, chunksize, usecols), q, cancel),
+                             daemon=True).start()
+            pending.append(q)
+
+    try:
+        for _ in range(max(prefetch, 1)):
+            start_next()
+        while pending:
+            q = pending.pop(0)
+            while (item := q.get()) is not _DONE:
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+            start_next()
+    finally:
+        # Stops the readers if the consumer gives up early
+        cancel.set()
+
+
+def coerce_coords(df):
+    """Parses any coordinate column that did not come out numeric, bad tokens as NaN."""
+    for col in RIDE_COLS:
+        if col in df and not pd.api.types.is_numeric_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def read_rides(path, chunksize=None, usecols=None, names=None):
+    """
+    Yields the ride file as DataFrames: whole, or `chunksize` rows at a time.
+    Coordinate columns come out numeric: a token that is not a number (a
+    stray 'abc' in an export) becomes NaN, which valid_latlng_mask drops.
+    A directory or glob of shards yields each shard (or its chunks) in turn.
+    """
+    if isinstance(path, (str, os.PathLike)):
+        files = expand_inputs(path)
+        if files and files != [os.fspath(path)]:
+            yield from _read_shards(files, chunksize, usecols)
+            return
+        if is_columnar(path):
+            yield from iter_table(path, usecols, chunksize)
+            return
+    header = None if names is not None else 'infer'
+    options = dict(usecols=usecols, names=names, header=header)
+    if chunksize:
+        for df in pd.read_csv(path, chunksize=chunksize, **options):
+            yield coerce_coords(df)
+    else:
+        yield coerce_coords(pd.read_csv(path, **options))
+
+
+def byte_range_shards(path, n):
+    """
+    Splits a CSV into up to n (start, end) byte ranges that begin on line starts.
+    Returns (column names, ranges). Assumes no quoted field spans a newline,
+    which holds for the numeric ride exports.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        data_start = f.tell()
+        bounds = [data_start]
+        for i in range(1, n):
+            target = data_start + (size - data_start) * i // n
+            if target <= bounds[-1]:
+                continue
+            # Step back one byte so a target already on a line start stays put
+            f.seek(target - 1)
+            f.readline()
+            bounds.append(min(f.tell(), size))
+        bounds.append(size)
+    names = next(csv.reader([header.decode('utf-8-sig').rstrip('\r\n')]))
+    return names, [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+class _ByteRange(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file."""
+
+    def __init__(self, path, start, end):
+        self._f = open(path, 'rb')
+        self._f.seek(start)
+        self._remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        n = min(len(buf), self._remaining)
+        if n <= 0:
+            return 0
+        data = self._f.read(n)
+        buf[:len(data)] = data
+        self._remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self._f.close()
+        super().close()
+
+
+def read_rides_range(path, start, end, names, chunksize=None, usecols=None):
+    """Like read_rides, for one byte range from byte_range_shards."""
+    with io.TextIOWrapper(io.BufferedReader(_ByteRange(path, start, end)), encoding='utf-8') as f:
+        yield from read_rides(f, chunksize, usecols=usecols, names=names)
+
+
+def index_rides(df, res):
+    """Returns (pickup cells, dropoff cells) for rides whose both ends are valid."""
+    p_cells, p_valid = latlng_to_cells(df[PICKUP_COLS[0]], df[PICKUP_COLS[1]], res)
+    d_cells, d_valid = latlng_to_cells(df[DROPOFF_COLS[0]], df[DROPOFF_COLS[1]], res)
+    keep = p_valid & d_valid
+    return p_cells[keep], d_cells[keep]
+
+
+def count_pairs(p_cells, d_cells):
+    """Counts rides per (pickup, dropoff) cell pair, sorted by pair."""
+    pairs = pd.DataFrame({'p': p_cells, 'd': d_cells})
+    return pairs.groupby(['p', 'd'], sort=True).size()
+
+
+def merge_counts(running, counts):
+    """
+    Folds a partial count table into the running one (either may be None).
+    Dicts of {resolution: counts} are merged per resolution, sketches with
+    their own merge().
+    """
+    if running is None:
+        return counts
+    if counts is None:
+        return running
+    if hasattr(running, 'merge'):
+        # Sketches (heavy_hitters.RouteSketch) merge themselves
+        return running.merge(counts)
+    if isinstance(running, dict):
+        return {res: merge_counts(running.get(res), counts.get(res)) for res in running.keys() | counts.keys()}
+    return pd.concat([running, counts]).groupby(level=list(range(running.index.nlevels)), sort=True).sum()
+
+
+def count_routes(chunks, res):
+    """Indexes ride chunks at resolution `res` and returns the total route counts."""
+    total = None
+    for df in timed_chunks(chunks):
+        with stage('index', rows_in=len(df)) as s:
+            p_cells, d_cells = index_rides(df, res)
+            s.rows_out = len(p_cells)
+        # Drop the raw rows before the next chunk is parsed
+        del df
+        with stage('group', rows_in=len(p_cells)) as s:
+            before = 0 if total is None else len(total)
+            total = merge_counts(total, count_pairs(p_cells, d_cells))
+            # New routes only, so the chunks add up to the final table size
+            s.rows_out = len(total) - before
+    if total is None:
+        total = count_pairs(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+    return total
+
+
+def rollup_counts(counts, res):
+    """
+    Derives res-`res` route counts from a finer table by summing over parent
+    cells. Note that H3 children do not tile their parent exactly, so for
+    rides near cell edges the parent can differ from direct indexing at `res`.
+    """
+    with stage('group', rows_in=len(counts)) as s:
+        pairs = pd.DataFrame({
+            'p': cell_to_parent(counts.index.get_level_values(0).to_numpy(dtype=np.uint64), res),
+            'd': cell_to_parent(counts.index.get_level_values(1).to_numpy(dtype=np.uint64), res),
+            'ride_count': counts.to_numpy(dtype='int64'),
+        })
+        rolled = pairs.groupby(['p', 'd'], sort=True)['ride_count'].sum()
+        s.rows_out = len(rolled)
+    return rolled
+
+
+def count_routes_multi(chunks, resolutions, exact=False):
+    """
+    Route counts for several resolutions from one pass over the rides.
+    By default rides are indexed only at the finest resolution and coarser
+    tables are rolled up; with exact=True every resolution is indexed directly
+    in the same pass. Returns {resolution: counts}.
+    """
+    resolutions = sorted(set(resolutions), reverse=True)
+    if not exact:
+        finest = count_routes(chunks, resolutions[0])
+        return {res: finest if res == resolutions[0] else rollup_counts(finest, res) for res in resolutions}
+
+    total = None
+    for df in timed_chunks(chunks):
+        with stage('index', rows_in=len(df)) as s:
+            cells = {res: index_rides(df, res) for res in resolutions}
+            s.rows_out = len(cells[resolutions[0]][0])
+        del df
+        with stage('group', rows_in=sum(len(p) for p, _ in cells.values())) as s:
+            before = 0 if total is None else sum(len(counts) for counts in total.values())
+            total = merge_counts(total, {res: count_pairs(*pairs) for res, pairs in cells.items()})
+            s.rows_out = sum(len(counts) for counts in total.values()) - before
+        del cells
+    if total is None:
+        total = {res: count_routes([], res) for res in resolutions}
+    return total
+
+
+def count_hex_routes(chunks, p_col, d_col):
+    """Same as count_routes, for chunks that already carry hex string columns."""
+    total = None
+    for df in timed_chunks(chunks):
+        with stage('index', rows_in=len(df)) as s:
+            # Columnar intermediates already hold the cells as uint64
+            p_cells = df[p_col].to_numpy() if df[p_col].dtype == np.uint64 else str_to_cells(df[p_col])
+            d_cells = df[d_col].to_numpy() if df[d_col].dtype == np.uint64 else str_to_cells(df[d_col])
+            keep = (p_cells != 0) & (d_cells != 0)
+            p_cells, d_cells = p_cells[keep], d_cells[keep]
+            s.rows_out = len(p_cells)
+        del df
+        with stage('group', rows_in=len(p_cells)) as s:
+            before = 0 if total is None else len(total)
+            total = merge_counts(total, count_pairs(p_cells, d_cells))
+            # New routes only, so the chunks add up to the final table size
+            s.rows_out = len(total) - before
+    if total is None:
+        total = count_pairs(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+    return total
+
+
+def counts_to_frame(counts, p_col, d_col):
+    """Turns a route-count table into the usual (p_col, d_col, ride_count) DataFrame."""
+    return pd.DataFrame({
+        p_col: cells_to_str(counts.index.get_level_values(0).to_numpy(dtype=np.uint64)),
+        d_col: cells_to_str(counts.index.get_level_values(1).to_numpy(dtype=np.uint64)),
+        'ride_count': counts.to_numpy(dtype='int64'),
+    })
+
+
+def read_counts_csv(path):
+    """Loads a route-count CSV (pickup hex, dropoff hex, ride_count) back into a count table."""
+    df = stage_io.read_csv(path)
+    p_col, d_col = df.columns[:2]
+    pairs = pd.DataFrame({
+        'p': str_to_cells(df[p_col]),
+        'd': str_to_cells(df[d_col]),
+        'ride_count': df['ride_count'].to_numpy(dtype='int64'),
+    })
+    return pairs.groupby(['p', 'd'], sort=True)['ride_count'].sum()
+
+
+def route_columns(res):
+    """Column names the existing outputs use for resolution `res`."""
+    if res == 9:
+        return 'pickup_hex_9', 'dropoff_hex_9'
+    return f'p_hex{res}', f'd_hex{res}'
+
+
+def _count_shard(path, start, end, names, chunksize, usecols, count_fn):
+    return count_fn(read_rides_range(path, start, end, names, chunksize, usecols))
+
+
+def _count_whole(path, chunksize, usecols, count_fn):
+    return count_fn(read_rides(path, chunksize, usecols))
+
+
+def count_jobs(files, workers, chunksize, usecols, count_fn):
+    """
+    One pool job per file. Plain CSVs are split into byte ranges as well
+    when there are fewer files than workers; compressed files and columnar
+    tables cannot be split and are read whole.
+    """
+    splits = math.ceil(workers / len(files))
+    jobs = []
+    for path in files:
+        if splits > 1 and not is_compressed(path) and not is_columnar(path):
+            names, ranges = byte_range_shards(path, splits)
+            jobs += [partial(_count_shard, path, start, end, names, chunksize, usecols, count_fn)
+                     for start, end in ranges]
+        else:
+            jobs.append(partial(_count_whole, path, chunksize, usecols, count_fn))
+    return jobs
+
+
+def count_file(path, count_fn, workers=1, chunksize=None, usecols=RIDE_COLS):
+    """
+    Runs count_fn (chunks -> route counts) over a ride file or set of shards,
+    either in this process or as jobs (see count_jobs) in a process pool.
+    A lone columnar table or compressed file is read in this process.
+    Only `usecols` (by default the ride coordinates) are read.
+    """
+    files = expand_inputs(path)
+    jobs = count_jobs(files, workers, chunksize, usecols, count_fn) if workers > 1 and files else []
+    if len(jobs) <= 1:
+        return count_fn(read_rides(path, chunksize, usecols))
+
+    total = None
+    # The workers' own read/index/group timings stay in their processes;
+    # here the whole fan-out is one 'count' stage
+    with stage('count') as s:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(job) for job in jobs]
+            for future in futures:
+                total = merge_counts(total, future.result())
+        if total is None:
+            total = count_fn([])
+        s.rows_out = sum(len(t) for t in total.values()) if isinstance(total, dict) else len(total)
+    return total
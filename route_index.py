@@ -0,0 +1,214 @@
+"""
+Compact membership index over (pickup, dropoff) hex pairs.
+
+Pairs are stored as one sorted uint64 key each: the rank of the pickup cell
+among all pickups times the number of distinct dropoffs, plus the rank of
+the dropoff cell. Next to the keys sit the two sorted arrays of distinct
+cells and a uint32 ride count per pair, so a pair costs 12 bytes plus its
+share of the cell arrays. Batch lookups are three np.searchsorted calls.
+
+Saved indexes are a single file (a small JSON header followed by the raw
+arrays), memory-mapped on load so that opening one costs nothing up front:
+
+    python route_index.py build hex8_route_counts_filtered.csv hex8_routes.idx
+"""
+import argparse
+import json
+import os
+import numpy as np
+from route_counts import read_counts_csv
+
+MAGIC = b'HEXROUTEIDX1'
+ALIGN = 64
+SORT_QUERIES_OVER = 1 << 16
+ARRAYS = (('p_cells', np.uint64), ('d_cells', np.uint64), ('keys', np.uint64), ('counts', np.uint32))
+
+
+class RouteIndex:
+    """Sorted, packed set of (pickup cell, dropoff cell) pairs with their ride counts."""
+
+    def __init__(self, p_cells, d_cells, keys, counts):
+        self.p_cells = p_cells
+        self.d_cells = d_cells
+        self.keys = keys
+        self.counts = counts
+
+    @classmethod
+    def from_pairs(cls, p, d, counts=None):
+        """Builds an index from parallel cell arrays; repeated pairs have their counts summed."""
+        p = np.asarray(p, dtype=np.uint64)
+        d = np.asarray(d, dtype=np.uint64)
+        counts = np.ones(len(p), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        p_cells, p_rank = np.unique(p, return_inverse=True)
+        d_cells, d_rank = np.unique(d, return_inverse=True)
+        keys = p_rank.astype(np.uint64) * np.uint64(len(d_cells)) + d_rank.astype(np.uint64)
+        keys, pair = np.unique(keys, return_inverse=True)
+        summed = np.bincount(pair.ravel(), weights=counts, minlength=len(keys)) if len(keys) else np.empty(0)
+        if len(summed) and summed.max() > np.iinfo(np.uint32).max:
+            raise ValueError("Route counts do not fit in uint32")
+        return cls(p_cells, d_cells, keys, summed.astype(np.uint32))
+
+    @classmethod
+    def from_counts(cls, counts, min_rides=1):
+        """Builds an index from a route-count table, keeping routes with at least min_rides."""
+        counts = counts[counts >= min_rides]
+        return cls.from_pairs(counts.index.get_level_values(0), counts.index.get_level_values(1), counts.to_numpy())
+
+    @classmethod
+    def from_csv(cls, path, min_rides=1):
+        return cls.from_counts(read_counts_csv(path), min_rides)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _ in ARRAYS)
+
+    def _positions(self, p, d):
+        """Position of each queried pair in keys, or -1 where it is absent."""
+        p = np.asarray(p, dtype=np.uint64)
+        d = np.asarray(d, dtype=np.uint64)
+        pos = np.full(len(p), -1, dtype=np.int64)
+        if not len(self.keys):
+            return pos
+        p_rank = np.minimum(np.searchsorted(self.p_cells, p), len(self.p_cells) - 1)
+        d_rank = np.minimum(np.searchsorted(self.d_cells, d), len(self.d_cells) - 1)
+        known = (self.p_cells[p_rank] == p) & (self.d_cells[d_rank] == d)
+        keys = p_rank[known].astype(np.uint64) * np.uint64(len(self.d_cells)) + d_rank[known].astype(np.uint64)
+        if len(keys) > SORT_QUERIES_OVER:
+            # Searching in key order walks the array once instead of missing cache on every probe
+            order = np.argsort(keys)
+            at = np.empty(len(keys), dtype=np.int64)
+            at[order] = np.searchsorted(self.keys, keys[order])
+        else:
+            at = np.searchsorted(self.keys, keys)
+        at = np.minimum(at, len(self.keys) - 1)
+        hit = self.keys[at] == keys
+        pos[np.flatnonzero(known)[hit]] = at[hit]
+        return pos
+
+    def contains(self, p, d):
+        """Vectorized membership test: True where (p[i], d[i]) is in the index."""
+        return self._positions(p, d) >= 0
+
+    def lookup(self, p, d):
+        """Ride counts for each queried pair (0 where the pair is not in the index)."""
+        pos = self._positions(p, d)
+        out = np.zeros(len(pos), dtype=np.int64)
+        out[pos >= 0] = self.counts[pos[pos >= 0]]
+        return out
+
+    def count(self, p, d):
+        """Ride count of a single pair (0 if absent), without the array overhead of lookup()."""
+        p, d = np.uint64(p), np.uint64(d)
+        i = int(self.p_cells.searchsorted(p))
+        j = int(self.d_cells.searchsorted(d))
+        if i == len(self.p_cells) or j == len(self.d_cells) or self.p_cells[i] != p or self.d_cells[j] != d:
+            return 0
+        key = np.uint64(i * len(self.d_cells) + j)
+        k = int(self.keys.searchsorted(key))
+        return int(self.counts[k]) if k < len(self.keys) and self.keys[k] == key else 0
+
+    def __contains__(self, pair):
+        return self.count(*pair) > 0
+
+    def pairs(self):
+        """(p, d, counts) arrays of every indexed route, in key order."""
+        n_d = np.uint64(max(len(self.d_cells), 1))
+        return self.p_cells[self.keys // n_d], self.d_cells[self.keys % n_d], self.counts.astype(np.int64)
+
+    def filtered(self, min_rides):
+        """A new index with only the routes that have at least min_rides."""
+        p, d, counts = self.pairs()
+        keep = counts >= min_rides
+        return RouteIndex.from_pairs(p[keep], d[keep], counts[keep])
+
+    def save(self, path):
+        """Writes the index to one file (written next to it, then renamed into place)."""
+        header = {'arrays': []}
+        offset = 0
+        for name, dtype in ARRAYS:
+            header['arrays'].append({'name': name, 'dtype': np.dtype(dtype).str, 'length': len(getattr(self, name)),
+                                     'offset': offset})
+            offset += -(-getattr(self, name).nbytes // ALIGN) * ALIGN
+        blob = json.dumps(header).encode()
+        start = -(-(len(MAGIC) + 8 + len(blob)) // ALIGN) * ALIGN
+        with open(path + '.tmp', 'wb') as f:
+            f.write(MAGIC + len(blob).to_bytes(8, 'little') + blob)
+            for entry, (name, dtype) in zip(header['arrays'], ARRAYS):
+                f.seek(start + entry['offset'])
+                f.write(np.ascontiguousarray(getattr(self, name), dtype=np.dtype(dtype).newbyteorder('<')).tobytes())
+            f.truncate(start + offset)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Opens a saved index; with mmap the arrays are paged in only as lookups touch them."""
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a route index")
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+        start = -(-(len(MAGIC) + 8 + size) // ALIGN) * ALIGN
+        arrays = {}
+        for entry in header['arrays']:
+            dtype = np.dtype(entry['dtype'])
+            if not entry['length']:
+                arrays[entry['name']] = np.empty(0, dtype=dtype)
+            elif mmap:
+                arrays[entry['name']] = np.memmap(path, dtype=dtype, mode='r', offset=start + entry['offset'],
+                                                  shape=(entry['length'],))
+            else:
+                arrays[entry['name']] = np.fromfile(path, dtype=dtype, count=entry['length'],
+                                                    offset=start + entry['offset'])
+        return cls(**arrays)
+
+
+def is_route_index(path):
+    if os.path.isdir(path) or not os.path.exists(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_routes(path, min_rides=1):
+    """A saved index as is, or an index built from a route-count CSV."""
+    if is_route_index(path):
+        index = RouteIndex.load(path)
+        return index if min_rides <= 1 else index.filtered(min_rides)
+    return RouteIndex.from_csv(path, min_rides)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or inspect a hex-pair route index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('build', help='Index a route-count CSV')
+    p.add_argument('input_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='Route counts (pickup hex, dropoff hex, ride_count)')
+    p.add_argument('output', nargs='?', default='hex8_routes.idx', help='Index file')
+    p.add_argument('--min_rides', type=int, default=1, help='Only index routes with at least this many rides')
+
+    p = commands.add_parser('info', help='Describe a saved index')
+    p.add_argument('index', nargs='?', default='hex8_routes.idx')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if not os.path.exists(args.input_csv):
+            print(f"Error: {args.input_csv} not found.")
+            return
+        print(f"Indexing {args.input_csv}...")
+        index = RouteIndex.from_csv(args.input_csv, args.min_rides)
+        index.save(args.output)
+        print(f"Saved {len(index)} routes to {args.output} ({os.path.getsize(args.output)} bytes)")
+    else:
+        if not is_route_index(args.index):
+            print(f"Error: {args.index} is not a route index.")
+            return
+        index = RouteIndex.load(args.index)
+        print(f"{args.index}: {len(index)} routes, {len(index.p_cells)} pickup and {len(index.d_cells)} dropoff cells, "
+              f"{index.nbytes / max(len(index), 1):.1f} bytes per route")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""
+Online route lookups over the precomputed hex data.
+
+For a pickup and dropoff lat/lon, answers the Hex-8 pair, its ride count,
+whether it is a power lane, and both area names. Everything is loaded once
+into a snapshot (RouteIndex arrays and a dict of names keyed by cell); the
+request path only does scalar H3 indexing, searchsorted and dict lookups.
+
+When any source file changes (e.g. a new month was exported), a fresh
+snapshot is built in the background and swapped in; requests in flight keep
+using the one they started with. A file is only reloaded once it has stopped
+changing between two polls, so half-written exports are never picked up.
+
+    python route_lookup.py --port 8090
+    curl 'localhost:8090/route?pickup=23.78,90.40&dropoff=23.75,90.39'
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+from hex_index import latlng_to_cell
+from route_index import load_routes
+from area_naming import read_names
+
+Snapshot = namedtuple('Snapshot', 'counts lanes names versions loaded_at')
+
+
+def file_versions(paths):
+    """(mtime, size) of each existing file, to tell when one was rewritten."""
+    versions = {}
+    for path in paths:
+        if path and os.path.exists(path):
+            st = os.stat(path)
+            versions[path] = (st.st_mtime_ns, st.st_size)
+    return versions
+
+
+class RouteLookup:
+    """
+    Loads route counts, power lanes and names once and answers lookups from
+    memory. lanes defaults to the routes in `counts` with at least min_rides.
+    Route sources may be CSVs or saved route indexes.
+    """
+
+    def __init__(self, counts='hex8_route_counts.csv', lanes='hex8_route_counts_filtered.csv',
+                 names='preset_with_names.csv', min_rides=5, res=8):
+        self.paths = [counts, lanes, names]
+        self.min_rides = min_rides
+        self.res = res
+        self.snapshot = self._load()
+        self._pending = None
+
+    def _load(self):
+        counts_path, lanes_path, names_path = self.paths
+        versions = file_versions(self.paths)
+        counts = load_routes(counts_path)
+        lanes = load_routes(lanes_path) if lanes_path and os.path.exists(lanes_path) else counts.filtered(self.min_rides)
+        names = read_names(names_path) if names_path and os.path.exists(names_path) else {}
+        return Snapshot(counts, lanes, names, versions, time.time())
+
+    def reload_if_changed(self):
+        """Swaps in a new snapshot if the source files changed and have settled. Returns True if it did."""
+        versions = file_versions(self.paths)
+        if versions == self.snapshot.versions:
+            self._pending = None
+            return False
+        if versions != self._pending:
+            # Changed since the last poll: wait until the writer is done
+            self._pending = versions
+            return False
+        try:
+            snapshot = self._load()
+        except Exception as e:
+            print(f"Reload failed, keeping the current data: {e}")
+            return False
+        self.snapshot = snapshot
+        self._pending = None
+        return True
+
+    def watch(self, interval=5.0):
+        """Polls for changed files every `interval` seconds in a daemon thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                if self.reload_if_changed():
+                    print(f"Reloaded: {len(self.snapshot.counts)} routes, {len(self.snapshot.names)} named hexes")
+        thread = threading.Thread(target=loop, daemon=True)
+        thread.start()
+        return thread
+
+    def _answer(self, snap, p, d, count, lane):
+        res = self.res
+        return {
+            f'pickup_hex{res}': format(p, 'x') if p else None,
+            f'dropoff_hex{res}': format(d, 'x') if d else None,
+            'ride_count': count,
+            'power_lane': lane,
+            'pickup_area_name': snap.names.get(p),
+            'dropoff_area_name': snap.names.get(d),
+        }
+
+    def lookup(self, pickup_lat, pickup_lon, dropoff_lat, dropoff_lon):
+        """Answers one trip with scalar lookups."""
+        snap = self.snapshot
+        p = latlng_to_cell(pickup_lat, pickup_lon, self.res)
+        d = latlng_to_cell(dropoff_lat, dropoff_lon, self.res)
+        return self._answer(snap, p, d, snap.counts.count(p, d), (p, d) in snap.lanes)
+
+    def lookup_many(self, queries):
+        """Answers [(pickup_lat, pickup_lon, dropoff_lat, dropoff_lon), ...] with one batch search per index."""
+        snap = self.snapshot
+        res = self.res
+        p = [latlng_to_cell(q[0], q[1], res) for q in queries]
+        d = [latlng_to_cell(q[2], q[3], res) for q in queries]
+        p_cells, d_cells = np.array(p, dtype=np.uint64), np.array(d, dtype=np.uint64)
+        counts = snap.counts.lookup(p_cells, d_cells).tolist()
+        lanes = snap.lanes.contains(p_cells, d_cells).tolist()
+        return [self._answer(snap, *row) for row in zip(p, d, counts, lanes)]
+
+    def info(self):
+        snap = self.snapshot
+        return {
+            'routes': len(snap.counts),
+            'power_lanes': len(snap.lanes),
+            'named_hexes': len(snap.names),
+            'loaded_at': snap.loaded_at,
+            'files': {path: version[0] for path, version in snap.versions.items()},
+        }
+
+
+def _point(value):
+    lat, _, lon = (value or '').partition(',')
+    try:
+        return float(lat), float(lon)
+    except ValueError:
+        return math.nan, math.nan
+
+
+def _json_point(value):
+    """(lat, lon) from a POST query's [lat, lon]; ValueError unless it is two numbers."""
+    if not (isinstance(value, list) and len(value) == 2
+            and all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in value)):
+        raise ValueError(f"not a [lat, lon] point: {value!r}")
+    lat, lon = map(float, value)
+    return lat, lon
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this, Nagle plus
+    # delayed ACKs add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    routes = None
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # GET /route?pickup=lat,lon&dropoff=lat,lon, or GET /info
+        url = urlparse(self.path)
+        if url.path == '/info':
+            return self._reply(200, self.routes.info())
+        if url.path != '/route':
+            return self._reply(404, {'error': 'not found'})
+        query = parse_qs(url.query)
+        pickup = _point(query.get('pickup', [''])[0])
+        dropoff = _point(query.get('dropoff', [''])[0])
+        self._reply(200, self.routes.lookup(*pickup, *dropoff))
+
+    def do_POST(self):
+        # POST /routes with {"queries": [{"pickup": [lat, lon], "dropoff": [lat, lon]}, ...]}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if urlparse(self.path).path != '/routes':
+            return self._reply(404, {'error': 'not found'})
+        try:
+            queries = [(*_json_point(q['pickup']), *_json_point(q['dropoff'])) for q in json.loads(body)['queries']]
+        except (ValueError, KeyError, TypeError):
+            return self._reply(400, {'error': 'expected {"queries": [{"pickup": [lat, lon], "dropoff": [lat, lon]}, ...]}'})
+        self._reply(200, {'results': self.routes.lookup_many(queries)})
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(routes, port=0):
+    """Serves `routes` in a background thread; returns (server, base url)."""
+    handler = type('RouteHandler', (Handler,), {'routes': routes})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve Hex-8 route lookups from precomputed files.')
+    parser.add_argument('--counts', default='hex8_route_counts.csv', help='Route counts (CSV or route index)')
+    parser.add_argument('--lanes', default='hex8_route_counts_filtered.csv', help='Power lanes (CSV or route index)')
+    parser.add_argument('--names', default='preset_with_names.csv', help='fetch_hex_names.py output with area names')
+    parser.add_argument('--min_rides', type=int, default=5, help='Power-lane threshold if --lanes does not exist')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--reload_secs', type=float, default=5, help='How often to check the files for changes (0 = never)')
+    parser.add_argument('--cpu', type=int, default=None, help='Pin the server to this CPU core (Linux)')
+
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.counts):
+        print(f"Error: {args.counts} not found.")
+        return
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+
+    routes = RouteLookup(args.counts, args.lanes, args.names, args.min_rides)
+    info = routes.info()
+    print(f"Loaded {info['routes']} routes, {info['power_lanes']} power lanes, {info['named_hexes']} named hexes")
+    if args.reload_secs:
+        routes.watch(args.reload_secs)
+
+    server, url = start_server(routes, args.port)
+    print(f"Serving route lookups at {url}/route and {url}/routes (Ctrl+C to stop)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
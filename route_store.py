@@ -0,0 +1,215 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+from functools import partial
+import numpy as np
+import pandas as pd
+from columnar import write_table, read_table
+from route_counts import (
+    count_file, count_pairs, count_routes, expand_inputs, input_exists, merge_counts, counts_to_frame, route_columns,
+)
+from stage_io import write_csv
+from metrics import instrumented, add_arguments, configure, stage
+
+# Persistent route-count store, partitioned by month.
+#
+#   route_store/
+#     manifest.json          resolution + one entry per ingested month
+#     month=2025-11/         (p, d, ride_count) as an npy table, uint64 cells
+#
+# Ingesting a month reads only that month's export; exports read the small
+# per-month count tables, never the raw rides.
+
+MANIFEST = 'manifest.json'
+
+def file_checksum(path, block=1 << 20):
+    """sha256 of a file, read in 1MB blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(block), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def input_checksum(files):
+    """file_checksum of a single export; for shards, a sha256 over their names and checksums."""
+    if len(files) == 1:
+        return file_checksum(files[0])
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(os.path.basename(path).encode() + b'\0' + file_checksum(path).encode())
+    return digest.hexdigest()
+
+def load_manifest(store, resolution=None):
+    path = os.path.join(store, MANIFEST)
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        if resolution is not None and manifest['resolution'] != resolution:
+            raise ValueError(f"{store} holds Hex-{manifest['resolution']} counts, not Hex-{resolution}")
+        return manifest
+    return {'resolution': 8 if resolution is None else resolution, 'partitions': {}}
+
+def save_manifest(store, manifest):
+    # Write then rename, so a crash never leaves a half-written manifest
+    path = os.path.join(store, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def partition_path(store, month):
+    return os.path.join(store, f'month={month}')
+
+def ingest(store, input_csv, month, resolution=None, replace=False, workers=1, chunksize=None):
+    """
+    Counts one month's ride export into the store. Returns the manifest entry,
+    or None if the same file was already ingested for that month.
+    """
+    os.makedirs(store, exist_ok=True)
+    manifest = load_manifest(store, resolution)
+    res = manifest['resolution']
+    files = expand_inputs(input_csv)
+    checksum = input_checksum(files)
+
+    existing = manifest['partitions'].get(month)
+    if existing and existing['sha256'] == checksum:
+        return None
+    if existing and not replace:
+        raise ValueError(f"{month} was ingested from a different file; use --replace to overwrite it")
+
+    counts = count_file(input_csv, partial(count_routes, res=res), workers, chunksize)
+    table = pd.DataFrame({
+        'p': counts.index.get_level_values(0).to_numpy(dtype=np.uint64),
+        'd': counts.index.get_level_values(1).to_numpy(dtype=np.uint64),
+        'ride_count': counts.to_numpy(dtype='int64'),
+    })
+
+    # Build the partition next to the old one and swap it in
+    tmp = partition_path(store, month) + '.tmp'
+    write_table(table, tmp, 'npy')
+    if os.path.exists(partition_path(store, month)):
+        shutil.rmtree(partition_path(store, month))
+    os.replace(tmp, partition_path(store, month))
+
+    entry = {
+        'source': os.path.abspath(input_csv),
+        'sha256': checksum,
+        'bytes': sum(os.path.getsize(f) for f in files),
+        'files': len(files),
+        'rides': int(table['ride_count'].sum()),
+        'routes': len(table),
+        'ingested_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    manifest['partitions'][month] = entry
+    save_manifest(store, manifest)
+    return entry
+
+def select_months(manifest, months=None, last=None, start=None, end=None):
+    """Picks partitions by explicit list, by the latest `last` months, or by a start/end range."""
+    available = sorted(manifest['partitions'])
+    if months:
+        missing = sorted(set(months) - set(available))
+        if missing:
+            raise ValueError(f"Months not in the store: {', '.join(missing)}")
+        return sorted(months)
+    selected = [m for m in available if (start is None or m >= start) and (end is None or m <= end)]
+    return selected[-last:] if last else selected
+
+def load_window(store, months):
+    """Sums the route counts of the given months."""
+    total = None
+    for month in months:
+        table = read_table(partition_path(store, month))
+        counts = table.set_index(['p', 'd'])['ride_count']
+        total = merge_counts(total, counts)
+    if total is None:
+        total = count_pairs(np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.uint64))
+    return total
+
+@instrumented('route_store')
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Month-partitioned store of hex route counts.')
+    parser.add_argument('--store', default='route_store', help='Store directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('ingest', help='Add one month of rides (skipped if already ingested)')
+    p.add_argument('input_csv', help='Ride export for the month (query.sql output; a CSV, or a directory or glob of shards)')
+    p.add_argument('--month', required=True, help='Month the export covers, as YYYY-MM')
+    p.add_argument('--resolution', type=int, default=None, help='H3 resolution (fixed when the store is created; default 8)')
+    p.add_argument('--replace', action='store_true', help='Re-ingest a month whose export changed')
+    p.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    p.add_argument('--workers', type=int, default=1, help='Count shards of the input in this many processes')
+
+    p = commands.add_parser('export', help='Write route counts for a window of months')
+    p.add_argument('output_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='Output summary')
+    p.add_argument('--months', nargs='+', default=None, help='Exact months to include')
+    p.add_argument('--last', type=int, default=None, help='Only the latest N months (e.g. 3 for a rolling quarter)')
+    p.add_argument('--start', default=None, help='First month to include (YYYY-MM)')
+    p.add_argument('--end', default=None, help='Last month to include (YYYY-MM)')
+    p.add_argument('--min_rides', type=int, default=5, help='Minimum number of rides to keep a route')
+
+    commands.add_parser('list', help='Show ingested months')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
+
+    if args.command == 'ingest':
+        if not input_exists(args.input_csv):
+            print(f"Error: {args.input_csv} not found.")
+            return
+        # Zero-padded so that months sort correctly as strings
+        if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', args.month):
+            print(f"Error: --month must look like 2025-11, not {args.month!r}.")
+            return
+        print(f"Ingesting {args.input_csv} as {args.month}...")
+        try:
+            entry = ingest(args.store, args.input_csv, args.month, args.resolution, args.replace,
+                           args.workers, args.chunksize)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if entry is None:
+            print(f"{args.month} is already ingested from this file, nothing to do.")
+        else:
+            print(f"Stored {entry['rides']} rides on {entry['routes']} routes for {args.month}.")
+
+    elif args.command == 'export':
+        manifest = load_manifest(args.store)
+        try:
+            months = select_months(manifest, args.months, args.last, args.start, args.end)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if not months:
+            print("Error: no ingested months match.")
+            return
+        res = manifest['resolution']
+        print(f"Combining {len(months)} months: {', '.join(months)}...")
+        route_counts = counts_to_frame(load_window(args.store, months), *route_columns(res))
+
+        # Same filter and ordering as test_hex8_routes_filtered.py
+        initial_count = len(route_counts)
+        with stage('filter', rows_in=initial_count) as s:
+            route_counts = route_counts[route_counts['ride_count'] >= args.min_rides]
+            route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+            s.rows_out = len(route_counts)
+
+        print(f"Hex-{res} Results:")
+        print(f"- Total unique routes found: {initial_count}")
+        print(f"- Routes remaining after filtering (>= {args.min_rides} rides): {len(route_counts)}")
+        write_csv(route_counts, args.output_csv)
+        print(f"Saved filtered results to {args.output_csv}")
+
+    else:
+        manifest = load_manifest(args.store)
+        print(f"Hex-{manifest['resolution']} store at {args.store}:")
+        for month, entry in sorted(manifest['partitions'].items()):
+            print(f"  {month}: {entry['rides']} rides, {entry['routes']} routes, from {entry['source']} ({entry['ingested_at']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+CSV reads and writes shared by the stage scripts.
+
+Run on their own, the scripts read and write files as usual. When several
+stages run in one process (see pipeline.py), keep_in_memory() makes every
+CSV a stage writes available to the next stage without parsing it again.
+The file is still written, so a later run can pick up from it.
+"""
+import os
+import pandas as pd
+from metrics import stage
+
+_frames = {}
+_enabled = False
+
+
+def keep_in_memory(enabled=True):
+    """Turns passing written frames to later readers on or off (off clears the memo)."""
+    global _enabled
+    _enabled = enabled
+    if not enabled:
+        _frames.clear()
+
+
+def _key(path):
+    path = os.path.abspath(path)
+    return path, os.stat(path).st_mtime_ns
+
+
+def write_csv(df, path):
+    """df.to_csv(path, index=False), remembering the frame for in-process readers."""
+    with stage('write', rows_in=len(df)) as s:
+        df.to_csv(path, index=False)
+        s.rows_out = len(df)
+    if _enabled:
+        # Readers get what read_csv would give them: a fresh 0..n-1 index
+        _frames[_key(path)] = df.reset_index(drop=True)
+
+
+def read_csv(path, usecols=None):
+    """pd.read_csv(path), or a copy of the frame written there earlier in this process."""
+    with stage('read') as s:
+        df = _frames.get(_key(path)) if _enabled else None
+        if df is not None:
+            df = (df if usecols is None else df[list(usecols)]).copy()
+        else:
+            # round_trip parses floats back to exactly what was written, so a
+            # frame read from disk matches the one handed on in memory
+            df = pd.read_csv(path, usecols=usecols, float_precision='round_trip')
+        s.rows_out = len(df)
+    return df
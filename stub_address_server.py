@@ -0,0 +1,103 @@
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import h3
+from h3.api import basic_int as h3_int
+
+# Supports both h3-py v3 and v4
+if hasattr(h3, 'latlng_to_cell'):
+    latlng_to_cell, cell_to_parent = h3_int.latlng_to_cell, h3_int.cell_to_parent
+else:
+    latlng_to_cell, cell_to_parent = h3_int.geo_to_h3, h3_int.h3_to_parent
+
+# Stand-in for the short-address API, for trying the naming stages offline.
+# Names are derived from the res-7 parent of each point so that neighbouring
+# hexes share a name, like real area names do. Every 20th parent has no name.
+
+stats = {'requests': 0, 'locations': 0}
+stats_lock = threading.Lock()
+
+def fake_address(lat, lon, res=7):
+    try:
+        parent = cell_to_parent(latlng_to_cell(lat, lon, 8), res)
+    except Exception:
+        return None
+    if (parent >> 12) % 20 == 0:
+        return None
+    return f"Area {parent:x}"
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            request = json.loads(body)
+        except ValueError:
+            self.send_response(400)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        # Same shape as the real API: {"<key>": {"location": {...}}} in, keyed answers out
+        response = {}
+        for key, item in request.items():
+            loc = item.get('location', {})
+            address = fake_address(loc.get('lat'), loc.get('lon'))
+            response[key] = {'short_address': {'en': address or ''}}
+
+        with stats_lock:
+            stats['requests'] += 1
+            stats['locations'] += len(request)
+
+        data = json.dumps(response).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        # GET /stats reports how many requests and locations were served
+        with stats_lock:
+            data = json.dumps(stats).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start_server(port=0, latency_ms=0):
+    """Starts the stub in a background thread; returns (server, url)."""
+    handler = type('StubHandler', (Handler,), {'latency': latency_ms / 1000.0})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1/shortaddress"
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the short-address API.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency_ms', type=float, default=0, help='Delay added to every request')
+
+    args = parser.parse_args()
+
+    server, url = start_server(args.port, args.latency_ms)
+    print(f"Serving fake short addresses at {url} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -1,52 +1,64 @@
-import pandas as pd
-import h3
 import argparse
-import os
-
-def get_hex_safe(lat, lng, res):
-    """Converts lat/lng to H3 index."""
-    try:
-        if hasattr(h3, 'latlng_to_cell'):
-            return h3.latlng_to_cell(lat, lng, res)
-        return h3.geo_to_h3(lat, lng, res)
-    except:
-        return None
-
-def main():
+from functools import partial
+from route_counts import count_file, count_routes, counts_to_frame, input_exists
+from stage_io import write_csv
+from od_matrix import save_od_matrix
+from partitioned import save_partitioned, DEFAULT_PARTITION_RES
+from metrics import instrumented, add_arguments, configure, stage
+
+@instrumented('test_hex8_rides')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Test ride counts at Hex Resolution 8.')
-    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data')
+    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data (a CSV, or a directory or glob of shards, optionally compressed)')
     parser.add_argument('output_csv', nargs='?', default='hex8_route_counts.csv', help='Output summary')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    parser.add_argument('--workers', type=int, default=1, help='Count shards of the input in this many processes')
+    parser.add_argument('--od_matrix', default=None, help='Also save the counts as a sparse OD matrix to this directory (see od_matrix.py)')
+    parser.add_argument('--ids_from', default=None, help='With --od_matrix, keep the hex ids of this earlier matrix')
+    parser.add_argument('--partitioned', default=None, help='Also write the routes to this directory, partitioned by the pickup hex parent (see partitioned.py)')
+    parser.add_argument('--partition_res', type=int, default=DEFAULT_PARTITION_RES, help='Resolution of the pickup parent hexes that key the partitions')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
     
-    args = parser.parse_args()
-    
-    if not os.path.exists(args.input_csv):
+    if not input_exists(args.input_csv):
         print(f"Error: {args.input_csv} not found.")
         return
 
     print(f"Reading {args.input_csv}...")
-    df = pd.read_csv(args.input_csv)
 
     # Use Resolution 8 for testing
     RES = 8
+    if args.partitioned and not 0 <= args.partition_res <= RES:
+        print(f"Error: --partition_res must be between 0 and {RES}.")
+        return
 
-    print(f"Processing coordinates into Hex-{RES}...")
+    print(f"Processing coordinates into Hex-{RES} and aggregating counts...")
     
-    # Calculate hexes on the fly
-    df['p_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'])]
-    df['d_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'])]
+    # Calculate hexes on the fly, group and count (shards in parallel with --workers)
+    counts = count_file(args.input_csv, partial(count_routes, res=RES), args.workers, args.chunksize)
 
-    print("Aggregating counts...")
-    # Group and count
-    route_counts = df.groupby(['p_hex8', 'd_hex8']).size().reset_index(name='ride_count')
+    if args.od_matrix:
+        matrix = save_od_matrix(counts, args.od_matrix, RES, args.ids_from)
+        print(f"Saved the {matrix.shape[0]}-hex OD matrix to {args.od_matrix}")
     
     # Sort by busiest routes
-    route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+    with stage('sort', rows_in=len(counts)) as s:
+        route_counts = counts_to_frame(counts, 'p_hex8', 'd_hex8')
+        route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+        s.rows_out = len(route_counts)
 
     print(f"Hex-8 Test Results: Found {len(route_counts)} unique routes.")
     print(f"Busiest Hex-8 route has {route_counts['ride_count'].max()} rides.")
 
-    route_counts.to_csv(args.output_csv, index=False)
+    write_csv(route_counts, args.output_csv)
     print(f"Saved test results to {args.output_csv}")
 
+    if args.partitioned:
+        manifest = save_partitioned(route_counts, args.partitioned, 'p_hex8', args.partition_res)
+        print(f"Saved {len(manifest['partitions'])} Hex-{args.partition_res} partitions to {args.partitioned}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,59 +1,162 @@
-import pandas as pd
-import h3
 import argparse
+import json
 import os
+from functools import partial
+from hex_index import get_resolution
+from route_counts import count_file, count_routes, counts_to_frame, input_exists, read_counts_csv, rollup_counts, RIDE_COLS
+from heavy_hitters import sketch_routes, validate
+from od_cube import ODCube, count_cube, TIME_COL
+from stage_io import write_csv
+from partitioned import save_partitioned, DEFAULT_PARTITION_RES
+from metrics import instrumented, add_arguments, configure, stage
 
-def get_hex_safe(lat, lng, res):
-    """Converts lat/lng to H3 index safely."""
-    try:
-        if hasattr(h3, 'latlng_to_cell'):
-            return h3.latlng_to_cell(lat, lng, res)
-        return h3.geo_to_h3(lat, lng, res)
-    except:
-        return None
-
-def main():
+@instrumented('test_hex8_routes_filtered')
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Aggregate Hex-8 routes and filter low-volume paths.')
-    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data')
+    parser.add_argument('input_csv', nargs='?', default='big-data.csv', help='Original ride data (a CSV, or a directory or glob of shards, optionally compressed)')
     parser.add_argument('output_csv', nargs='?', default='hex8_route_counts_filtered.csv', help='Output summary')
     parser.add_argument('--min_rides', type=int, default=5, help='Minimum number of rides to keep a route')
+    parser.add_argument('--chunksize', type=int, default=0, help='Stream the input this many rows at a time (0 = read it all at once)')
+    parser.add_argument('--workers', type=int, default=1, help='Count shards of the input in this many processes')
+    parser.add_argument('--route_counts', default=None, help='Filter an existing Hex-8 route-count CSV, e.g. hex8_route_counts.csv, instead of re-reading the rides')
+    parser.add_argument('--allow_rollup', action='store_true', help='Accept a finer --route_counts table and roll it up to Hex-8 (saved as *_rollup.csv; rolled-up routes differ from directly indexed ones)')
+    parser.add_argument('--top_k', type=int, default=None, help='Only keep the K busiest routes (after --min_rides)')
+    parser.add_argument('--approx', action='store_true', help='Find the heavy routes with fixed-memory sketches instead of counting every route')
+    parser.add_argument('--capacity', type=int, default=100_000, help='With --approx, candidate routes kept (counts are off by at most rides / capacity)')
+    parser.add_argument('--sketch_width', type=int, default=1 << 20, help='With --approx, Count-Min counters per row')
+    parser.add_argument('--sketch_depth', type=int, default=4, help='With --approx, Count-Min rows')
+    parser.add_argument('--validate', action='store_true', help='With --approx, also count exactly and report recall and count errors')
+    parser.add_argument('--report', default=None, help='Write the --validate report here as JSON')
+    parser.add_argument('--cube', default=None, help='Also save route counts by hour and weekday/weekend to this directory (see od_cube.py)')
+    parser.add_argument('--partitioned', default=None, help='Also write the routes to this directory, partitioned by the pickup hex parent (see partitioned.py)')
+    parser.add_argument('--partition_res', type=int, default=DEFAULT_PARTITION_RES, help='Resolution of the pickup parent hexes that key the partitions')
+
+    add_arguments(parser)
+
+    args = parser.parse_args(argv)
+    configure(args)
     
-    args = parser.parse_args()
-    
-    if not os.path.exists(args.input_csv):
-        print(f"Error: {args.input_csv} not found.")
+    source = args.route_counts or args.input_csv
+    if not input_exists(source):
+        print(f"Error: {source} not found.")
+        return
+    if (args.approx or args.cube) and args.route_counts:
+        print("Error: --approx and --cube read the rides; they cannot be used with --route_counts.")
+        return
+    if args.approx and args.cube:
+        print("Error: --cube needs exact counts; it cannot be used with --approx.")
         return
 
-    print(f"Reading {args.input_csv}...")
-    df = pd.read_csv(args.input_csv)
+    print(f"Reading {source}...")
 
     RES = 8
-    print(f"Processing coordinates into Hex-{RES}...")
+    if args.partitioned and not 0 <= args.partition_res <= RES:
+        print(f"Error: --partition_res must be between 0 and {RES}.")
+        return
+    sketch = None
+    rolled_from = None
+    if args.route_counts:
+        # Counts are already aggregated; only the threshold is applied here
+        counts = read_counts_csv(args.route_counts)
+        base_res = int(get_resolution(counts.index.get_level_values(0)[:1])[0]) if len(counts) else RES
+        if base_res < RES:
+            print(f"Error: {args.route_counts} is Hex-{base_res}; it cannot produce Hex-{RES} routes.")
+            return
+        if base_res > RES and not args.allow_rollup:
+            print(f"Error: {args.route_counts} is Hex-{base_res}; rolled-up Hex-{RES} routes differ from directly "
+                  f"indexed ones. Pass --allow_rollup to use it anyway.")
+            return
+        if base_res != RES:
+            # Kept apart from the directly indexed power lanes
+            root, ext = os.path.splitext(args.output_csv)
+            args.output_csv = f'{root}_rollup{ext}'
+            if args.partitioned:
+                args.partitioned = args.partitioned.rstrip('/\\') + '_rollup'
+            print(f"Rolling Hex-{base_res} counts up to Hex-{RES} (saved as {args.output_csv})...")
+            counts = rollup_counts(counts, RES)
+            rolled_from = base_res
+    elif args.approx:
+        # Streamed in chunks so memory stays at the sketches plus one chunk
+        chunksize = args.chunksize or 1_000_000
+        print(f"Sketching Hex-{RES} routes ({args.capacity} candidates, "
+              f"{args.sketch_depth}x{args.sketch_width} Count-Min)...")
+        count_fn = partial(sketch_routes, res=RES, capacity=args.capacity,
+                           width=args.sketch_width, depth=args.sketch_depth)
+        sketch = count_file(args.input_csv, count_fn, args.workers, chunksize)
+        counts = sketch.heavy_routes(args.min_rides, args.top_k)
+    elif args.cube:
+        print(f"Processing coordinates and {TIME_COL} into Hex-{RES} counts by hour and day type...")
+        try:
+            cube_counts = count_file(args.input_csv, partial(count_cube, res=RES), args.workers, args.chunksize,
+                                     usecols=RIDE_COLS + (TIME_COL,))
+        except ValueError as e:
+            print(f"Error: {e} (re-export the rides with the current query.sql)")
+            return
+        cube = ODCube.from_counts(cube_counts, RES)
+        cube.save(args.cube)
+        print(f"Saved {len(cube)} routes in {len(cube.route)} hour/day-type entries to {args.cube}")
+        # The flat table is the cube's all-time slice
+        counts = cube.slice()
+    else:
+        print(f"Processing coordinates into Hex-{RES} and aggregating counts...")
+        # Calculate hexes, group and count (per shard when --workers > 1)
+        counts = count_file(args.input_csv, partial(count_routes, res=RES), args.workers, args.chunksize)
     
-    # Calculate hexes
-    df['p_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_pickup_latitude'], df['estimated_pickup_longitude'])]
-    df['d_hex8'] = [get_hex_safe(lat, lng, RES) for lat, lng in zip(df['estimated_dropoff_latitude'], df['estimated_dropoff_longitude'])]
+    with stage('filter', rows_in=len(counts)) as s:
+        route_counts = counts_to_frame(counts, 'p_hex8', 'd_hex8')
 
-    print("Aggregating counts...")
-    # Group and count
-    route_counts = df.groupby(['p_hex8', 'd_hex8']).size().reset_index(name='ride_count')
-    
-    # --- FILTER LOGIC ---
-    initial_count = len(route_counts)
-    route_counts = route_counts[route_counts['ride_count'] >= args.min_rides]
-    filtered_count = len(route_counts)
-    # --------------------
+        # --- FILTER LOGIC ---
+        initial_count = len(route_counts)
+        route_counts = route_counts[route_counts['ride_count'] >= args.min_rides]
+        filtered_count = len(route_counts)
+        # --------------------
 
-    # Sort by busiest routes
-    route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+        # Sort by busiest routes
+        route_counts = route_counts.sort_values(by='ride_count', ascending=False)
+        if args.top_k is not None:
+            route_counts = route_counts.head(args.top_k)
+            filtered_count = len(route_counts)
+        s.rows_out = filtered_count
 
-    print(f"Hex-8 Results:")
-    print(f"- Total unique routes found: {initial_count}")
-    print(f"- Routes remaining after filtering (>= {args.min_rides} rides): {filtered_count}")
-    print(f"- Reduction: {initial_count - filtered_count} low-volume routes removed.")
+    print(f"Hex-8 Results (rolled up from Hex-{rolled_from}):" if rolled_from else f"Hex-8 Results:")
+    if sketch is not None:
+        bounds = sketch.bounds(args.min_rides)
+        print(f"- Rides sketched: {bounds['rides']} into {bounds['sketch_mb']:.1f} MB")
+        print(f"- Heavy routes found: {filtered_count}")
+        print(f"- Counts are upper bounds, at most {bounds['space_saving_max_overcount']:.1f} rides too high "
+              f"(Count-Min: {bounds['count_min_max_overcount']:.1f} with {bounds['count_min_confidence']:.1%} confidence)")
+        if bounds['complete']:
+            print(f"- Complete: every route with >= {args.min_rides} rides is included")
+        else:
+            print(f"- Warning: routes with up to {bounds['floor']} rides may be missing; raise --capacity for a complete result")
+    else:
+        print(f"- Total unique routes found: {initial_count}")
+        print(f"- Routes remaining after filtering (>= {args.min_rides} rides): {filtered_count}")
+        print(f"- Reduction: {initial_count - filtered_count} low-volume routes removed.")
 
-    route_counts.to_csv(args.output_csv, index=False)
+    write_csv(route_counts, args.output_csv)
     print(f"Saved filtered results to {args.output_csv}")
 
+    if args.partitioned:
+        manifest = save_partitioned(route_counts, args.partitioned, 'p_hex8', args.partition_res)
+        print(f"Saved {len(manifest['partitions'])} Hex-{args.partition_res} partitions to {args.partitioned}")
+
+    if sketch is not None and args.validate:
+        print("Validating against exact counts (second pass)...")
+        exact = count_file(args.input_csv, partial(count_routes, res=RES), args.workers, args.chunksize or 1_000_000)
+        report = validate(sketch, exact, args.min_rides, args.top_k)
+        print("\n--- Sketch validation ---")
+        print(f"Exact table:   {report['exact_routes']} routes, {report['exact_table_mb']:.1f} MB "
+              f"(sketch {report['sketch_mb']:.1f} MB)")
+        print(f"Route set:     recall {report['recall']:.2%}, precision {report['precision']:.2%} "
+              f"({report['missed']} missed, {report['false_positives']} extra of {report['true_routes']} true)")
+        print(f"Counts:        {report['exact_counts']} of {report['found_routes']} exact, "
+              f"overcount max {report['max_overcount']} / mean {report['mean_overcount']:.2f}")
+        print(f"Bounds held:   {report['bounds_held']}")
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=1)
+            print(f"Saved validation report to {args.report}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file